@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+""" Piezo alarm driver with a fast path and timed patterns """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import logging
+from Adafruit_GPIO import GPIO
+
+import metrics
+
+import timesource
+
+# piezo patterns as (level, seconds) steps repeated until the alarm is reset
+STEADY = ((GPIO.HIGH, 0.0),)
+FIRE_PATTERN = ((GPIO.HIGH, 0.5), (GPIO.LOW, 0.5))
+PANIC_PATTERN = ((GPIO.HIGH, 0.1), (GPIO.LOW, 0.1), (GPIO.HIGH, 0.1), (GPIO.LOW, 0.7))
+
+LOGGER = logging.getLogger(__name__)
+
+class AlarmController:
+    """ alarm piezo device driver
+
+        sound_alarm drives the pin before anything else so the buzzer reacts
+        within one GPIO write of the MQTT callback. Patterns are stepped by a
+        daemon thread against monotonic deadlines and never block the caller. """
+
+    def __init__(self, pin, gpio=None):
+        """ control output to pin 4  """
+        if gpio is None:
+            gpio = GPIO.get_platform_gpio()
+        self.gpio = gpio
+        self.pin = pin
+        self.gpio.setup(self.pin, GPIO.OUT)
+        self.gpio.output(self.pin, GPIO.LOW)
+        self.level = GPIO.LOW
+        self.pattern = STEADY
+        self.generation = 0
+        self.wake = timesource.event()
+        self.latency = metrics.LatencyStats("alarm_latency")
+        self.pattern_thread = timesource.spawn(self.run_pattern)
+
+    def sound_alarm(self, turn_on, pattern=STEADY, received=None):
+        """ turn power to piexo on or off; received is the monotonic arrival time """
+        if turn_on:
+            self.gpio.output(self.pin, GPIO.HIGH)
+            self.level = GPIO.HIGH
+        else:
+            self.gpio.output(self.pin, GPIO.LOW)
+            self.level = GPIO.LOW
+        if received is not None:
+            self.latency.record(time.monotonic() - received)
+        self.pattern = pattern if turn_on else STEADY
+        self.generation += 1
+        self.wake.set()
+
+    def reset(self,):
+        """ turn power to piexo off """
+        self.sound_alarm(False)
+
+    def run_pattern(self,):
+        """ step the current pattern until the alarm changes """
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            generation = self.generation
+            pattern = self.pattern
+            # settle on the latest requested level in case a step raced a change
+            self.gpio.output(self.pin, self.level)
+            if len(pattern) < 2:
+                continue
+            deadline = timesource.monotonic() + pattern[0][1]
+            step = 1
+            while not self.wake.wait(max(0.0, deadline - timesource.monotonic())):
+                level, seconds = pattern[step]
+                if generation != self.generation:
+                    break
+                self.gpio.output(self.pin, level)
+                deadline += seconds
+                step = (step + 1) % len(pattern)
+
+if __name__ == '__main__':
+    import simulatedhw
+    SIMULATED = simulatedhw.SimulatedGPIO()
+    ALARM = AlarmController(4, SIMULATED)
+    for _ in range(100):
+        ARRIVAL = time.monotonic()
+        ALARM.sound_alarm(True, PANIC_PATTERN, ARRIVAL)
+        time.sleep(0.01)
+        ALARM.sound_alarm(False)
+    ARRIVAL = time.monotonic()
+    ALARM.sound_alarm(True, FIRE_PATTERN, ARRIVAL)
+    time.sleep(2.2)
+    ALARM.reset()
+    TOGGLES = [stamp - ARRIVAL for stamp, pin, level in SIMULATED.events if stamp >= ARRIVAL]
+    print(ALARM.latency.summary())
+    print("fire pattern edges (s):", ["%.3f" % toggle for toggle in TOGGLES])
+    sys.exit()
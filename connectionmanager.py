@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+
+""" MQTT connection state machine with jittered exponential backoff """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import random
+import logging
+from threading import Lock
+
+import metrics
+
+import timesource
+
+import watchdog
+
+# connection states
+DISCONNECTED = 0
+CONNECTING = 1
+CONNECTED = 2
+BACKOFF = 3
+
+STATE_NAMES = ("disconnected", "connecting", "connected", "backoff")
+
+# seconds to wait before the first reconnect attempt
+INITIAL_BACKOFF = 1.0
+
+# backoff doubles on every consecutive failure up to this ceiling
+MAXIMUM_BACKOFF = 60.0
+
+# each backoff sleep is randomised by up to this fraction either way
+BACKOFF_JITTER = 0.25
+
+# seconds allowed between a TCP connect and the broker's CONNACK
+CONNACK_SECONDS = 10.0
+
+# seconds each network loop call may block
+LOOP_SECONDS = 1.0
+
+# network loop time allowed on top of LOOP_SECONDS before the heartbeat is late
+LOOP_SLACK = 1.0
+
+LOGGER = logging.getLogger(__name__)
+
+def valid_topic(topic):
+    """ a topic paho will publish to: not empty and without wildcards """
+    return bool(topic) and '+' not in topic and '#' not in topic
+
+class ConnectionManager:
+    """ own the connect, network loop and reconnect of one MQTT client
+
+        Connecting happens on a background thread so the displays and alarm
+        start without waiting for the broker, and a broker that is down at
+        boot is retried instead of raising. Retained publications made while
+        offline are kept, latest per topic, and sent once connected; others
+        are counted and dropped. """
+
+    def __init__(self, client, host, port=1883, keepalive=60, name="mqtt"):
+        """ client is a paho client or a localbroker.LocalClient with callbacks assigned;
+            name tells the heartbeat and metrics of several connections apart """
+        #pylint: disable=too-many-arguments
+        self.client = client
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.state = DISCONNECTED
+        self.backoff = INITIAL_BACKOFF
+        self.attempts = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.callback_errors = 0
+        self.pending = {}
+        self.lock = Lock()
+        self.started = None
+        self.down_since = None
+        self.first_connect = metrics.LatencyStats(name + "_first_connect")
+        self.reconnect = metrics.LatencyStats(name + "_reconnect")
+        self.heartbeat = watchdog.Heartbeat(name)
+        self.connected_event = timesource.event()
+        self.app_on_connect = None
+        self.app_on_disconnect = None
+        self.thread = None
+
+    def set_state(self, state):
+        """ record and log a state change """
+        if state != self.state:
+            LOGGER.info('MQTT %s -> %s', STATE_NAMES[self.state], STATE_NAMES[state])
+            self.state = state
+            if state == CONNECTED:
+                self.connected_event.set()
+            else:
+                self.connected_event.clear()
+
+    def connected(self,):
+        """ True once the broker has acknowledged the connection """
+        return self.state == CONNECTED
+
+    def wait_connected(self, timeout=None):
+        """ block until connected; False if the timeout expires first """
+        return self.connected_event.wait(timeout)
+
+    def on_connect(self, client, userdata, flags, rcdata):
+        """ CONNACK: time the outage, let the application subscribe, then flush """
+        if rcdata != 0:
+            LOGGER.error('MQTT connection refused, code %s', rcdata)
+            return
+        now = timesource.monotonic()
+        if self.first_connect.count == 0:
+            self.first_connect.record(now - self.started)
+        elif self.down_since is not None:
+            self.reconnect.record(now - self.down_since)
+            LOGGER.info('MQTT reconnected after %.1f seconds', now - self.down_since)
+        self.down_since = None
+        self.backoff = INITIAL_BACKOFF
+        self.set_state(CONNECTED)
+        if self.app_on_connect is not None:
+            self.app_on_connect(client, userdata, flags, rcdata)
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        for topic, (payload, qos) in pending.items():
+            try:
+                client.publish(topic, payload, qos, True)
+            except (ValueError, TypeError, OSError) as ex:
+                # on the network thread inside CONNACK: one bad entry must not stop the rest
+                self.dropped += 1
+                LOGGER.error('MQTT pending publish to %r failed: %s', topic, str(ex))
+
+    def on_disconnect(self, client, userdata, rcdata):
+        """ start timing the outage; the manager thread reconnects """
+        if self.down_since is None:
+            self.down_since = timesource.monotonic()
+        self.set_state(DISCONNECTED)
+        if self.app_on_disconnect is not None:
+            self.app_on_disconnect(client, userdata, rcdata)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """ publish now, keep a retained message for later, or drop; True if sent
+
+            Empty and wildcard topics, e.g. the motion topic before the setup
+            message arrives, are rejected rather than raised or kept. """
+        if not valid_topic(topic):
+            self.rejected += 1
+            LOGGER.error('MQTT publish to invalid topic %r rejected', topic)
+            return False
+        if self.state == CONNECTED:
+            self.client.publish(topic, payload, qos, retain)
+            return True
+        if retain:
+            with self.lock:
+                self.pending[topic] = (payload, qos)
+        else:
+            self.dropped += 1
+        return False
+
+    def connect(self,):
+        """ one TCP connect; True when the broker can now be serviced """
+        self.set_state(CONNECTING)
+        self.attempts += 1
+        try:
+            return not self.client.connect(self.host, self.port, self.keepalive)
+        except (OSError, ValueError) as ex:
+            LOGGER.info('MQTT connect to %s failed: %s', self.host, str(ex))
+            return False
+
+    def service(self,):
+        """ run the network loop until the connection is lost or CONNACK never comes
+
+            paho re-raises a callback's exception out of loop(), so a malformed
+            message is logged and counted rather than ending the thread. """
+        connecting = timesource.monotonic()
+        while self.state in (CONNECTING, CONNECTED):
+            self.heartbeat.beat(LOOP_SECONDS + LOOP_SLACK)
+            try:
+                rcdata = self.client.loop(LOOP_SECONDS)
+            #pylint: disable=broad-except
+            except Exception as ex:
+                self.callback_errors += 1
+                LOGGER.error('MQTT callback failed: %s', repr(ex))
+                continue
+            if rcdata:
+                break
+            if self.state == CONNECTING and timesource.monotonic() - connecting > CONNACK_SECONDS:
+                LOGGER.info('MQTT no CONNACK from %s', self.host)
+                self.client.disconnect()
+                break
+        if self.down_since is None:
+            self.down_since = timesource.monotonic()
+        self.set_state(DISCONNECTED)
+
+    def wait_backoff(self,):
+        """ sleep a jittered, doubling delay before the next attempt """
+        self.failures += 1
+        self.set_state(BACKOFF)
+        delay = self.backoff * random.uniform(1.0 - BACKOFF_JITTER, 1.0 + BACKOFF_JITTER)
+        self.backoff = min(self.backoff * 2.0, MAXIMUM_BACKOFF)
+        self.heartbeat.beat(delay + LOOP_SLACK)
+        timesource.sleep(delay)
+
+    def connection_thread(self,):
+        """ connect, service until lost, back off, forever """
+        while True:
+            if self.connect():
+                self.service()
+            self.wait_backoff()
+
+    def attach(self,):
+        """ hook the client callbacks, e.g. for a harness that connects the client itself """
+        self.app_on_connect = self.client.on_connect
+        self.app_on_disconnect = self.client.on_disconnect
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.started = timesource.monotonic()
+
+    def start(self,):
+        """ hook the client callbacks and start connecting in the background """
+        if self.started is None:
+            self.attach()
+        self.thread = timesource.spawn(self.connection_thread)
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        return {"state": STATE_NAMES[self.state], "attempts": self.attempts,
+                "failures": self.failures, "dropped": self.dropped, "rejected": self.rejected,
+                "callback_errors": self.callback_errors,
+                "pending": len(self.pending), "backoff": self.backoff,
+                "first_connect": self.first_connect.summary(),
+                "reconnect": self.reconnect.summary()}
+
+def outage_demo(boot_outage=2.0, outages=5, longest=3.0):
+    """ first frame and reconnect times against a local broker that goes away
+
+        The broker is down at boot for boot_outage seconds, then drops the
+        connection outages times for up to longest seconds each. """
+    #pylint: disable=import-outside-toplevel
+    import time
+    import simulatedhw
+    simulatedhw.install()
+    import localbroker
+
+    class OutageClient(localbroker.LocalClient):
+        """ refuses to connect while the broker is down """
+        down = True
+
+        def connect(self, host="localhost", port=1883, keepalive=60):
+            """ connection refused during an outage """
+            if self.down:
+                raise ConnectionRefusedError("simulated broker outage")
+            return localbroker.LocalClient.connect(self, host, port, keepalive)
+
+        def loop(self, timeout=1.0):
+            """ paho returns non-zero once the connection is gone """
+            localbroker.LocalClient.loop(self, timeout)
+            return 0 if self.connected else 1
+
+    started = time.monotonic()
+    import diyclock
+    client = OutageClient(localbroker.LocalBroker(), "diyclock")
+    client.on_connect = diyclock.on_connect
+    client.on_message = diyclock.on_message
+    manager = diyclock.create_connection(client)
+    manager.start()
+    matrix = simulatedhw.BACKPACKS[diyclock.CONFIG.matrix8x8_addr]
+    while not matrix.frames:
+        time.sleep(0.001)
+    first_frame = time.monotonic() - started
+    time.sleep(boot_outage)
+    client.down = False
+    broker_up = time.monotonic() - manager.started
+    manager.wait_connected()
+    late = metrics.LatencyStats("reconnect_after_outage")
+    for _ in range(outages):
+        client.down = True
+        client.disconnect()
+        time.sleep(random.uniform(0.1, longest))
+        client.down = False
+        restored = time.monotonic()
+        manager.wait_connected()
+        late.record(time.monotonic() - restored)
+    return {"first_frame": first_frame, "broker_up": broker_up, "manager": manager.summary(),
+            "after_outage": late.summary()}
+
+if __name__ == '__main__':
+    RESULT = outage_demo()
+    print("first frame {0:.3f} s with the broker down".format(RESULT["first_frame"]))
+    print("first connect {0:.2f} s after start, broker up after {1:.2f} s".format(
+        RESULT["manager"]["first_connect"]["last"], RESULT["broker_up"]))
+    print("reconnect mean {0:.2f} s max {1:.2f} s, of which waiting after the broker "
+          "returned mean {2:.2f} s max {3:.2f} s".format(
+              RESULT["manager"]["reconnect"]["mean"], RESULT["manager"]["reconnect"]["max"],
+              RESULT["after_outage"]["mean"], RESULT["after_outage"]["max"]))
+    sys.exit()
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+""" Shared I2C device health supervisor with backoff and recovery """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import random
+import logging
+
+import metrics
+
+import timesource
+
+# seconds to wait before the first re-initialisation attempt
+INITIAL_BACKOFF = 0.5
+
+# backoff doubles on every consecutive failure up to this ceiling, short enough
+# that a reseated cable is back within seconds; it runs on the display thread
+MAXIMUM_BACKOFF = 4.0
+
+# each backoff sleep is randomised by up to this fraction either way
+BACKOFF_JITTER = 0.25
+
+# failures tolerated before the I2C bus itself is reopened
+ERROR_BUDGET = 5
+
+# seconds of uninterrupted success that restore the full error budget
+BUDGET_RESET_SECONDS = 60.0
+
+LOGGER = logging.getLogger(__name__)
+
+def reopen_bus(device):
+    """ replace the I2C handle of an Adafruit HT16K33 backpack """
+    #pylint: disable=protected-access
+    from Adafruit_GPIO import I2C
+    address = device._device._address
+    device._device = I2C.get_i2c_device(address)
+
+class DeviceHealth:
+    """ error budget, backoff and recovery timing for one I2C device """
+
+    def __init__(self, name, device, restore=None):
+        """ device must provide begin(); restore reapplies settings after begin """
+        self.name = name
+        self.device = device
+        self.restore = restore
+        self.errors = 0
+        self.failures = 0
+        self.backoff = INITIAL_BACKOFF
+        self.failed_since = None
+        self.healthy_since = timesource.monotonic()
+        self.recovery = metrics.LatencyStats(name + "_recovery")
+
+    def longest_delay(self,):
+        """ upper bound of the sleep the next failure() will take """
+        return self.backoff * (1.0 + BACKOFF_JITTER)
+
+    def success(self,):
+        """ called after every good write; closes an outage, resetting the backoff,
+            and refills the budget once the device has stayed up """
+        if self.failed_since is not None:
+            now = timesource.monotonic()
+            self.recovery.record(now - self.failed_since)
+            LOGGER.info('%s: recovered after %.1f seconds', self.name, now - self.failed_since)
+            self.failed_since = None
+            self.healthy_since = now
+            self.backoff = INITIAL_BACKOFF
+        elif self.errors and timesource.monotonic() - self.healthy_since > BUDGET_RESET_SECONDS:
+            self.errors = 0
+
+    def failure(self, ex):
+        """ back off then re-initialise the device, reopening the bus once over budget """
+        now = timesource.monotonic()
+        if self.failed_since is None:
+            self.failed_since = now
+            LOGGER.error('%s: I2C failure', self.name, exc_info=ex)
+        self.errors += 1
+        self.failures += 1
+        delay = self.backoff * random.uniform(1.0 - BACKOFF_JITTER, 1.0 + BACKOFF_JITTER)
+        self.backoff = min(self.backoff * 2.0, MAXIMUM_BACKOFF)
+        timesource.sleep(delay)
+        try:
+            if self.errors > ERROR_BUDGET:
+                LOGGER.info('%s: error budget spent, reopening I2C bus', self.name)
+                reopen_bus(self.device)
+            self.device.begin()
+            if self.restore is not None:
+                self.restore()
+        #pylint: disable=broad-except
+        except Exception as reinit_ex:
+            LOGGER.info('%s: re-initialisation failed: %s', self.name, str(reinit_ex))
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        return {"name": self.name, "errors": self.errors, "failures": self.failures,
+                "backoff": self.backoff, "down": self.failed_since is not None,
+                "recovery": self.recovery.summary()}
+
+class HealthSupervisor:
+    """ one place that tracks the health of every I2C device on the bus """
+
+    def __init__(self,):
+        """ no devices registered yet """
+        self.devices = {}
+
+    def register(self, name, device, restore=None):
+        """ start supervising a device and return its health record """
+        health = DeviceHealth(name, device, restore)
+        self.devices[name] = health
+        return health
+
+    def summary(self,):
+        """ health of all registered devices """
+        return [health.summary() for health in self.devices.values()]
+
+if __name__ == '__main__':
+    sys.exit()
@@ -24,12 +24,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import sys
+import math
 import time
 import datetime
 import socket
 import queue
+import atexit
+import signal
 import logging
-import logging.config
 
 import paho.mqtt.client as mqtt
 
@@ -39,8 +42,39 @@ from Adafruit_LED_Backpack import BicolorMatrix8x8
 import ledclock
 
 import led8x8controller
+import led8x8text
 
-logging.config.fileConfig(fname='/home/an/diyclock/logging.ini', disable_existing_loggers=False)
+import alarmcontroller
+
+import devicehealth
+
+import framerecorder
+
+import renderprocess
+
+import eventscheduler
+
+import ht16k33
+
+import profiler
+
+import occupancy
+
+import metrics
+
+import timesync
+
+import connectionmanager
+
+import motionjournal
+
+import rendergovernor
+
+import watchdog
+
+import diylogging
+
+diylogging.configure()
 
 # Get the logger specified in the file
 LOGGER = logging.getLogger("diyclock")
@@ -49,14 +83,37 @@ LOGGER.info('Application started')
 class Configuration:
     """ motion_topic to avoid global PEP8 """
 
+    __slots__ = ('setup_topic', 'profile_topic', 'heartbeat_topic', 'motion_topic',
+                 'pir_pin', 'piezo_pin', 'mqtt_ip', 'matrix8x8_addr', 'clock_addr',
+                 'frame_capture', 'motion_journal', 'isolate_rendering', 'use_occupancy', 'latitude', 'longitude',
+                 'time_leader', 'dither_demo')
+
     def __init__(self):
         """ create two topics for this application """
         self.setup_topic = "diy/" + socket.gethostname() + "/setup"
+        self.profile_topic = "diy/" + socket.gethostname() + "/profile"
+        self.heartbeat_topic = "diy/" + socket.gethostname() + "/heartbeat"
         self.motion_topic = ""
         self.pir_pin = 24
         self.piezo_pin = 4
         self.mqtt_ip = "192.168.1.53"
         self.matrix8x8_addr = 0x70
+        self.clock_addr = 0x71
+        # path of a frame capture file; empty disables recording
+        self.frame_capture = ""
+        # path of the motion history journal; empty keeps history in memory only
+        self.motion_journal = ""
+        # render and drive I2C in a separate process from networking
+        self.isolate_rendering = False
+        # follow the aggregated occupancy bitmap instead of every room topic
+        self.use_occupancy = False
+        # publish the time beacons every other clock aligns its animations to
+        self.time_leader = False
+        # add the 240 Hz dither pattern to the demo rotation
+        self.dither_demo = False
+        # set both to switch the lights at local sunrise and sunset
+        self.latitude = None
+        self.longitude = None
     def set(self, topic):
         """ the motion topic is passed to the app at startup """
         self.motion_topic = topic
@@ -66,6 +123,17 @@ class Configuration:
     def get_motion(self,):
         """ the motion topic dynamically set """
         return self.motion_topic
+    def get_profile(self,):
+        """ command topic for on demand profiling; results go to <topic>/result """
+        return self.profile_topic
+    def get_heartbeat(self,):
+        """ periodic heartbeat lateness histograms are published here """
+        return self.heartbeat_topic
+    def get_demo_modes(self,):
+        """ matrix demo rotation, with dithering only when asked for """
+        if self.dither_demo:
+            return led8x8controller.DITHER_DEMO_MODES
+        return led8x8controller.DEMO_MODES
 
 CONFIG = Configuration()
 
@@ -103,40 +171,101 @@ class MotionController:
         """ return the last value either 1 or 0 """
         return self.queue.get(False)
 
-    def wait_for_motion(self,):
-        """ wait for the next interrupt 1 or 0 """
-        return self.queue.get(True)
-
-class AlarmController:
-    """ alarm piezo device driver """
-    def __init__(self, pin):
-        """ control output to pin 4  """
-        self.gpio = GPIO.get_platform_gpio()
-        self.pin = pin
-        self.gpio.setup(self.pin, GPIO.OUT)
-        self.gpio.output(self.pin, GPIO.LOW)
-
-    def sound_alarm(self, turn_on):
-        """ turn power to piexo on or off """
-        if turn_on:
-            self.gpio.output(self.pin, GPIO.HIGH)
-        else:
-            self.gpio.output(self.pin, GPIO.LOW)
-
-    def reset(self,):
-        """ turn power to piexo off """
-        self.gpio.output(self.pin, GPIO.LOW)
-
-CLOCK = ledclock.LedClock()
-CLOCK.run()
-
-DISPLAY = BicolorMatrix8x8.BicolorMatrix8x8(address=CONFIG.matrix8x8_addr)
-DISPLAY.begin()
-
-MATRIX = led8x8controller.Led8x8Controller(DISPLAY)
-MATRIX.run()
-
-ALARM = AlarmController(CONFIG.piezo_pin)
+    def wait_for_motion(self, timeout=None):
+        """ wait for the next interrupt 1 or 0; None if the timeout expires """
+        try:
+            return self.queue.get(True, timeout)
+        except queue.Empty:
+            return None
+
+HEALTH = devicehealth.HealthSupervisor()
+
+if CONFIG.isolate_rendering:
+    # fork before any other thread starts; CLOCK and MATRIX become proxies
+    RENDERER = renderprocess.RenderProcess(CONFIG.matrix8x8_addr, CONFIG.clock_addr,
+                                           CONFIG.frame_capture, CONFIG.motion_journal,
+                                           CONFIG.get_demo_modes())
+    RENDERER.start()
+    CLOCK = RENDERER.clock
+    MATRIX = RENDERER.matrix
+else:
+    CLOCK = ledclock.LedClock(HEALTH)
+
+    DISPLAY = ht16k33.install_block_writes(
+        BicolorMatrix8x8.BicolorMatrix8x8(address=CONFIG.matrix8x8_addr))
+    DISPLAY.begin()
+
+    if CONFIG.frame_capture:
+        RECORDER = framerecorder.FrameRecorder(CONFIG.frame_capture)
+        RECORDER.attach(CLOCK.display, CONFIG.clock_addr)
+        RECORDER.attach(DISPLAY, CONFIG.matrix8x8_addr)
+
+    CLOCK.run()
+
+    JOURNAL = motionjournal.MotionJournal(CONFIG.motion_journal) if CONFIG.motion_journal else None
+    if JOURNAL is not None:
+        JOURNAL.run()
+        atexit.register(JOURNAL.close)
+    # a late clock slows the matrix patterns down, never the other way round
+    GOVERNOR = rendergovernor.RenderGovernor()
+    GOVERNOR.watch(CLOCK.heartbeat)
+    MATRIX = led8x8controller.Led8x8Controller(DISPLAY, HEALTH, journal=JOURNAL, governor=GOVERNOR,
+                                               demo_modes=CONFIG.get_demo_modes())
+    MATRIX.run()
+
+def create_connection(client):
+    """ route every publish through a connection manager for client; harnesses call this too
+
+        The client's callbacks must already be assigned. Start the result to
+        connect in the background, or connect the client directly. """
+    #pylint: disable=global-statement
+    global CLIENT, CONNECTION
+    CLIENT = client
+    CONNECTION = connectionmanager.ConnectionManager(client, CONFIG.mqtt_ip, 1883, 60)
+    CONNECTION.attach()
+    WATCHDOG.watch(CONNECTION.heartbeat)
+    return CONNECTION
+
+def create_alarm_connection(client):
+    """ keep a second connection that only carries the alarm topics
+
+        The broker queues fire and panic on their own socket and a network
+        thread of their own services them, so they never wait behind a
+        motion flood on the main connection. Nothing is published on it. """
+    #pylint: disable=global-statement
+    global ALARM_CONNECTION
+    client.on_connect = on_alarm_connect
+    client.on_message = alarm_message
+    ALARM_CONNECTION = connectionmanager.ConnectionManager(client, CONFIG.mqtt_ip, 1883, 60,
+                                                           "mqtt_alarm")
+    ALARM_CONNECTION.attach()
+    WATCHDOG.watch(ALARM_CONNECTION.heartbeat)
+    return ALARM_CONNECTION
+
+def publish_heartbeats(summary):
+    """ send heartbeat lateness histograms """
+    CONNECTION.publish(CONFIG.get_heartbeat(), summary, 0, False)
+
+# systemd is told READY once the displays run, MQTT or not; stalled threads stop its pings
+WATCHDOG = watchdog.Watchdog(publish_heartbeats)
+if CONFIG.isolate_rendering:
+    WATCHDOG.watch_counter("render_process", RENDERER.health_count, renderprocess.HEALTH_SECONDS)
+else:
+    WATCHDOG.watch(CLOCK.heartbeat)
+    WATCHDOG.watch(MATRIX.heartbeat)
+    WATCHDOG.add_report("render_governor", GOVERNOR.summary)
+
+def render_jitter():
+    """ frame to frame jitter of both displays in either process mode """
+    if CONFIG.isolate_rendering:
+        return RENDERER.jitter()
+    return {"matrix_mean": MATRIX.jitter.jitter.mean(), "matrix_max": MATRIX.jitter.jitter.maximum,
+            "clock_mean": CLOCK.jitter.jitter.mean(), "clock_max": CLOCK.jitter.jitter.maximum}
+
+# seconds between render jitter log entries
+JITTER_LOG_SECONDS = 600
+
+ALARM = alarmcontroller.AlarmController(CONFIG.piezo_pin)
 ALARM.sound_alarm(False)
 
 
@@ -146,7 +275,7 @@ class TimedEvents:
     def __init__(self, day, night):
         """ initialize night,day and light status """
         if night < day:
-            raise "NIGHT < DAY"
+            raise ValueError("NIGHT < DAY")
         self.night = night
         self.day = day
         self.lights_are_on = True
@@ -154,50 +283,73 @@ class TimedEvents:
     def control_lights(self, switch):
         """ dim lights at night or turn up during the day """
         if switch == "Turn On":
+            CLOCK.set_low_power(False)
+            MATRIX.set_low_power(False)
             CLOCK.set_brightness(12)
             MATRIX.set_state(led8x8controller.DEMO_STATE)
             self.lights_are_on = True
         else:
             CLOCK.set_brightness(0)
+            CLOCK.set_low_power(True)
+            MATRIX.set_low_power(True)
             MATRIX.set_state(led8x8controller.IDLE_STATE)
             self.lights_are_on = False
 
-    def check_for_timed_events(self,):
-        """ turn down displays at night """
-        now = datetime.datetime.now().time()
-        if now <= self.day:
-            if self.lights_are_on:
-                self.control_lights("Turn Off")
-        elif now >= self.night:
-            if self.lights_are_on:
-                self.control_lights("Turn Off")
-        else:
-            if not self.lights_are_on:
-                self.control_lights("Turn On")
+    def lights_on(self,):
+        """ scheduler callback for the start of the day """
+        if not self.lights_are_on:
+            self.control_lights("Turn On")
+
+    def lights_off(self,):
+        """ scheduler callback for the start of the night """
+        if self.lights_are_on:
+            self.control_lights("Turn Off")
+
+    def schedule(self,):
+        """ day and night transitions at fixed times or at sunrise and sunset """
+        if CONFIG.latitude is not None and CONFIG.longitude is not None:
+            return eventscheduler.SolarSchedule("lights", CONFIG.latitude, CONFIG.longitude,
+                                                self.lights_on, self.lights_off)
+        return eventscheduler.DailySchedule("lights", [(self.day, self.lights_on),
+                                                       (self.night, self.lights_off)])
 
 DAY_DEFAULT = datetime.time(6, 1)
 NIGHT_DEFAULT = datetime.time(20, 1)
 TIMER = TimedEvents(DAY_DEFAULT, NIGHT_DEFAULT)
 
+SCHEDULER = eventscheduler.EventScheduler()
+SCHEDULER.add(TIMER.schedule())
+SCHEDULER.run()
+WATCHDOG.watch(SCHEDULER.heartbeat)
+
+# alarm topics with their matrix mode and piezo pattern
+ALARM_TOPICS = {
+    "diy/system/fire":
+        {"mode":led8x8controller.FIRE_MODE, "pattern":alarmcontroller.FIRE_PATTERN},
+    "diy/system/panic":
+        {"mode":led8x8controller.PANIC_MODE, "pattern":alarmcontroller.PANIC_PATTERN}
+    }
+
+def alarm_message(client, userdata, msg):
+    #pylint: disable=unused-argument
+    """ alarm fast path: drive the piezo first, then queue the matrix mode
+
+        Runs on the alarm connection's network thread, never behind the
+        messages queued on the main connection. """
+    alarm = ALARM_TOPICS.get(msg.topic)
+    if alarm is None:
+        return
+    if msg.payload == b'ON':
+        ALARM.sound_alarm(True, alarm["pattern"], msg.timestamp)
+        MATRIX.set_mode(alarm["mode"])
+    else:
+        ALARM.sound_alarm(False, received=msg.timestamp)
+        MATRIX.set_mode(led8x8controller.FIBONACCI_MODE, True)
+
 def system_message(msg):
     """ process system messages"""
-    #pylint: disable=too-many-branches
     #LOGGER.info(msg.topic+" "+msg.payload.decode('utf-8'))
-    if msg.topic == 'diy/system/fire':
-        if msg.payload == b'ON':
-            MATRIX.set_mode(led8x8controller.FIRE_MODE)
-            ALARM.sound_alarm(True)
-        else:
-            MATRIX.set_mode(led8x8controller.FIBONACCI_MODE, True)
-            ALARM.sound_alarm(False)
-    elif msg.topic == 'diy/system/panic':
-        if msg.payload == b'ON':
-            MATRIX.set_mode(led8x8controller.PANIC_MODE)
-            ALARM.sound_alarm(True)
-        else:
-            MATRIX.set_mode(led8x8controller.FIBONACCI_MODE, True)
-            ALARM.sound_alarm(False)
-    elif msg.topic == 'diy/system/who':
+    if msg.topic == 'diy/system/who':
         if msg.payload == b'ON':
             CLOCK.set_mode(ledclock.WHO_MODE)
         else:
@@ -221,23 +373,84 @@ def system_message(msg):
         topic = msg.payload.decode('utf-8') + "/motion"
         CONFIG.set(topic)
 
+def countdown_message(msg):
+    """ countdown and stopwatch control
+
+        set: seconds to count down, "90.0" to show tenths, "0" for a stopwatch
+        start: optional wall clock epoch so several clocks start together
+        stop: freeze the count, "OFF" returns to the time of day """
+    payload = msg.payload.decode('utf-8', 'ignore').strip()
+    if msg.topic == 'diy/system/countdown/set':
+        try:
+            seconds = float(payload)
+        except ValueError:
+            seconds = math.nan
+        if not math.isfinite(seconds) or not ledclock.valid_count(seconds):
+            LOGGER.info('countdown: bad set payload %s', payload)
+            return
+        CLOCK.set_countdown(seconds, "." in payload)
+    elif msg.topic == 'diy/system/countdown/start':
+        try:
+            epoch = float(payload) if payload else None
+        except ValueError:
+            epoch = None
+        if epoch is not None and not (math.isfinite(epoch) and ledclock.valid_start(epoch)):
+            LOGGER.info('countdown: bad start payload %s', payload)
+            return
+        CLOCK.start_countdown(epoch)
+    elif msg.topic == 'diy/system/countdown/stop':
+        CLOCK.stop_countdown()
+        if payload == 'OFF':
+            CLOCK.set_mode(ledclock.TIME_MODE)
+
+def text_message(msg):
+    """ scroll a message on the matrix: 'TEXT', 'COLOR:TEXT' or 'COLOR/SPEED:TEXT' """
+    text, color, speed = led8x8text.parse_message(msg.payload)
+    try:
+        MATRIX.show_text(text, color, speed)
+    except ValueError as ex:
+        LOGGER.info('message: %s', str(ex))
+
+def time_message(msg):
+    """ align animations with the leader; paho stamps msg.timestamp with time.monotonic() """
+    MATRIX.time_beacon(msg.payload, msg.timestamp)
+
+def publish_profile(summary):
+    """ send a profiler summary back to whoever asked """
+    CONNECTION.publish(CONFIG.get_profile() + "/result", summary, 0, False)
+
+PROFILER = profiler.OnDemandProfiler(publish_profile)
+
+def profile_message(msg):
+    """ start a capture: payload is 'SECONDS' or 'SECONDS memory' """
+    seconds, memory = PROFILER.parse(msg.payload)
+    PROFILER.start(seconds, memory)
+
 
 # use a dispatch model for the subscriptions
 TOPIC_DISPATCH_DICTIONARY = {
     "diy/system/demo":
         {"method":system_message},
-    "diy/system/fire":
-        {"method":system_message},
-    "diy/system/panic":
-        {"method":system_message},
     "diy/system/security":
         {"method":system_message},
     "diy/system/silent":
         {"method":system_message},
     "diy/system/who":
         {"method":system_message},
+    "diy/system/countdown/set":
+        {"method":countdown_message},
+    "diy/system/countdown/start":
+        {"method":countdown_message},
+    "diy/system/countdown/stop":
+        {"method":countdown_message},
+    "diy/system/message":
+        {"method":text_message},
     CONFIG.get_setup():
-        {"method":system_message}
+        {"method":system_message},
+    CONFIG.get_profile():
+        {"method":profile_message},
+    timesync.BEACON_TOPIC:
+        {"method":time_message}
     }
 
 
@@ -246,15 +459,30 @@ TOPIC_DISPATCH_DICTIONARY = {
 def on_connect(client, userdata, flags, rcdata):
     #pylint: disable=unused-argument
     """ Subscribing in on_connect() means that if we lose the connection and
-        reconnect then subscriptions will be renewed. """
+        reconnect then subscriptions will be renewed. The alarm topics have
+        a connection of their own. """
     client.subscribe("diy/system/demo", 1)
-    client.subscribe("diy/system/fire", 1)
-    client.subscribe("diy/system/panic", 1)
     client.subscribe("diy/system/security", 1)
     client.subscribe("diy/system/silent", 1)
     client.subscribe("diy/system/who", 1)
+    client.subscribe("diy/system/countdown/set", 1)
+    client.subscribe("diy/system/countdown/start", 1)
+    client.subscribe("diy/system/countdown/stop", 1)
+    client.subscribe("diy/system/message", 1)
     client.subscribe(CONFIG.get_setup(), 1)
-    client.subscribe("diy/+/+/motion", 1)
+    client.subscribe(CONFIG.get_profile(), 1)
+    if not CONFIG.time_leader:
+        client.subscribe(timesync.BEACON_TOPIC, 0)
+    if CONFIG.use_occupancy:
+        client.subscribe(occupancy.OCCUPANCY_TOPIC, 1)
+    else:
+        client.subscribe(occupancy.MOTION_FILTER, 1)
+
+def on_alarm_connect(client, userdata, flags, rcdata):
+    #pylint: disable=unused-argument
+    """ renew the alarm subscriptions on every connect of the alarm client """
+    for topic in ALARM_TOPICS:
+        client.subscribe(topic, 1)
 
 def on_disconnect(client, userdata, rcdata):
     #pylint: disable=unused-argument
@@ -269,10 +497,16 @@ def on_disconnect(client, userdata, rcdata):
 def on_message(client, userdata, msg):
     #pylint: disable=unused-argument
     """ dispatch to the appropriate MQTT topic handler """
-    if "motion" in msg.topic:
-        MATRIX.update_motion(msg.topic)
+    if msg.topic == occupancy.OCCUPANCY_TOPIC:
+        MATRIX.update_occupancy(msg.payload, bool(msg.retain))
+    elif "motion" in msg.topic:
+        MATRIX.update_motion(msg.topic, msg.payload == b'1', bool(msg.retain))
     else:
-        TOPIC_DISPATCH_DICTIONARY[msg.topic]["method"](msg)
+        handler = TOPIC_DISPATCH_DICTIONARY.get(msg.topic)
+        if handler is None:
+            LOGGER.info('no handler for topic %s', msg.topic)
+        else:
+            handler["method"](msg)
 
 MOTION = MotionController(CONFIG.pir_pin)
 MOTION.enable()
@@ -280,23 +514,43 @@ MOTION.enable()
 if __name__ == '__main__':
     #Start utility threads, setup MQTT handlers then wait for timed events
 
+    # systemd stops the service with SIGTERM; exit normally so atexit handlers
+    # write the motion journal and the batched log
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     CLIENT = mqtt.Client()
     CLIENT.on_connect = on_connect
     CLIENT.on_disconnect = on_disconnect
     CLIENT.on_message = on_message
-    CLIENT.connect(CONFIG.mqtt_ip, 1883, 60)
-    CLIENT.loop_start()
 
-    # give network time to startup - hack?
-    time.sleep(1.0)
+    # the displays are already running; connect in the background and keep retrying
+    create_connection(CLIENT).start()
+    create_alarm_connection(mqtt.Client()).start()
+
+    if CONFIG.time_leader:
+        LEADER = timesync.TimeLeader(CLIENT)
+        LEADER.run()
+
+    WATCHDOG.ready()
+    HEARTBEAT = WATCHDOG.heartbeat("main")
 
-    # loop forever checking for interrupts or timed events
+    # block on motion interrupts; the scheduler thread handles timed events
 
+    JITTER_LOGGED = time.monotonic()
+    WAKEUPS = metrics.WakeupCounter("main")
+    WAKEUP_REPORT = metrics.WakeupReport()
     while True:
-        time.sleep(1.0)
-        if MOTION.detected():
-            VALUE = MOTION.get_motion()
+        WAIT = max(0.0, JITTER_LOG_SECONDS - (time.monotonic() - JITTER_LOGGED))
+        HEARTBEAT.beat(WAIT + watchdog.STALL_SECONDS)
+        VALUE = MOTION.wait_for_motion(WAIT)
+        WAKEUPS.wake()
+        if VALUE is not None:
             TOPIC = CONFIG.get_motion()
-            CLIENT.publish(TOPIC, VALUE, 0, True)
-            # print("bil: motion detected")
-        TIMER.check_for_timed_events()
+            if not CONNECTION.publish(TOPIC, VALUE, 0, True):
+                # offline the broker cannot echo our own motion back to the matrix
+                MATRIX.update_motion(TOPIC, VALUE == "1")
+        if time.monotonic() - JITTER_LOGGED >= JITTER_LOG_SECONDS:
+            JITTER_LOGGED = time.monotonic()
+            LOGGER.info('render jitter %s', render_jitter())
+            LOGGER.info('wake-ups per minute %s', WAKEUP_REPORT.sample())
+            LOGGER.info('mqtt %s', CONNECTION.summary())
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+
+""" Queue based logging so display threads never format or write log files """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import logging.config
+import logging.handlers
+from threading import Thread, Lock
+
+import metrics
+
+LOGGING_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logging.ini')
+
+# seconds between writes of batched log records to the SD card
+FLUSH_INTERVAL = 5.0
+
+# records that force a write before the flush interval expires
+BATCH_RECORDS = 100
+
+# seconds during which repeats of the same message are only counted
+REPEAT_WINDOW = 60.0
+
+STOP = None
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """ rotating file handler that only flushes when the log writer says so
+
+        The stock handler seeks to the end of the file before every record to
+        decide on rollover, which flushes the stream; the size is tracked here
+        instead so records really stay buffered until sync. """
+
+    def __init__(self, *args, **kwargs):
+        """ size of the current file is read lazily on the first record """
+        logging.handlers.RotatingFileHandler.__init__(self, *args, **kwargs)
+        self.written = None
+        self.pending_length = 0
+
+    def shouldRollover(self, record):
+        """ compare the tracked file size with maxBytes without touching the stream """
+        #pylint: disable=invalid-name
+        if self.maxBytes <= 0:
+            return False
+        if self.written is None:
+            self.written = 0
+            if os.path.exists(self.baseFilename):
+                self.written = os.path.getsize(self.baseFilename)
+        self.pending_length = len(self.format(record)) + len(self.terminator)
+        return self.written + self.pending_length >= self.maxBytes
+
+    def doRollover(self,):
+        """ a fresh file starts empty """
+        #pylint: disable=invalid-name
+        logging.handlers.RotatingFileHandler.doRollover(self)
+        self.written = 0
+
+    def emit(self, record):
+        """ write the record into the stream buffer and count its size """
+        logging.handlers.RotatingFileHandler.emit(self, record)
+        if self.written is not None:
+            self.written += self.pending_length
+
+    def flush(self,):
+        """ leave records in the stream buffer until sync """
+
+    def sync(self,):
+        """ write the buffered records to disk """
+        logging.handlers.RotatingFileHandler.flush(self)
+
+class RepeatFilter(logging.Filter):
+    """ pass the first of a run of identical messages and count the rest
+
+        The count is reported when the window ends, by the log writer calling
+        expire, or by the next repeat if that comes first. """
+
+    def __init__(self, window=REPEAT_WINDOW):
+        """ no messages seen yet """
+        logging.Filter.__init__(self)
+        self.window = window
+        self.lock = Lock()
+        self.seen = {}
+
+    def filter(self, record):
+        """ drop repeats inside the window; annotate the first record after it """
+        exc_type = record.exc_info[0] if record.exc_info else None
+        message = record.getMessage()
+        key = (record.name, message, exc_type)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                self.seen[key] = (entry[0], entry[1] + 1, record)
+                return False
+            suppressed = entry[1] if entry is not None else 0
+            self.seen[key] = (now, 0, None)
+            if len(self.seen) > 1000:
+                self.seen = {key: (now, 0, None)}
+        if suppressed:
+            record.msg = '{} ({} repeats suppressed)'.format(message, suppressed)
+            record.args = None
+        return True
+
+    def next_expiry(self,):
+        """ monotonic time the earliest window ends, None with no window open """
+        with self.lock:
+            if not self.seen:
+                return None
+            return min(first for first, _, _ in self.seen.values()) + self.window
+
+    def expire(self, now):
+        """ close the windows that ended; the last repeat of each run that had
+            any, annotated with its count, to be written in its place """
+        reports = []
+        with self.lock:
+            for key, (first, suppressed, record) in list(self.seen.items()):
+                if now - first >= self.window:
+                    del self.seen[key]
+                    if suppressed:
+                        record.msg = '{} ({} repeats suppressed)'.format(key[1], suppressed)
+                        record.args = None
+                        reports.append(record)
+        return reports
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ queue the record untouched so formatting happens on the log writer thread """
+
+    def prepare(self, record):
+        """ no message or traceback formatting in the calling thread """
+        return record
+
+class LogWriter:
+    """ single thread that formats queued records and writes them in batches """
+
+    def __init__(self, records, handlers, repeats=None):
+        """ start the writer thread; repeats is the RepeatFilter whose counts it reports """
+        self.records = records
+        self.handlers = handlers
+        self.repeats = repeats
+        self.wakeups = metrics.WakeupCounter("log_writer")
+        self.thread = Thread(target=self.writer_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def sync(self,):
+        """ push batched records to disk """
+        for handler in self.handlers:
+            if hasattr(handler, 'sync'):
+                handler.sync()
+            else:
+                handler.flush()
+
+    def handle(self, record):
+        """ pass one record to every handler whose level it reaches """
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def writer_thread(self,):
+        """ handle records as they arrive and sync a flush interval after the first
+
+            With nothing pending and no repeat window open the thread blocks
+            until the next record. """
+        pending = 0
+        first_pending = 0.0
+        while True:
+            deadline = None
+            if pending:
+                deadline = first_pending + FLUSH_INTERVAL
+            if self.repeats is not None:
+                expiry = self.repeats.next_expiry()
+                if expiry is not None and (deadline is None or expiry < deadline):
+                    deadline = expiry
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self.records.get(True, timeout)
+            except queue.Empty:
+                record = False
+            self.wakeups.wake()
+            if record is STOP:
+                self.sync()
+                return
+            reports = [] if self.repeats is None else self.repeats.expire(time.monotonic())
+            if record:
+                reports.insert(0, record)
+            for report in reports:
+                self.handle(report)
+                if not pending:
+                    first_pending = time.monotonic()
+                pending += 1
+            if pending and (pending >= BATCH_RECORDS
+                            or time.monotonic() - first_pending >= FLUSH_INTERVAL):
+                self.sync()
+                pending = 0
+
+    def stop(self,):
+        """ write everything still queued and stop the thread """
+        self.records.put(STOP)
+        self.thread.join(FLUSH_INTERVAL)
+
+WRITER = None
+
+def configure(fname=LOGGING_INI):
+    """ load logging.ini once and move its handlers behind a queue """
+    #pylint: disable=global-statement
+    global WRITER
+    if WRITER is not None:
+        return WRITER
+    logging.config.fileConfig(fname=fname, disable_existing_loggers=False)
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    records = queue.Queue()
+    queue_handler = DeferredQueueHandler(records)
+    repeats = RepeatFilter()
+    queue_handler.addFilter(repeats)
+    root.addHandler(queue_handler)
+    WRITER = LogWriter(records, handlers, repeats)
+    atexit.register(WRITER.stop)
+    return WRITER
+
+def after_fork():
+    """ a forked child has the queue handler but no writer thread; start its own """
+    #pylint: disable=global-statement
+    global WRITER
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    WRITER = None
+    return configure()
+
+if __name__ == '__main__':
+    sys.exit()
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+
+""" Sleep until the next computed transition instead of polling the clock """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import math
+import datetime
+import logging
+
+import metrics
+
+import watchdog
+
+import timesource
+
+# longest single sleep; bounds how late a wall clock step is noticed
+MAXIMUM_SLEEP = 3600.0
+
+# wall clock and monotonic elapsed time may differ by this much before a step is assumed
+STEP_TOLERANCE = 2.0
+
+# running callbacks is allowed this long before a wake-up counts as late
+WAKE_SLACK = 1.0
+
+# sun center 0.833 degrees below the horizon, allowing for refraction
+SUN_ZENITH = 90.833
+
+LOGGER = logging.getLogger(__name__)
+
+def sun_times(date, latitude, longitude):
+    """ (sunrise, sunset) POSIX timestamps for a date, None during polar day or night
+
+        NOAA general solar position approximation, accurate to about a minute. """
+    gamma = 2.0 * math.pi / 365.0 * (date.timetuple().tm_yday - 1)
+    eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                       - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    decl = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+            - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+            - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+    lat = math.radians(latitude)
+    cos_ha = (math.cos(math.radians(SUN_ZENITH)) / (math.cos(lat) * math.cos(decl))
+              - math.tan(lat) * math.tan(decl))
+    if cos_ha < -1.0 or cos_ha > 1.0:
+        return None
+    hour_angle = math.degrees(math.acos(cos_ha))
+    midnight = datetime.datetime(date.year, date.month, date.day,
+                                 tzinfo=datetime.timezone.utc).timestamp()
+    sunrise = midnight + 60.0 * (720.0 - 4.0 * (longitude + hour_angle) - eqtime)
+    sunset = midnight + 60.0 * (720.0 - 4.0 * (longitude - hour_angle) - eqtime)
+    return sunrise, sunset
+
+class DailySchedule:
+    """ callbacks at fixed local times of day; DST is handled by mktime """
+
+    def __init__(self, name, events):
+        """ events is a list of (datetime.time, callback) """
+        self.name = name
+        self.events = events
+
+    def events_on(self, date):
+        """ (timestamp, callback) for each event on a local date """
+        return [(datetime.datetime.combine(date, when).timestamp(), callback)
+                for when, callback in self.events]
+
+class SolarSchedule:
+    """ callbacks at local sunrise and sunset computed from latitude and longitude """
+
+    def __init__(self, name, latitude, longitude, sunrise, sunset, offset=0.0):
+        """ offset in seconds is added to both transitions """
+        #pylint: disable=too-many-arguments
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.offset = offset
+
+    def events_on(self, date):
+        """ (timestamp, callback) for sunrise and sunset on a date """
+        times = sun_times(date, self.latitude, self.longitude)
+        if times is None:
+            return []
+        return [(times[0] + self.offset, self.sunrise), (times[1] + self.offset, self.sunset)]
+
+class EventScheduler:
+    """ run schedule callbacks at their transitions, waking only when one is due """
+
+    def __init__(self,):
+        """ no schedules yet """
+        self.schedules = []
+        self.changed = timesource.event()
+        self.wakeups = metrics.WakeupCounter("scheduler")
+        self.heartbeat = watchdog.Heartbeat("scheduler")
+        self.thread = None
+
+    def add(self, schedule):
+        """ add a schedule; its current state is applied on the next wake """
+        self.schedules.append(schedule)
+        self.changed.set()
+
+    def events_around(self, now):
+        """ every event from yesterday to tomorrow, in time order """
+        today = datetime.date.fromtimestamp(now)
+        events = []
+        for schedule in self.schedules:
+            for days in (-1, 0, 1, 2):
+                events.extend(schedule.events_on(today + datetime.timedelta(days=days)))
+        events.sort(key=lambda event: event[0])
+        return events
+
+    def apply_current(self, now):
+        """ run the latest past callback of each schedule so state matches the clock """
+        for schedule in self.schedules:
+            latest = None
+            today = datetime.date.fromtimestamp(now)
+            for days in (-2, -1, 0):
+                for stamp, callback in schedule.events_on(today + datetime.timedelta(days=days)):
+                    if stamp <= now and (latest is None or stamp >= latest[0]):
+                        latest = (stamp, callback)
+            if latest is not None:
+                latest[1]()
+
+    def next_event(self, now):
+        """ (timestamp, callbacks) of the next transition after now or None """
+        pending = [event for event in self.events_around(now) if event[0] > now]
+        if not pending:
+            return None
+        stamp = pending[0][0]
+        return stamp, [callback for when, callback in pending if when == stamp]
+
+    def scheduler_thread(self,):
+        """ sleep until the next transition, a schedule change or a clock step """
+        resync = True
+        while True:
+            if resync or self.changed.is_set():
+                self.changed.clear()
+                self.apply_current(timesource.time())
+                resync = False
+            wall = timesource.time()
+            mono = timesource.monotonic()
+            upcoming = self.next_event(wall)
+            delay = MAXIMUM_SLEEP
+            if upcoming is not None:
+                delay = min(delay, max(0.0, upcoming[0] - wall))
+            self.heartbeat.beat(delay + WAKE_SLACK)
+            self.changed.wait(delay)
+            self.wakeups.wake()
+            drift = (timesource.time() - wall) - (timesource.monotonic() - mono)
+            if abs(drift) > STEP_TOLERANCE:
+                LOGGER.info('EventScheduler: wall clock stepped %.1f seconds', drift)
+                resync = True
+            elif upcoming is not None and timesource.time() >= upcoming[0]:
+                for callback in upcoming[1]:
+                    callback()
+
+    def run(self,):
+        """ start the scheduler thread """
+        self.thread = timesource.spawn(self.scheduler_thread)
+
+if __name__ == '__main__':
+    sys.exit()
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+""" Record and replay the frames written to the I2C backpacks """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import struct
+from threading import Lock
+
+import simulatedhw
+
+# file starts with a magic and version, then fixed size frame records
+MAGIC = b'DIYF\x01'
+
+# monotonic seconds, I2C address, HT16K33 display buffer
+RECORD = struct.Struct('<dB16s')
+
+# records buffered in memory before they are appended to the file
+FLUSH_RECORDS = 64
+
+class FrameRecorder:
+    """ append every frame written to attached displays to a capture file """
+
+    def __init__(self, path):
+        """ open the capture for appending, writing the header to a new file """
+        self.path = path
+        self.lock = Lock()
+        self.pending = []
+        self.frames = 0
+        self.capture = open(path, 'ab')
+        if self.capture.tell() == 0:
+            self.capture.write(MAGIC)
+
+    def attach(self, display, address):
+        """ wrap the display's write_display so each frame is recorded after it is sent
+
+            The unwrapped write stays reachable as write_unrecorded for patterns
+            that send many sub-frames of one content frame and record it once. """
+        write_display = display.write_display
+
+        def recorded_write_display():
+            """ send the frame then record its buffer """
+            write_display()
+            self.record(address, display.buffer)
+
+        display.write_display = recorded_write_display
+        display.write_unrecorded = write_display
+        return display
+
+    def record(self, address, buffer):
+        """ queue one frame; called from both display threads """
+        packed = RECORD.pack(time.monotonic(), address, bytes(buffer))
+        with self.lock:
+            self.pending.append(packed)
+            self.frames += 1
+            if len(self.pending) >= FLUSH_RECORDS:
+                self.flush_locked()
+
+    def flush_locked(self,):
+        """ append queued records; caller holds the lock """
+        self.capture.write(b''.join(self.pending))
+        self.capture.flush()
+        self.pending = []
+
+    def close(self,):
+        """ flush and close the capture file """
+        with self.lock:
+            self.flush_locked()
+            self.capture.close()
+
+def read_frames(path):
+    """ yield (timestamp, address, buffer) for each recorded frame """
+    with open(path, 'rb') as capture:
+        if capture.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a diyclock frame capture'.format(path))
+        while True:
+            record = capture.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            yield RECORD.unpack(record)
+
+def replay(path, displays, realtime=False):
+    """ push recorded frames through displays keyed by address; returns per frame cost """
+    frames = 0
+    render = 0.0
+    first = None
+    started = time.monotonic()
+    for stamp, address, buffer in read_frames(path):
+        display = displays.get(address)
+        if display is None:
+            continue
+        if realtime:
+            if first is None:
+                first = stamp
+            delay = (stamp - first) - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        begin = time.perf_counter()
+        display.buffer[:] = buffer
+        display.write_display()
+        render += time.perf_counter() - begin
+        frames += 1
+    return {"frames": frames, "seconds": render,
+            "per_frame": render / frames if frames else 0.0}
+
+def diff(path_a, path_b):
+    """ compare frame content per address ignoring timing; None if identical """
+    streams_a = {}
+    streams_b = {}
+    for streams, path in ((streams_a, path_a), (streams_b, path_b)):
+        for _, address, buffer in read_frames(path):
+            streams.setdefault(address, []).append(buffer)
+    for address in sorted(set(streams_a) | set(streams_b)):
+        frames_a = streams_a.get(address, [])
+        frames_b = streams_b.get(address, [])
+        for index, (frame_a, frame_b) in enumerate(zip(frames_a, frames_b)):
+            if frame_a != frame_b:
+                return {"address": address, "frame": index, "a": frame_a.hex(), "b": frame_b.hex()}
+        if len(frames_a) != len(frames_b):
+            return {"address": address, "frame": min(len(frames_a), len(frames_b)),
+                    "a": len(frames_a), "b": len(frames_b)}
+    return None
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'replay':
+        MATRIX = simulatedhw.SimulatedBicolorMatrix8x8(0x70)
+        CLOCK = simulatedhw.SimulatedSevenSegment(0x71)
+        print(replay(sys.argv[2], {0x70: MATRIX, 0x71: CLOCK}))
+    elif len(sys.argv) == 4 and sys.argv[1] == 'diff':
+        DIFFERENCE = diff(sys.argv[2], sys.argv[3])
+        print(DIFFERENCE if DIFFERENCE else 'identical')
+        sys.exit(1 if DIFFERENCE else 0)
+    else:
+        print('usage: framerecorder.py replay CAPTURE | diff CAPTURE CAPTURE')
+    sys.exit()
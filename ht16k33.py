@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+""" Minimal HT16K33 transport: one I2C block write per frame """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+
+# HT16K33 display RAM starts at register 0 and auto increments
+DISPLAY_RAM = 0x00
+
+def install_block_writes(display):
+    """ replace the per byte write_display of an Adafruit backpack with one block write
+
+        The Adafruit driver sends each of the 16 buffer bytes as its own
+        register write. Displays without an I2C device, such as the simulated
+        backpacks, are left unchanged. """
+    if not hasattr(display, '_device'):
+        return display
+
+    def block_write_display():
+        """ send the whole buffer in a single I2C transaction """
+        #pylint: disable=protected-access
+        display._device.writeList(DISPLAY_RAM, display.buffer)
+
+    display.write_display = block_write_display
+    return display
+
+if __name__ == '__main__':
+    sys.exit()
@@ -25,10 +25,9 @@
 # SOFTWARE.
 
 import sys
-import time
-from threading import Thread
+from collections import namedtuple
+from collections import deque
 import logging
-import logging.config
 
 import led8x8idle
 import led8x8flash
@@ -36,6 +35,26 @@ import led8x8fibonacci
 import led8x8motion
 import led8x8wopr
 import led8x8life
+import led8x8prime
+import led8x8text
+import led8x8heatmap
+import led8x8dither
+
+import timesource
+
+import timesync
+
+import motionjournal
+
+import devicehealth
+
+import watchdog
+
+import rendergovernor
+
+import metrics
+
+import diylogging
 
 # Color values as convenient globals.
 OFF = 0
@@ -54,96 +73,264 @@ PANIC_MODE = 1
 FIBONACCI_MODE = 2
 WOPR_MODE = 3
 LIFE_MODE = 4
+TEXT_MODE = 5
+PRIME_MODE = 6
+HEATMAP_MODE = 7
+DITHER_MODE = 8
+
+# demo modes in the order they rotate
+DEMO_MODES = (FIBONACCI_MODE, WOPR_MODE, LIFE_MODE, PRIME_MODE, HEATMAP_MODE)
+
+# the rotation with the 240 Hz dither pattern; opt in until it is measured on a Pi Zero
+DITHER_DEMO_MODES = DEMO_MODES + (DITHER_MODE,)
+
+# demo modes rotate on multiples of this on the shared timeline
+ROTATION_SECONDS = 60
+
+# a requested demo mode is shown at least this long before the next rotation
+MINIMUM_DWELL_SECONDS = 30
 
-logging.config.fileConfig(fname='/home/an/diyclock/logging.ini', disable_existing_loggers=False)
+# frame period of each demo mode, for heartbeat lateness
+DEMO_PERIODS = {
+    FIBONACCI_MODE: led8x8fibonacci.UPDATE_RATE_SECONDS,
+    WOPR_MODE: led8x8wopr.UPDATE_RATE_SECONDS,
+    LIFE_MODE: led8x8life.UPDATE_RATE_SECONDS,
+    PRIME_MODE: led8x8prime.UPDATE_RATE_SECONDS,
+    HEATMAP_MODE: led8x8heatmap.UPDATE_RATE_SECONDS,
+    DITHER_MODE: led8x8dither.UPDATE_RATE_SECONDS
+    }
+
+# governor tier of each demo mode; dithering costs the most and goes first
+DEMO_TIERS = {
+    DITHER_MODE: rendergovernor.ANIMATION_TIER,
+    FIBONACCI_MODE: rendergovernor.DEMO_TIER,
+    WOPR_MODE: rendergovernor.DEMO_TIER,
+    LIFE_MODE: rendergovernor.DEMO_TIER,
+    PRIME_MODE: rendergovernor.DEMO_TIER,
+    HEATMAP_MODE: rendergovernor.AMBIENT_TIER
+    }
+
+# brightness each demo mode's pattern was designed for
+DEMO_BRIGHTNESS = {
+    FIBONACCI_MODE: led8x8fibonacci.BRIGHTNESS,
+    WOPR_MODE: led8x8wopr.BRIGHTNESS,
+    LIFE_MODE: led8x8life.BRIGHTNESS,
+    PRIME_MODE: led8x8prime.BRIGHTNESS,
+    HEATMAP_MODE: led8x8heatmap.BRIGHTNESS,
+    DITHER_MODE: led8x8dither.BRIGHTNESS
+    }
+
+# rendering time allowed on top of a pattern's sleep before a frame counts as late
+FRAME_SLACK = 0.05
+
+diylogging.configure()
 
 # Get the logger specified in the file
 LOGGER = logging.getLogger(__name__)
 
 LOGGER.info('Application started')
 
+# mode and state transitions requested by other threads
+SET_STATE = 0
+SET_MODE = 1
+OVERRIDE_MODE = 2
+RESTORE_MODE = 3
+END_TEXT = 4
+
+# immutable view of the mode controller published to the display thread
+ModeSnapshot = namedtuple('ModeSnapshot',
+                          ['version', 'machine_state', 'current_mode', 'last_mode', 'start_time'])
+
 class ModeController:
-    """ control changing modes. note Fire and Panic are externally controlled. """
+    """ control changing modes. note Fire and Panic are externally controlled.
 
-    def __init__(self,):
-        """ create mode control variables """
-        self.machine_state = DEMO_STATE
-        self.current_mode = FIBONACCI_MODE
-        self.last_mode = LIFE_MODE
-        self.start_time = time.time()
+        Other threads never touch the published snapshot; they queue transitions
+        which the display thread applies in order, exactly once, before each frame.
+        deque append and popleft are atomic so the frame path takes no locks.
+        Start times are on the shared timeline of sync. """
+
+    def __init__(self, sync=None, demo_modes=DEMO_MODES):
+        """ create mode control variables; demo_modes is the rotation """
+        self.sync = sync if sync is not None else timesync.SharedClock()
+        self.demo_modes = demo_modes
+        self.snapshot = ModeSnapshot(0, DEMO_STATE, FIBONACCI_MODE, LIFE_MODE, self.sync.shared())
+        self.transitions = deque()
+        self.wake = timesource.event()
 
     def set_state(self, state):
-        """ set the display mode """
-        self.machine_state = state
+        """ request a new machine state """
+        self.transitions.append((SET_STATE, state))
+        self.wake.set()
 
     def get_state(self,):
         """ get the display mode """
-        return self.machine_state
+        return self.snapshot.machine_state
 
-    def set_mode(self, mode):
-        """ set the display mode """
-        self.last_mode = self.current_mode
-        self.current_mode = mode
-        self.start_time = time.time()
+    def set_mode(self, mode, override=False):
+        """ request a new display mode; fire and panic are kept unless overridden """
+        if override:
+            self.transitions.append((OVERRIDE_MODE, mode))
+        else:
+            self.transitions.append((SET_MODE, mode))
+        self.wake.set()
 
     def restore_mode(self,):
-        """ set or override the display mode """
-        self.current_mode = self.last_mode
-        self.start_time = time.time()
+        """ request a return to the last display mode """
+        self.transitions.append((RESTORE_MODE, None))
+        self.wake.set()
+
+    def end_text(self,):
+        """ request a return from a finished text message; ignored if another mode took over """
+        self.transitions.append((END_TEXT, None))
+        self.wake.set()
+
+    def wait_for_transition(self, timeout=None):
+        """ block the display thread until a transition is queued or wake is set """
+        self.wake.clear()
+        if not self.transitions:
+            self.wake.wait(timeout)
 
     def get_mode(self,):
         """ get current the display mode """
-        return self.current_mode
-
-    def evaluate(self,):
-        """ initialize and start the fibinnocci display """
-        now_time = time.time()
-        elapsed = now_time - self.start_time
-        if elapsed > 60:
-            self.last_mode = self.current_mode
-            self.current_mode = self.current_mode + 1
-            self.start_time = now_time
-            if self.current_mode > LIFE_MODE:
-                self.current_mode = FIBONACCI_MODE
+        return self.snapshot.current_mode
+
+    def get_version(self,):
+        """ number of transitions applied so far """
+        return self.snapshot.version
+
+    def publish(self, machine_state, current_mode, last_mode, start_time):
+        """ replace the snapshot in a single reference assignment """
+        self.snapshot = ModeSnapshot(self.snapshot.version + 1, machine_state,
+                                     current_mode, last_mode, start_time)
+
+    def apply_transitions(self,):
+        """ apply queued transitions; only called from the display thread
+
+            Text is never kept as the last mode, so restoring after an alarm
+            that interrupted a message goes back to the mode before the text. """
+        while self.transitions:
+            action, value = self.transitions.popleft()
+            snap = self.snapshot
+            if action == SET_STATE:
+                self.publish(value, snap.current_mode, snap.last_mode, snap.start_time)
+            elif action == END_TEXT:
+                if snap.current_mode == TEXT_MODE:
+                    self.publish(snap.machine_state, snap.last_mode, snap.last_mode,
+                                 self.sync.shared())
+            elif action == RESTORE_MODE:
+                self.publish(snap.machine_state, snap.last_mode, snap.last_mode, self.sync.shared())
+            elif action == SET_MODE and snap.current_mode in (FIRE_MODE, PANIC_MODE):
+                continue
+            elif value == snap.current_mode:
+                # repeating the current mode must not make it its own last mode
+                self.publish(snap.machine_state, value, snap.last_mode, self.sync.shared())
+            elif snap.current_mode == TEXT_MODE:
+                self.publish(snap.machine_state, value, snap.last_mode, self.sync.shared())
+            else:
+                self.publish(snap.machine_state, value, snap.current_mode, self.sync.shared())
+        return self.snapshot
+
+    def evaluate(self, period=0.0):
+        """ rotate the demo modes on shared ROTATION_SECONDS boundaries
+
+            The mode is picked by the boundary's index so synced clocks show
+            the same pattern. A boundary due within period, the time until the
+            next frame, is waited for; one missed by a slow frame rotates late.
+            Only called from the display thread. """
+        snap = self.snapshot
+        now_time = self.sync.shared()
+        index = self.sync.next_boundary(ROTATION_SECONDS)
+        boundary = index * ROTATION_SECONDS
+        if boundary - now_time > period:
+            index -= 1
+            boundary -= ROTATION_SECONDS
+            if boundary <= snap.start_time:
+                return
+        if boundary - snap.start_time < MINIMUM_DWELL_SECONDS:
+            return
+        self.sync.sleep_until(boundary)
+        mode = self.demo_modes[index % len(self.demo_modes)]
+        self.publish(snap.machine_state, mode, snap.current_mode, boundary)
 #pylint: disable=too-many-instance-attributes
 
 class Led8x8Controller:
     """ Idle or sleep pattern """
 
-    def __init__(self, matrix8x8,):
-        """ create initial conditions and saving display and I2C lock """
+    def __init__(self, matrix8x8, supervisor=None, sync=None, journal=None, governor=None,
+                 demo_modes=DEMO_MODES):
+        """ create initial conditions and saving display and I2C lock
+
+            journal is an optional motionjournal.MotionJournal that keeps
+            motion history and seeds the heatmap across restarts. governor
+            is a rendergovernor.RenderGovernor, created when not given.
+            demo_modes is the rotation, DITHER_DEMO_MODES to include dithering. """
+        #pylint: disable=too-many-arguments
         self.matrix8x8 = matrix8x8
+        self.sync = sync if sync is not None else timesync.SharedClock()
+        if supervisor is None:
+            supervisor = devicehealth.HealthSupervisor()
+        self.health = supervisor.register("matrix8x8", self.matrix8x8, self.restore_brightness)
         self.matrix8x8.clear()
-        self.mode_controller = ModeController()
+        self.mode_controller = ModeController(self.sync, demo_modes)
         self.idle = led8x8idle.Led8x8Idle(self.matrix8x8)
-        self.fire = led8x8flash.Led8x8Flash(self.matrix8x8, RED)
-        self.panic = led8x8flash.Led8x8Flash(self.matrix8x8, YELLOW)
+        self.fire = led8x8flash.Led8x8Flash(self.matrix8x8, RED, self.sync)
+        self.panic = led8x8flash.Led8x8Flash(self.matrix8x8, YELLOW, self.sync)
         self.fib = led8x8fibonacci.Led8x8Fibonacci(self.matrix8x8)
-        self.motion = led8x8motion.Led8x8Motion(self.matrix8x8)
+        self.heatmap = motionjournal.DailyHeatmap()
+        if journal is not None:
+            self.heatmap.load(journal)
+        self.motion = led8x8motion.Led8x8Motion(self.matrix8x8, journal, self.heatmap)
+        self.heatmap_pattern = led8x8heatmap.Led8x8Heatmap(self.matrix8x8, self.heatmap)
         self.wopr = led8x8wopr.Led8x8Wopr(self.matrix8x8)
         self.life = led8x8life.Led8x8Life(self.matrix8x8)
-        self.error_count = 0
+        self.text = led8x8text.Led8x8Text(self.matrix8x8)
+        self.prime = led8x8prime.Led8x8Prime(self.matrix8x8)
+        self.dither = led8x8dither.Led8x8Dither(self.matrix8x8)
+        self.jitter = metrics.JitterStats("matrix8x8_jitter")
+        self.wakeups = metrics.WakeupCounter("matrix8x8")
+        self.heartbeat = watchdog.Heartbeat("matrix8x8")
+        self.governor = governor if governor is not None else rendergovernor.RenderGovernor()
+        self.governor.watch(self.heartbeat)
+        self.low_power = False
+        # the motion pattern's constructor sets the brightness last
+        self.brightness = led8x8motion.BRIGHTNESS
 
     def reset(self,):
         """ initialize to starting state and set brightness """
         self.mode_controller.set_state(DEMO_STATE)
-        self.mode_controller.set_mode(FIBONACCI_MODE)
+        self.mode_controller.set_mode(FIBONACCI_MODE, True)
 
     def display_thread(self,):
         """ display the series as a 64 bit image with alternating colored pixels """
+        version = -1
         while True:
+            self.wakeups.wake()
             try:
-                mode = self.mode_controller.get_mode()
+                snap = self.mode_controller.apply_transitions()
+                if snap.version != version:
+                    version = snap.version
+                    self.jitter.restart()
+                    self.apply_brightness(snap)
+                self.jitter.frame()
+                self.governor.poll()
+                self.heartbeat.beat(self.frame_period(snap))
+                mode = snap.current_mode
                 if mode == FIRE_MODE:
                     self.fire.display()
                 elif mode == PANIC_MODE:
                     self.panic.display()
+                elif mode == TEXT_MODE:
+                    if self.text.display():
+                        self.mode_controller.end_text()
                 else:
-                    state = self.mode_controller.get_state()
+                    state = snap.machine_state
                     if state == SECURITY_STATE:
                         self.motion.display()
                     elif state == IDLE_STATE:
-                        self.idle.display()
+                        if self.low_power:
+                            self.sleep_blank()
+                        else:
+                            self.idle.display()
                     else: #demo
                         if mode == FIBONACCI_MODE:
                             self.fib.display()
@@ -151,26 +338,101 @@ class Led8x8Controller:
                             self.wopr.display()
                         elif mode == LIFE_MODE:
                             self.life.display()
-                        self.mode_controller.evaluate()
+                        elif mode == PRIME_MODE:
+                            self.prime.display()
+                        elif mode == HEATMAP_MODE:
+                            self.heatmap_pattern.display()
+                        elif mode == DITHER_MODE:
+                            self.dither.display()
+                        self.mode_controller.evaluate(DEMO_PERIODS.get(mode, 0.0))
+                self.throttle(snap)
+                self.health.success()
             #pylint: disable=broad-except
             except Exception as ex:
-                LOGGER.info('Led8x8Controller: thread exception: %s %s', str(ex),
-                            str(self.error_count))
-                self.error_count += 1
-                if self.error_count < 10:
-                    time.sleep(1.0)
-                    self.matrix8x8.begin()
-                else:
-                    break
+                self.heartbeat.beat(self.health.longest_delay() + FRAME_SLACK)
+                self.health.failure(ex)
+
+    def frame_period(self, snap):
+        """ seconds until the frame after this one; None while blanked waiting for a transition """
+        mode = snap.current_mode
+        if mode in (FIRE_MODE, PANIC_MODE):
+            period = led8x8flash.UPDATE_RATE_SECONDS
+        elif mode == TEXT_MODE:
+            period = self.text.message.step_seconds
+        elif snap.machine_state == SECURITY_STATE:
+            period = led8x8motion.UPDATE_RATE_SECONDS
+        elif snap.machine_state == IDLE_STATE:
+            if self.low_power:
+                return None
+            period = led8x8idle.UPDATE_RATE_SECONDS
+        else:
+            period = DEMO_PERIODS.get(mode, led8x8fibonacci.UPDATE_RATE_SECONDS)
+        return period * self.governor.stretch(self.tier(snap)) + FRAME_SLACK
+
+    def pattern_brightness(self, snap):
+        """ brightness of the pattern shown for snap """
+        mode = snap.current_mode
+        if mode in (FIRE_MODE, PANIC_MODE):
+            return led8x8flash.BRIGHTNESS
+        if mode == TEXT_MODE:
+            return led8x8text.BRIGHTNESS
+        if snap.machine_state == SECURITY_STATE:
+            return led8x8motion.BRIGHTNESS
+        if snap.machine_state == IDLE_STATE:
+            return led8x8idle.BRIGHTNESS
+        return DEMO_BRIGHTNESS.get(snap.current_mode, led8x8fibonacci.BRIGHTNESS)
+
+    def apply_brightness(self, snap):
+        """ switch to the brightness of the pattern shown for snap when it differs """
+        brightness = self.pattern_brightness(snap)
+        if brightness != self.brightness:
+            self.brightness = brightness
+            self.matrix8x8.set_brightness(brightness)
+
+    def tier(self, snap):
+        """ governor tier of the pattern shown for snap; None for alarms and text """
+        mode = snap.current_mode
+        if mode in (FIRE_MODE, PANIC_MODE, TEXT_MODE):
+            return None
+        if snap.machine_state == SECURITY_STATE:
+            return rendergovernor.SECURITY_TIER
+        if snap.machine_state == IDLE_STATE:
+            return None if self.low_power else rendergovernor.AMBIENT_TIER
+        return DEMO_TIERS.get(mode, rendergovernor.DEMO_TIER)
+
+    def throttle(self, snap):
+        """ hold the frame longer while the governor stretches this pattern
+
+            The wait ends at once when a transition is queued, so an alarm
+            is shown as soon as it arrives. A dither step would leave one
+            sub-frame held for the wait, so it holds its flat frame instead. """
+        stretch = self.governor.stretch(self.tier(snap))
+        if stretch > 1:
+            if snap.machine_state == DEMO_STATE and snap.current_mode == DITHER_MODE:
+                self.dither.show_flat()
+            period = self.frame_period(snap) - FRAME_SLACK
+            self.mode_controller.wait_for_transition(period * (stretch - 1) / stretch)
+
+    def sleep_blank(self,):
+        """ blank the matrix once then sleep until the next transition """
+        if any(self.matrix8x8.buffer):
+            self.matrix8x8.clear()
+            self.matrix8x8.write_display()
+        self.mode_controller.wait_for_transition()
+        self.jitter.restart()
+
+    def set_low_power(self, low_power):
+        """ at night the idle state blanks the matrix instead of animating it """
+        self.low_power = low_power
+        self.mode_controller.wake.set()
+
+    def restore_brightness(self,):
+        """ begin() resets the backpack to full brightness; go back to the active pattern's """
+        self.matrix8x8.set_brightness(self.brightness)
 
     def set_mode(self, mode, override=False):
-        """ set display mode """
-        if override:
-            self.mode_controller.set_mode(mode)
-        current_mode = self.mode_controller.get_mode()
-        if current_mode in (FIRE_MODE, PANIC_MODE):
-            return
-        self.mode_controller.set_mode(mode)
+        """ set display mode; fire and panic are only replaced by an override """
+        self.mode_controller.set_mode(mode, override)
 
     def restore_mode(self,):
         """ return to last mode; usually after idle, fire or panic """
@@ -184,15 +446,26 @@ class Led8x8Controller:
         """ get the current machine state """
         return self.mode_controller.get_state()
 
-    def update_motion(self, topic):
-        """ update the countdown timer for the topic (room)"""
-        self.motion.motion_detected(topic)
+    def show_text(self, text, color=YELLOW, speed=led8x8text.SCROLL_SPEED):
+        """ scroll a message once then return to the last mode """
+        self.text.set_message(text, color, speed)
+        self.mode_controller.set_mode(TEXT_MODE)
+
+    def update_motion(self, topic, active=True, replay=False):
+        """ update the countdown timer for the topic (room); replay marks a retained message """
+        self.motion.motion_detected(topic, active, replay)
+
+    def time_beacon(self, payload, received=None):
+        """ align frames and rotations with the clock publishing time beacons """
+        self.sync.on_beacon(payload, received)
+
+    def update_occupancy(self, payload, replay=False):
+        """ update the countdown timers from a house occupancy bitmap """
+        self.motion.occupancy_detected(payload, replay)
 
     def run(self):
         """ start the display thread and make it a daemon """
-        display = Thread(target=self.display_thread)
-        display.daemon = True
-        display.start()
+        timesource.spawn(self.display_thread)
 
 if __name__ == '__main__':
     sys.exit()
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+""" Grayscale on an Adafruit 8x8 bicolor backpack by temporal dithering """
+
+import sys
+import time
+import argparse
+
+import timesource
+
+import metrics
+
+BRIGHTNESS = 15
+
+# one content frame; sub-frames are interleaved for this long per display call
+UPDATE_RATE_SECONDS = 0.25
+
+# sub-frames per dither cycle; each color plane gets SUBFRAMES + 1 levels
+SUBFRAMES = 4
+
+# 240 sub-frames a second puts the full dither cycle at 60 Hz
+SUBFRAME_SECONDS = 1.0 / 240
+
+# behind by more than a cycle, e.g. returning to the mode, restart the timeline
+RESYNC_SECONDS = SUBFRAME_SECONDS * SUBFRAMES
+
+# sub-frame lateness is far below the frame scale of metrics.LATENESS_BUCKETS
+DITHER_BUCKETS = (0.0005, 0.001, 0.002, 0.004, 0.008, 0.016)
+
+# bits on the bus for one block write of the display RAM: address, register and
+# 16 data bytes with an acknowledge each, plus start and stop
+BLOCK_WRITE_BITS = (2 + 16) * 9 + 2
+
+# the clock shares the bus, at worst a tenths countdown writing ten times a second
+CLOCK_WRITES_PER_SECOND = 10
+
+def bit_reversed(count):
+    """ sub-frame order that spreads each level's lit sub-frames evenly over a cycle """
+    width = count.bit_length() - 1
+    return tuple(int(format(index, '0{}b'.format(width))[::-1], 2) for index in range(count))
+
+# level L lights sub-frame s when SUBFRAME_ORDER[s] < L, so level 2 of 4 is on every
+# other sub-frame and flickers at twice the cycle rate rather than the cycle rate
+SUBFRAME_ORDER = bit_reversed(SUBFRAMES)
+
+# the sub-frame lighting every cell at half level or above, the nearest flat frame
+FLAT_SUBFRAME = SUBFRAME_ORDER.index(SUBFRAMES // 2 - 1)
+
+# 64 bit row mask bit of each cell, cells indexed x * 8 + y as in FrameBuffer.map_cells
+CELL_BITS = tuple(1 << (((index & 7) << 3) | (index >> 3)) for index in range(64))
+
+def level_masks(cells):
+    """ one 64 bit mask of the cells at each level, levels past SUBFRAMES clamped """
+    masks = [0] * (SUBFRAMES + 1)
+    for index, level in enumerate(cells):
+        if level:
+            masks[level if level < SUBFRAMES else SUBFRAMES] |= CELL_BITS[index]
+    return masks
+
+def build_subframes(green, red):
+    """ precompute the HT16K33 buffers of one dither cycle from two planes of levels
+
+        green and red hold 64 levels from 0 to SUBFRAMES indexed x * 8 + y.
+        The result is SUBFRAMES 16 byte buffers in the bicolor layout, green row
+        y at byte 2y and red row y at byte 2y+1, ready to copy and write. """
+    green_masks = level_masks(green)
+    red_masks = level_masks(red)
+    subframes = []
+    for order in SUBFRAME_ORDER:
+        buffer = bytearray(16)
+        green_plane = 0
+        red_plane = 0
+        for level in range(order + 1, SUBFRAMES + 1):
+            green_plane |= green_masks[level]
+            red_plane |= red_masks[level]
+        buffer[0::2] = green_plane.to_bytes(8, 'little')
+        buffer[1::2] = red_plane.to_bytes(8, 'little')
+        subframes.append(bytes(buffer))
+    return tuple(subframes)
+
+def triangle(value):
+    """ 0 up to SUBFRAMES and back down over a period of 2 * SUBFRAMES """
+    value %= 2 * SUBFRAMES
+    return value if value <= SUBFRAMES else 2 * SUBFRAMES - value
+
+class Led8x8Dither:
+    """ crossing green and red diagonal ramps showing every level of both planes
+
+        Each display call precomputes one dither cycle and then only copies
+        the buffers to the matrix at SUBFRAME_SECONDS deadlines, so the sub-frame
+        path is a slice assignment and one block write. Under a frame recorder
+        the sub-frames bypass it and only the flat frame of each step is kept. """
+
+    def __init__(self, matrix8x8):
+        """ create the dither object """
+        self.matrix = matrix8x8
+        self.step = 0
+        self.position = 0
+        self.subframes = build_subframes(bytes(64), bytes(64))
+        self.deadline = timesource.monotonic()
+        self.lateness = metrics.LatenessHistogram("dither_lateness", DITHER_BUCKETS)
+        self.writes = metrics.LatencyStats("dither_write")
+        self.dropped = 0
+
+    def reset(self,):
+        """ initialize to starting state and set brightness """
+        self.step = 0
+        self.position = 0
+        self.deadline = timesource.monotonic()
+        self.matrix.set_brightness(BRIGHTNESS)
+
+    def scene(self,):
+        """ green and red levels of the current step """
+        green = bytearray(64)
+        red = bytearray(64)
+        for index in range(64):
+            xpixel = index >> 3
+            ypixel = index & 7
+            green[index] = triangle(xpixel + ypixel + self.step)
+            red[index] = triangle(xpixel - ypixel + self.step + SUBFRAMES)
+        return green, red
+
+    def show_flat(self,):
+        """ write the flat frame of the current step, held while throttled """
+        self.matrix.buffer[:] = self.subframes[FLAT_SUBFRAME]
+        self.matrix.write_display()
+
+    def display(self,):
+        """ interleave the sub-frames of the next step for UPDATE_RATE_SECONDS
+
+            A slot whose deadline already passed by a whole sub-frame is
+            dropped, which only lengthens the sub-frame already shown. """
+        self.subframes = build_subframes(*self.scene())
+        self.step += 1
+        write = getattr(self.matrix, 'write_unrecorded', None)
+        if write is None:
+            write = self.matrix.write_display
+        else:
+            self.show_flat()
+        now = timesource.monotonic()
+        if now - self.deadline > RESYNC_SECONDS:
+            self.deadline = now
+        end = self.deadline + UPDATE_RATE_SECONDS
+        while self.deadline < end:
+            delay = self.deadline - timesource.monotonic()
+            if delay > 0:
+                timesource.sleep(delay)
+            late = timesource.monotonic() - self.deadline
+            self.deadline += SUBFRAME_SECONDS
+            if late > SUBFRAME_SECONDS:
+                self.dropped += 1
+                continue
+            self.lateness.record(max(late, 0.0))
+            started = time.perf_counter()
+            self.matrix.buffer[:] = self.subframes[self.position]
+            write()
+            self.writes.record(time.perf_counter() - started)
+            self.position = (self.position + 1) % SUBFRAMES
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        return {"lateness": self.lateness.summary(), "write": self.writes.summary(),
+                "dropped": self.dropped}
+
+def benchmark(seconds, hardware=False):
+    """ sustained sub-frame rate, CPU and bus cost on the simulated or the real matrix """
+    #pylint: disable=import-outside-toplevel
+    import ht16k33
+    if not hardware:
+        import simulatedhw
+        simulatedhw.install()
+    from Adafruit_LED_Backpack import BicolorMatrix8x8
+    matrix = ht16k33.install_block_writes(BicolorMatrix8x8.BicolorMatrix8x8(address=0x70))
+    matrix.begin()
+    count = 1000
+    pattern = Led8x8Dither(matrix)
+    started = time.perf_counter()
+    for _ in range(count):
+        build_subframes(*pattern.scene())
+    build = (time.perf_counter() - started) / count
+    pattern.reset()
+    cpu = time.process_time()
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        pattern.display()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    rate = pattern.writes.count / elapsed
+    lateness = pattern.lateness.summary()
+    print("{} matrix, {:.1f} s".format("real" if hardware else "simulated", elapsed))
+    print("  sub-frames {:.0f}/s target {:.0f}/s dropped {}".format(
+        rate, 1.0 / SUBFRAME_SECONDS, pattern.dropped))
+    print("  cycle build {:.3f} ms write mean {:.3f} ms max {:.3f} ms".format(
+        build * 1000, pattern.writes.mean() * 1000, pattern.writes.maximum * 1000))
+    print("  lateness mean {:.3f} ms max {:.3f} ms {}".format(
+        lateness["mean"] * 1000, lateness["max"] * 1000, lateness["histogram"]))
+    print("  cpu {:.1f}% of one core".format(100.0 * cpu / elapsed))
+    for bus_hz in (100000, 400000):
+        print("  bus at {} kHz {:.0f}% busy, {:.1f}% of it the clock".format(
+            bus_hz // 1000, 100.0 * (rate + CLOCK_WRITES_PER_SECOND) * BLOCK_WRITE_BITS / bus_hz,
+            100.0 * CLOCK_WRITES_PER_SECOND * BLOCK_WRITE_BITS / bus_hz))
+
+def main():
+    """ run the benchmark from the command line """
+    parser = argparse.ArgumentParser(description=benchmark.__doc__)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--hardware", action="store_true",
+                        help="drive the real backpack at 0x70 instead of a simulated one")
+    args = parser.parse_args()
+    benchmark(args.seconds, args.hardware)
+
+if __name__ == '__main__':
+    main()
+    sys.exit()
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """ Display the fibonacci series as a 64 bit pattern on an Adafruit 8x8 LED backpack """
 
-import time
+import timesource
 
 BRIGHTNESS = 5
 
@@ -31,7 +31,7 @@ class Led8x8Fibonacci:
 
     def display(self,):
         """ display the series as a 64 bit image with alternating colored pixels """
-        time.sleep(UPDATE_RATE_SECONDS)
+        timesource.sleep(UPDATE_RATE_SECONDS)
         for ypixel in range(0, 8):
             for xpixel in range(0, 8):
                 self.iterations += 1
@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 """ Display full screen flash color pattern on an Adafruit 8x8 LED backpack """
 
-import time
+import led8x8framebuffer
+
+import timesync
 
 BRIGHTNESS = 5
 
@@ -11,12 +13,18 @@ PING = 0
 PONG = 1
 
 class Led8x8Flash:
-    """ flash pattern based on color and time interval  """
+    """ flash pattern based on color and time interval
+
+        Frames land on multiples of UPDATE_RATE_SECONDS of the shared timeline
+        and even frames are lit, so synced clocks flash in step. """
 
-    def __init__(self, matrix8x8, color):
+    def __init__(self, matrix8x8, color, sync=None):
         """ create initial conditions and saving display and I2C lock """
         self.matrix = matrix8x8
         self.alternate = PING
+        self.index = None
+        self.sync = sync if sync is not None else timesync.SharedClock()
+        self.frame = led8x8framebuffer.FrameBuffer()
         if color < 0:
             self.color = 0
             raise Exception('color must be greater than 0 color was: {}'.format(color))
@@ -29,6 +37,7 @@ class Led8x8Flash:
     def reset(self,):
         """ initialize to starting state and set brightness """
         self.alternate = PING
+        self.index = None
 
     def set_color(self, color):
         """ initialize to starting state and set brightness """
@@ -42,19 +51,23 @@ class Led8x8Flash:
             self.color = color
 
     def display(self,):
-        """ display the series as a 64 bit image with alternating colored pixels """
-        time.sleep(UPDATE_RATE_SECONDS)
+        """ display the series as a 64 bit image with alternating colored pixels
+
+            When the shared timeline steps back, e.g. on the first beacon, the
+            last index is far ahead; it is dropped rather than waited for, and
+            no wait is longer than one frame. """
+        index = self.sync.next_boundary(UPDATE_RATE_SECONDS, self.index)
+        upcoming = self.sync.next_boundary(UPDATE_RATE_SECONDS)
+        if index - upcoming > 1:
+            index = upcoming
+        self.index = index
+        self.sync.sleep_until(index * UPDATE_RATE_SECONDS, UPDATE_RATE_SECONDS)
+        self.alternate = PING if self.index % 2 == 0 else PONG
         if self.alternate == PING:
-            self.alternate = PONG
+            self.frame.fill(self.color)
         else:
-            self.alternate = PING
-        for xpixel in range(0, 8):
-            for ypixel in range(0, 8):
-                if self.alternate == PING:
-                    self.matrix.set_pixel(xpixel, ypixel, self.color)
-                else:
-                    self.matrix.set_pixel(xpixel, ypixel, 0)
-        self.matrix.write_display()
+            self.frame.clear()
+        self.frame.show(self.matrix)
 
 if __name__ == '__main__':
     exit()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+""" Packed red and green planes for the bicolor 8x8 matrix """
+
+import sys
+
+BLACK = 0
+GREEN = 1
+RED = 2
+YELLOW = 3
+
+FULL_ROW = 0xFF
+
+# same layout as the HT16K33 bicolor matrix buffer: green row y at byte 2y
+# and red row y at byte 2y+1, bit x of each row is column x
+GREEN_ROWS = slice(0, 16, 2)
+RED_ROWS = slice(1, 16, 2)
+
+def mask_rows(mask):
+    """ accept a 64 bit mask (row y in bits 8y..8y+7) or eight row bytes """
+    if isinstance(mask, int):
+        return mask.to_bytes(8, 'little')
+    return bytes(mask)
+
+class FrameBuffer:
+    """ 8x8 bicolor frame stored as two planes of eight packed row bytes """
+
+    __slots__ = ('green', 'red')
+
+    def __init__(self,):
+        """ start with a black frame """
+        self.green = bytearray(8)
+        self.red = bytearray(8)
+
+    def fill(self, color):
+        """ set every pixel to one color """
+        self.green[:] = bytes([FULL_ROW if color & GREEN else 0]) * 8
+        self.red[:] = bytes([FULL_ROW if color & RED else 0]) * 8
+
+    def clear(self,):
+        """ set every pixel to black """
+        self.fill(BLACK)
+
+    def set_pixel(self, xpixel, ypixel, color):
+        """ set one pixel, the slow path kept for sparse patterns """
+        bit = 1 << xpixel
+        if color & GREEN:
+            self.green[ypixel] |= bit
+        else:
+            self.green[ypixel] &= ~bit
+        if color & RED:
+            self.red[ypixel] |= bit
+        else:
+            self.red[ypixel] &= ~bit
+
+    def get_pixel(self, xpixel, ypixel):
+        """ color of one pixel """
+        green = (self.green[ypixel] >> xpixel) & 1
+        red = (self.red[ypixel] >> xpixel) & 1
+        return green * GREEN + red * RED
+
+    def blit(self, other):
+        """ copy another frame over this one """
+        self.green[:] = other.green
+        self.red[:] = other.red
+
+    def or_mask(self, mask, color):
+        """ light the masked pixels, mixing with what is already lit """
+        rows = mask_rows(mask)
+        for plane, bit in ((self.green, GREEN), (self.red, RED)):
+            if color & bit:
+                for ypixel in range(8):
+                    plane[ypixel] |= rows[ypixel]
+
+    def and_mask(self, mask):
+        """ keep only the masked pixels in both planes """
+        rows = mask_rows(mask)
+        for plane in (self.green, self.red):
+            for ypixel in range(8):
+                plane[ypixel] &= rows[ypixel]
+
+    def xor_mask(self, mask, color):
+        """ toggle the color bits of the masked pixels """
+        rows = mask_rows(mask)
+        for plane, bit in ((self.green, GREEN), (self.red, RED)):
+            if color & bit:
+                for ypixel in range(8):
+                    plane[ypixel] ^= rows[ypixel]
+
+    def paint(self, mask, color):
+        """ set the masked pixels to exactly one color, leaving the rest """
+        rows = mask_rows(mask)
+        for plane, bit in ((self.green, GREEN), (self.red, RED)):
+            for ypixel in range(8):
+                if color & bit:
+                    plane[ypixel] |= rows[ypixel]
+                else:
+                    plane[ypixel] &= ~rows[ypixel]
+
+    def shift(self, dx, dy, wrap=False):
+        """ move the frame dx columns right and dy rows down, wrapping or dropping pixels """
+        for plane in (self.green, self.red):
+            rows = bytes(plane)
+            for ypixel in range(8):
+                source = ypixel - dy
+                if wrap:
+                    row = rows[source % 8]
+                    shift = dx % 8
+                    plane[ypixel] = ((row << shift) | (row >> (8 - shift))) & FULL_ROW
+                elif 0 <= source < 8:
+                    row = rows[source]
+                    plane[ypixel] = (row << dx if dx >= 0 else row >> -dx) & FULL_ROW
+                else:
+                    plane[ypixel] = 0
+
+    def rotate(self, quarter_turns=1):
+        """ rotate the frame clockwise by multiples of 90 degrees """
+        for _ in range(quarter_turns % 4):
+            for plane in (self.green, self.red):
+                rows = bytes(plane)
+                for ypixel in range(8):
+                    row = 0
+                    for xpixel in range(8):
+                        row |= ((rows[7 - xpixel] >> ypixel) & 1) << xpixel
+                    plane[ypixel] = row
+
+    def map_cells(self, cells, palette):
+        """ color 64 values indexed x * 8 + y, values past the palette use its last color """
+        last = len(palette) - 1
+        green = bytearray(8)
+        red = bytearray(8)
+        for index, value in enumerate(cells):
+            if value:
+                color = palette[value if value < last else last]
+                bit = 1 << (index >> 3)
+                if color & GREEN:
+                    green[index & 7] |= bit
+                if color & RED:
+                    red[index & 7] |= bit
+        self.green[:] = green
+        self.red[:] = red
+
+    def planes(self,):
+        """ the frame as a 64 bit green mask and a 64 bit red mask """
+        return (int.from_bytes(self.green, 'little'), int.from_bytes(self.red, 'little'))
+
+    def show(self, matrix):
+        """ copy both planes straight into the HT16K33 buffer and write it """
+        matrix.buffer[GREEN_ROWS] = self.green
+        matrix.buffer[RED_ROWS] = self.red
+        matrix.write_display()
+
+if __name__ == '__main__':
+    sys.exit()
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+""" Display a week of room motion as a heatmap on an Adafruit 8x8 LED backpack """
+
+import timesource
+
+import led8x8framebuffer
+
+BRIGHTNESS = 5
+
+UPDATE_RATE_SECONDS = 1.0
+
+BLACK = 0
+GREEN = 1
+YELLOW = 3
+RED = 2
+
+# no motion, then quiet to busy relative to the busiest room day
+HEAT_PALETTE = (BLACK, GREEN, YELLOW, RED)
+
+class Led8x8Heatmap:
+    """ one column per day with today on the right, one row per room
+
+        The heatmap is kept up to date as motion arrives, so a frame only
+        maps its 64 levels and is remapped only when they changed. """
+
+    def __init__(self, matrix8x8, heatmap):
+        """ heatmap is the motionjournal.DailyHeatmap fed by the motion pattern """
+        self.matrix = matrix8x8
+        self.heatmap = heatmap
+        self.frame = led8x8framebuffer.FrameBuffer()
+        self.version = None
+
+    def reset(self,):
+        """ initialize to starting state and set brightness """
+        self.version = None
+        self.matrix.set_brightness(BRIGHTNESS)
+
+    def display(self,):
+        """ roll over at midnight and show the current levels """
+        timesource.sleep(UPDATE_RATE_SECONDS)
+        self.heatmap.advance(timesource.time())
+        if self.heatmap.version != self.version:
+            self.version = self.heatmap.version
+            self.frame.map_cells(self.heatmap.levels(), HEAT_PALETTE)
+        self.frame.show(self.matrix)
+
+if __name__ == '__main__':
+    exit()
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 """ Display full screen flash color pattern on an Adafruit 8x8 LED backpack """
 
-import time
+import timesource
 
 BRIGHTNESS = 5
 
@@ -27,7 +27,7 @@ class Led8x8Idle:
 
     def display(self,):
         """ display the series as a 64 bit image with alternating colored pixels """
-        time.sleep(UPDATE_RATE_SECONDS)
+        timesource.sleep(UPDATE_RATE_SECONDS)
         self.matrix.clear()
         self.matrix.set_pixel(self.lastx, self.lasty, GREEN)
         self.lasty += 1
@@ -1,7 +1,12 @@
 #!/usr/bin/python3
 """ Display the Game of Life pattern on an Adafruit 8x8 LED backpack """
 
-import time
+import timesource
+import random
+import logging
+from collections import deque
+
+import led8x8framebuffer
 
 BRIGHTNESS = 5
 
@@ -9,167 +14,191 @@ UPDATE_RATE_SECONDS = 0.3
 
 PATTERN_RATE = 10
 
+# generations of packed board hashes kept to detect still lifes and oscillators
+HISTORY_SIZE = 16
+
+# consecutive cyclic generations shown before a new seed or soup is spawned
+STAGNANT_GENERATIONS = 4
+
+# percentage of live cells in a random soup
+SOUP_DENSITY = 35
+
 BLACK = 0
 GREEN = 1
 YELLOW = 3
 RED = 2
 
+# newborn cells are green, young cells yellow and cells of age five or more red
+AGE_PALETTE = (BLACK, GREEN, YELLOW, YELLOW, YELLOW, RED)
+
+# live cells keep counting their age up to here so a cell fits in a byte
+MAX_AGE = 255
+
+# starting boards, one string per column x with '#' for a live cell at row y
+SEEDS = (
+    # glider
+    ("..#.....", "...#....", ".###....", "........",
+     "........", "........", "........", "........"),
+    # oscilator1, shown twice in each round of seeds
+    ("........", "........", "........", ".#####..",
+     "........", "........", "........", "........"),
+    ("........", "........", "........", ".#####..",
+     "........", "........", "........", "........"),
+    # oscilator2
+    ("........", "........", "........", ".######.",
+     "........", "........", "........", "........"),
+    # oscilator3
+    (".....###", "........", "........", "...##...",
+     "...#....", "......#.", ".....##.", "........"),
+    # toad
+    ("........", "...#....", ".#..#...", ".#..#...",
+     "..#.....", "........", "....###.", "........"),
+)
+
+LOGGER = logging.getLogger(__name__)
+
 class Led8x8Life:
-    """ Game of Life pattern based on john Conway """
+    """ Game of Life pattern based on john Conway
+
+        Each generation is a bytearray of 64 cell ages indexed x * 8 + y. """
 
     def __init__(self, matrix8x8):
         """ create initial conditions and saving display and I2C lock """
         self.matrix = matrix8x8
         self.matrix.set_brightness(BRIGHTNESS)
-        self.current_gen = [[0 for x in range(8)] for y in range(8)]
-        self.next_gen = [[0 for x in range(8)] for y in range(8)]
+        self.current_gen = bytearray(64)
+        self.next_gen = bytearray(64)
         self.pattern = 0
-        self.pattern_switch_time = time.time()
-        self.dispatch = {
-            0: self.glider,
-            1: self.oscilator1,
-            2: self.oscilator1,
-            3: self.oscilator2,
-            4: self.oscilator3,
-            5: self.toad
-        }
-
-    def glider(self,):
-        """ initialize to starting state and set brightness """
-        self.next_gen[0] = [0, 0, 1, 0, 0, 0, 0, 0]
-        self.next_gen[1] = [0, 0, 0, 1, 0, 0, 0, 0]
-        self.next_gen[2] = [0, 1, 1, 1, 0, 0, 0, 0]
-        self.next_gen[3] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[4] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[5] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[6] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[7] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.copy()
-
-    def oscilator1(self,):
-        """ initialize to starting state and set brightness """
-        self.next_gen[0] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[1] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[2] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[3] = [0, 1, 1, 1, 1, 1, 0, 0]
-        self.next_gen[4] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[5] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[6] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[7] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.copy()
-
-    def oscilator2(self,):
-        """ initialize to starting state and set brightness """
-        self.next_gen[0] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[1] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[2] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[3] = [0, 1, 1, 1, 1, 1, 1, 0]
-        self.next_gen[4] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[5] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[6] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[7] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.copy()
-
-    def oscilator3(self,):
-        """ initialize to starting state and set brightness """
-        self.next_gen[0] = [0, 0, 0, 0, 0, 1, 1, 1]
-        self.next_gen[1] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[2] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[3] = [0, 0, 0, 1, 1, 0, 0, 0]
-        self.next_gen[4] = [0, 0, 0, 1, 0, 0, 0, 0]
-        self.next_gen[5] = [0, 0, 0, 0, 0, 0, 1, 0]
-        self.next_gen[6] = [0, 0, 0, 0, 0, 1, 1, 0]
-        self.next_gen[7] = [0, 0, 0, 0, 0, 0, 0, 0]
+        self.pattern_switch_time = timesource.time()
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.stagnant = 0
+        self.last_period = 0
+        self.periods = {}
+        self.soup_next = True
+        self.frame = led8x8framebuffer.FrameBuffer()
+
+    def seed(self, columns):
+        """ start from one of the SEEDS """
+        for xpixel, column in enumerate(columns):
+            for ypixel, cell in enumerate(column):
+                self.next_gen[xpixel * 8 + ypixel] = 1 if cell == '#' else 0
         self.copy()
 
-    def toad(self,):
-        """ initialize to starting state and set brightness """
-        self.next_gen[0] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[1] = [0, 0, 0, 1, 0, 0, 0, 0]
-        self.next_gen[2] = [0, 1, 0, 0, 1, 0, 0, 0]
-        self.next_gen[3] = [0, 1, 0, 0, 1, 0, 0, 0]
-        self.next_gen[4] = [0, 0, 1, 0, 0, 0, 0, 0]
-        self.next_gen[5] = [0, 0, 0, 0, 0, 0, 0, 0]
-        self.next_gen[6] = [0, 0, 0, 0, 1, 1, 1, 0]
-        self.next_gen[7] = [0, 0, 0, 0, 0, 0, 0, 0]
+    def soup(self,):
+        """ seed the board with a random soup of live cells """
+        for index in range(64):
+            self.next_gen[index] = 1 if random.randint(1, 100) <= SOUP_DENSITY else 0
         self.copy()
 
     def spawn(self,):
         """ initialize to starting state and set brightness """
-        self.dispatch[self.pattern]()
-        self.pattern_switch_time = time.time()
-        self.pattern += 1
-        if self.pattern > 5:
-            self.pattern = 0
+        self.history.clear()
+        self.stagnant = 0
+        self.seed(SEEDS[self.pattern])
+        self.pattern_switch_time = timesource.time()
+        self.pattern = (self.pattern + 1) % len(SEEDS)
+
+    def respawn(self,):
+        """ replace a stagnant board, alternating random soups and seeds """
+        if self.soup_next:
+            self.history.clear()
+            self.stagnant = 0
+            self.soup()
+            self.pattern_switch_time = timesource.time()
+        else:
+            self.spawn()
+        self.soup_next = not self.soup_next
+
+    def pack(self,):
+        """ pack the live cells of the current generation into a 64 bit hash """
+        packed = 0
+        for index, cell in enumerate(self.current_gen):
+            if cell:
+                packed |= 1 << index
+        return packed
+
+    def detect_cycle(self,):
+        """ return the period if the current generation was seen recently or 0 """
+        packed = self.pack()
+        period = 0
+        for distance, previous in enumerate(reversed(self.history), start=1):
+            if previous == packed:
+                period = distance
+                break
+        self.history.append(packed)
+        return period
+
+    def check_stagnation(self,):
+        """ respawn once a still life or short oscillator has repeated a few times """
+        period = self.detect_cycle()
+        if period == 0:
+            self.stagnant = 0
+            return False
+        self.stagnant += 1
+        if self.stagnant < STAGNANT_GENERATIONS:
+            return False
+        self.last_period = period
+        self.periods[period] = self.periods.get(period, 0) + 1
+        LOGGER.info('Led8x8Life: period %d detected, respawning', period)
+        self.respawn()
+        return True
 
     def reset(self,):
         """ initialize to starting state and set brightness """
         self.spawn()
 
-    @classmethod
-    def mod(cls, test):
-        """ ensure that the returned coordinate is between 0 and 7 """
-        safe = (test + 8) % 8
-        return safe
-
     def draw(self,):
-        """ display a section of WOPR based on starting and ending rows """
-        for xpixel in range(8):
-            for ypixel in range(8):
-                color = BLACK
-                if self.next_gen[xpixel][ypixel] >= 5:
-                    color = RED
-                elif self.next_gen[xpixel][ypixel] == 1:
-                    color = GREEN
-                elif self.next_gen[xpixel][ypixel] != 0:
-                    color = YELLOW
-                self.matrix.set_pixel(xpixel, ypixel, color)
-        self.matrix.write_display()
+        """ color cells by age and show them in a single frame update """
+        self.frame.map_cells(self.next_gen, AGE_PALETTE)
+        self.frame.show(self.matrix)
 
     def age(self,):
         """ ensure that the returned coordinate is between 0 and 7 """
+        current = self.current_gen
         for i in range(8):
+            column = i * 8
+            right = ((i + 1) & 7) * 8
+            left = ((i - 1) & 7) * 8
             for j in range(8):
+                down = (j + 1) & 7
+                up = (j - 1) & 7
                 alive = 0
-                alive += self.current_gen[self.mod(i+1)][self.mod(j)] != 0
-                alive += self.current_gen[self.mod(i)][self.mod(j+1)] != 0
-                alive += self.current_gen[self.mod(i-1)][self.mod(j)] != 0
-                alive += self.current_gen[self.mod(i)][self.mod(j-1)] != 0
-                alive += self.current_gen[self.mod(i+1)][self.mod(j+1)] != 0
-                alive += self.current_gen[self.mod(i-1)][self.mod(j-1)] != 0
-                alive += self.current_gen[self.mod(i+1)][self.mod(j-1)] != 0
-                alive += self.current_gen[self.mod(i-1)][self.mod(j+1)] != 0
-                if self.current_gen[i][j] != 0:
+                alive += current[right + j] != 0
+                alive += current[column + down] != 0
+                alive += current[left + j] != 0
+                alive += current[column + up] != 0
+                alive += current[right + down] != 0
+                alive += current[left + up] != 0
+                alive += current[right + up] != 0
+                alive += current[left + down] != 0
+                cell = current[column + j]
+                if cell != 0:
                     if (alive < 2) or (alive > 3):
-                        self.next_gen[i][j] = 0
+                        self.next_gen[column + j] = 0
                     else:
-                        self.next_gen[i][j] = self.current_gen[i][j] + 1
+                        self.next_gen[column + j] = min(cell + 1, MAX_AGE)
                 else:
                     if alive == 3:
-                        self.next_gen[i][j] = 1
+                        self.next_gen[column + j] = 1
 
     def copy(self,):
         """ ensure that the returned coordinate is between 0 and 7 """
-        early_spawn = True
-        for i in range(8):
-            for j in range(8):
-                self.current_gen[i][j] = self.next_gen[i][j]
-                if early_spawn:
-                    if self.current_gen[i][j] != 0:
-                        early_spawn = False
-        if early_spawn:
+        self.current_gen[:] = self.next_gen
+        if not any(self.current_gen):
             self.matrix.clear()
             self.matrix.write_display()
             self.spawn()
-            time.sleep(1)
+            timesource.sleep(1)
 
     def display(self,):
         """ display the series as a 64 bit image with alternating colored pixels """
-        time.sleep(UPDATE_RATE_SECONDS)
+        timesource.sleep(UPDATE_RATE_SECONDS)
         self.draw()
         self.age()
         self.copy()
-        now_time = time.time()
+        if self.check_stagnation():
+            return
+        now_time = timesource.time()
         elapsed = now_time - self.pattern_switch_time
         if elapsed > PATTERN_RATE:
             self.spawn()
@@ -1,10 +1,11 @@
 #!/usr/bin/python3
 """ Display full screen flash color pattern on an Adafruit 8x8 LED backpack """
 
-import time
+import timesource
 
-from PIL import Image
-from PIL import ImageDraw
+import led8x8framebuffer
+
+import occupancy
 
 BRIGHTNESS = 5
 
@@ -15,86 +16,116 @@ GREEN = 1
 YELLOW = 3
 RED = 2
 
+# seconds a room stays lit after motion and after a reset
+MOTION_SECONDS = 60
+RESET_SECONDS = 10
+
+# topic, x and y of the top left pixel and width of each room, all two pixels tall
+ROOMS = (
+    ("diy/perimeter/front/motion", 0, 3, 1),
+    ("diy/main/hallway/motion", 2, 3, 1),
+    ("diy/main/dining/motion", 3, 0, 2),
+    ("diy/main/garage/motion", 0, 6, 2),
+    ("diy/main/living/motion", 3, 6, 2),
+    ("diy/upper/guest/motion", 6, 0, 2),
+    ("diy/upper/study/motion", 6, 6, 2),
+    ("diy/upper/stairs/motion", 5, 3, 1),
+)
+
+def room_mask(xpixel, ypixel, width):
+    """ 64 bit frame mask covering one room """
+    row = ((1 << width) - 1) << xpixel
+    return (row << (8 * ypixel)) | (row << (8 * (ypixel + 1)))
+
+ROOM_INDEX = {room[0]: index for index, room in enumerate(ROOMS)}
+ROOM_MASKS = tuple(room_mask(*room[1:]) for room in ROOMS)
+
 class Led8x8Motion:
-    """ Display motion in various rooms of the house """
+    """ Display motion in various rooms of the house
+
+        Countdowns are kept in one bytearray indexed like ROOMS. """
 
-    def __init__(self, matrix8x8):
-        """ create initial conditions and saving display and I2C lock """
+    def __init__(self, matrix8x8, journal=None, heatmap=None):
+        """ motion is also appended to journal and counted in heatmap when given """
         self.matrix = matrix8x8
+        self.journal = journal
+        self.heatmap = heatmap
         # self.matrix.begin()
         self.matrix.set_brightness(BRIGHTNESS)
-        self.matrix_image = Image.new('RGB', (8, 8))
-        self.matrix_draw = ImageDraw.Draw(self.matrix_image)
-        self.dispatch = {}
+        self.frame = led8x8framebuffer.FrameBuffer()
+        self.seconds = bytearray(len(ROOMS))
         self.motions = 0
+        self.occupied = 0
+        # rooms whose last motion message was active, bit per ROOMS index
+        self.active = 0
         self.reset()
 
-    def draw_two(self, color, row, column):
-        """ display a small room or area """
-        # print("draw_two color=",color)
-        self.matrix_draw.line((row, column, row, column+1), fill=color)
-
-    def draw_four(self, color, row, column):
-        """ draw a medium or large area """
-        # print("draw_four color=",color)
-        self.matrix_draw.line((row, column, row, column+1), fill=color)
-        self.matrix_draw.line((row+1, column, row+1, column+1), fill=color)
-
     def reset(self,):
         """ initialize to starting state and set brightness """
-        self.motions = 8
-        self.dispatch = {
-            "diy/perimeter/front/motion":
-                {"method": self.draw_two, "row" : 0, "column" : 3, "seconds" : 10},
-            "diy/main/hallway/motion":
-                {"method": self.draw_two, "row" : 2, "column" : 3, "seconds" : 10},
-            "diy/main/dining/motion":
-                {"method": self.draw_four, "row" : 3, "column" : 0, "seconds" : 10},
-            "diy/main/garage/motion":
-                {"method": self.draw_four, "row" : 0, "column" : 6, "seconds" : 10},
-            "diy/main/living/motion":
-                {"method": self.draw_four, "row" : 3, "column" : 6, "seconds" : 10},
-            "diy/upper/guest/motion":
-                {"method": self.draw_four, "row" : 6, "column" : 0, "seconds" : 10},
-            "diy/upper/study/motion":
-                {"method": self.draw_four, "row" : 6, "column" : 6, "seconds" : 10},
-            "diy/upper/stairs/motion":
-                {"method": self.draw_two, "row" : 5, "column" : 3, "seconds" : 10}
-            }
+        self.motions = len(ROOMS)
+        self.seconds[:] = bytes([RESET_SECONDS]) * len(ROOMS)
 
     def display(self,):
         ''' display the series as a 64 bit image with alternating colored pixels '''
-        time.sleep(UPDATE_RATE_SECONDS)
-        self.matrix_draw.rectangle((0, 0, 7, 7), outline=(0, 0, 0), fill=(0, 0, 0))
+        timesource.sleep(UPDATE_RATE_SECONDS)
+        self.frame.clear()
         self.motions = 0
-        for key in self.dispatch:
-            self.dispatch[key]["seconds"] = self.dispatch[key]["seconds"] - 1
-            if self.dispatch[key]["seconds"] > 50:
-                self.motions += 1
-                self.dispatch[key]["method"]((255, 0, 0),
-                                             self.dispatch[key]["row"],
-                                             self.dispatch[key]["column"])
-            elif self.dispatch[key]["seconds"] > 30:
-                self.motions += 1
-                self.dispatch[key]["method"]((255, 255, 0),
-                                             self.dispatch[key]["row"],
-                                             self.dispatch[key]["column"])
-            elif self.dispatch[key]["seconds"] > 0:
-                self.motions += 1
-                self.dispatch[key]["method"]((0, 255, 0),
-                                             self.dispatch[key]["row"],
-                                             self.dispatch[key]["column"])
+        for index, mask in enumerate(ROOM_MASKS):
+            seconds = self.seconds[index]
+            if seconds > 0:
+                seconds -= 1
+                self.seconds[index] = seconds
+            if seconds > 50:
+                color = RED
+            elif seconds > 30:
+                color = YELLOW
+            elif seconds > 0:
+                color = GREEN
             else:
-                self.dispatch[key]["seconds"] = 0
-        self.matrix.set_image(self.matrix_image)
-        self.matrix.write_display()
-
-    def motion_detected(self, topic):
-        ''' set timer to countdown occupancy '''
-        for key in self.dispatch:
-            if key == topic:
-                self.dispatch[key]["seconds"] = 60
-                # print("motion_detected topic=",topic)
+                continue
+            self.motions += 1
+            self.frame.paint(mask, color)
+        self.frame.show(self.matrix)
+
+    def record(self, index):
+        ''' journal and count one new motion in a room '''
+        now = timesource.time()
+        if self.journal is not None:
+            self.journal.append(index, now)
+        if self.heatmap is not None:
+            self.heatmap.record(index, now)
+
+    def motion_detected(self, topic, active=True, replay=False):
+        ''' set timer to countdown occupancy
+
+            Every message restarts the countdown, but only a rising edge that
+            is not a retained replay is journaled and counted. '''
+        index = ROOM_INDEX.get(topic)
+        if index is not None:
+            self.seconds[index] = MOTION_SECONDS
+            bit = 1 << index
+            rising = active and not self.active & bit
+            self.active = self.active | bit if active else self.active & ~bit
+            if rising and not replay:
+                self.record(index)
+
+    def occupancy_detected(self, payload, replay=False):
+        ''' restart the countdown of occupied rooms and rooms that just emptied
+
+            Only rooms that just became occupied are journaled and counted. '''
+        decoded = occupancy.decode(payload)
+        if decoded is None:
+            return
+        bitmap = decoded[1]
+        changed = bitmap | self.occupied
+        rising = bitmap & ~self.occupied
+        self.occupied = bitmap
+        for bit, topic in enumerate(occupancy.ROOM_TOPICS):
+            index = ROOM_INDEX.get(topic)
+            if index is not None and changed & (1 << bit):
+                self.seconds[index] = MOTION_SECONDS
+                if rising & (1 << bit) and not replay:
+                    self.record(index)
 
 if __name__ == '__main__':
     exit()
@@ -1,60 +1,269 @@
 #!/usr/bin/python3
-""" Test Bed for Diyhas System Status class """
+""" Stream primes from a segmented sieve onto an Adafruit 8x8 LED backpack """
 
+import sys
 import time
+from array import array
+from collections import deque
+
+import led8x8framebuffer
+
+import timesource
 
 BRIGHTNESS = 10
 
 UPDATE_RATE_SECONDS = 0.2
 
-PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67,
-          71, 73, 79, 83, 89, 97, 101, 103, 107, 109, 113, 127, 131, 137, 139, 149,
-          151, 157, 163, 167, 173, 179, 181, 191, 193, 197, 199, 211, 223, 227, 229,
-          233, 239, 241, 251]
+# time kept back from each frame so prefetching never delays the next frame
+FRAME_MARGIN_SECONDS = 0.02
+
+# odd numbers covered by one sieve segment; the segment is the only large buffer
+SEGMENT_ODDS = 2048
+
+# sieve with base primes up to here; wider numbers are presieved then tested
+BASE_LIMIT = 1 << 16
+
+# small primes used to thin out candidates before a Miller-Rabin test
+PRESIEVE_LIMIT = 2048
+
+# base primes applied to a segment per unit of work
+MARK_BATCH = 32
+
+# primes kept ready ahead of the display
+READY_PRIMES = 64
+
+# units of work next_prime may do when nothing was prefetched; a unit is at
+# most one Miller-Rabin test or one MARK_BATCH of base primes
+NEXT_PRIME_WORK = 32
+
+# primes shown at one width before moving on to the next
+PRIMES_PER_WIDTH = 64
+
+# row bytes per prime and the first number of each width
+WIDTHS = (8, 16, 32, 64)
+WIDTH_START = {8: 2, 16: 1 << 15, 32: 1 << 31, 64: 1 << 63}
+
+# deterministic Miller-Rabin witnesses for every n below 2**64
+WITNESSES = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+
+BLACK = 0
+GREEN = 1
+RED = 2
+YELLOW = 3
+
+PRIME_COLORS = (GREEN, RED, YELLOW)
+
+def simple_sieve(limit):
+    """ all primes below limit packed as unsigned ints rather than a list of int objects """
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b'\0\0'
+    for number in range(2, int(limit ** 0.5) + 1):
+        if sieve[number]:
+            sieve[number * number::number] = bytes(len(range(number * number, limit, number)))
+    return array('I', (number for number in range(limit) if sieve[number]))
+
+BASE_PRIMES = simple_sieve(BASE_LIMIT)
+
+def is_probable_prime(number):
+    """ Miller-Rabin, deterministic below 2**64 with WITNESSES """
+    if number < 2:
+        return False
+    odd = number - 1
+    shifts = 0
+    while odd % 2 == 0:
+        odd //= 2
+        shifts += 1
+    for witness in WITNESSES:
+        witness %= number
+        if witness == 0:
+            continue
+        value = pow(witness, odd, number)
+        if value in (1, number - 1):
+            continue
+        for _ in range(shifts - 1):
+            value = value * value % number
+            if value == number - 1:
+                break
+        else:
+            return False
+    return True
+
+class PrimeStream:
+    """ endless primes from start upward using an incremental segmented sieve
+
+        Work is done in small units: marking a batch of base primes on the
+        current segment, or testing one candidate once marking is finished.
+        Memory is one segment plus a short queue of ready primes. Numbers past
+        end wrap back to start. """
+
+    def __init__(self, start=2, end=1 << 64):
+        """ begin at the first odd segment at or above start """
+        self.start = start
+        self.end = end
+        self.ready = deque()
+        self.segment = bytearray(SEGMENT_ODDS)
+        self.low = 0
+        self.span = 0
+        self.marked = 0
+        self.scanned = 0
+        self.base_end = 0
+        self.exact = True
+        self.sieved = 0
+        self.restart()
+
+    def restart(self,):
+        """ go back to the start of the range """
+        if self.start <= 2:
+            self.ready.append(2)
+        self.load_segment(max(3, self.start | 1))
+
+    def load_segment(self, low):
+        """ prepare the segment of odd numbers beginning at low """
+        if low >= self.end:
+            self.restart()
+            return
+        self.low = low
+        self.span = min(SEGMENT_ODDS, (self.end - low + 1) // 2)
+        self.segment[:] = b'\1' * SEGMENT_ODDS
+        high = low + 2 * self.span
+        root = int(high ** 0.5) + 1
+        self.exact = root <= BASE_LIMIT
+        limit = root if self.exact else PRESIEVE_LIMIT
+        # odd base primes BASE_PRIMES[1:base_end] sieve this segment
+        self.base_end = self.bisect(limit)
+        self.marked = 1
+        self.scanned = 0
+
+    @classmethod
+    def bisect(cls, limit):
+        """ number of base primes not above limit """
+        lower = 0
+        upper = len(BASE_PRIMES)
+        while lower < upper:
+            middle = (lower + upper) // 2
+            if BASE_PRIMES[middle] <= limit:
+                lower = middle + 1
+            else:
+                upper = middle
+        return lower
+
+    def mark(self, prime):
+        """ clear the odd multiples of prime from the segment """
+        first = max(prime * prime, (self.low + prime - 1) // prime * prime)
+        if first % 2 == 0:
+            first += prime
+        index = (first - self.low) // 2
+        if index < self.span:
+            self.segment[index:self.span:prime] = bytes(len(range(index, self.span, prime)))
+
+    def work(self,):
+        """ one bounded unit of sieving or testing; True while primes can be queued """
+        if len(self.ready) >= READY_PRIMES:
+            return False
+        if self.marked < self.base_end:
+            for prime in BASE_PRIMES[self.marked:min(self.marked + MARK_BATCH, self.base_end)]:
+                self.mark(prime)
+            self.marked += MARK_BATCH
+            return True
+        index = self.segment.find(1, self.scanned, self.span)
+        if index < 0:
+            self.sieved += self.span * 2
+            self.load_segment(self.low + 2 * self.span)
+            return True
+        self.scanned = index + 1
+        number = self.low + 2 * index
+        if self.exact or is_probable_prime(number):
+            self.ready.append(number)
+        return True
+
+    def prefetch(self, deadline):
+        """ queue primes until the ready queue is full or the monotonic deadline passes """
+        while timesource.monotonic() < deadline and self.work():
+            pass
+
+    def next_prime(self, budget=NEXT_PRIME_WORK):
+        """ next prime, sieving now only if nothing was prefetched; None if
+            budget units of work did not find one """
+        while not self.ready and budget > 0:
+            self.work()
+            budget -= 1
+        return self.ready.popleft() if self.ready else None
 
 class Led8x8Prime:
-    """ Prime numbers less than 256 display on an 8x8 matrix """
+    """ primes scrolling down the matrix, one to eight rows per prime by width """
 
     def __init__(self, matrix8x8):
         """ create the prime object """
         self.matrix = matrix8x8
-        self.index = 0
+        self.frame = led8x8framebuffer.FrameBuffer()
+        self.streams = {width: PrimeStream(WIDTH_START[width], 1 << width) for width in WIDTHS}
+        self.width = WIDTHS[0]
+        self.shown = 0
         self.row = 0
-        self.iterations = 0
+        self.deadline = timesource.monotonic()
 
     def reset(self,):
         """ initialize and start the prime number display """
-        self.index = 0
         self.row = 0
-        self.iterations = 0
+        self.shown = 0
+        self.frame.clear()
         self.matrix.set_brightness(BRIGHTNESS)
 
+    def next_width(self,):
+        """ move on to the next layout with a clear screen """
+        self.width = WIDTHS[(WIDTHS.index(self.width) + 1) % len(WIDTHS)]
+        self.shown = 0
+        self.row = 0
+        self.frame.clear()
+
     def display(self,):
-        """ display primes up to the max for 8 bits """
-        time.sleep(UPDATE_RATE_SECONDS)
-        self.matrix.clear()
-        # cycle through the primes
-        self.index += 1
-        if self.index >= len(PRIMES):
-            self.index = 0
-            self.row = 0
-        number = PRIMES[self.index]
-        #display 8 bit prime per row
-        row = self.row
-        self.row += 1
-        if self.row >= 8:
-            self.row = 0
-        for xpixel in range(0, 8):
-            bit = number & (1 << xpixel)
-            if self.iterations == 3:
-                self.iterations = 1
-            else:
-                self.iterations += 1
-            if bit == 0:
-                self.matrix.set_pixel(row, xpixel, 0)
+        """ show the next prime at its frame deadline then sieve ahead in the spare time """
+        delay = self.deadline - timesource.monotonic()
+        if delay > 0:
+            timesource.sleep(delay)
+        else:
+            self.deadline = timesource.monotonic()
+        prime = self.streams[self.width].next_prime()
+        self.deadline += UPDATE_RATE_SECONDS
+        if prime is None:
+            # keep the last frame up and sieve on rather than overrun this one
+            self.streams[self.width].prefetch(self.deadline - FRAME_MARGIN_SECONDS)
+            return
+        rows = self.width // 8
+        rows_mask = ((1 << (8 * rows)) - 1) << (8 * self.row)
+        self.frame.paint(rows_mask, BLACK)
+        self.frame.or_mask(prime << (8 * self.row), PRIME_COLORS[self.shown % len(PRIME_COLORS)])
+        self.frame.show(self.matrix)
+        self.row = (self.row + rows) % 8
+        self.shown += 1
+        if self.shown >= PRIMES_PER_WIDTH:
+            self.next_width()
+        self.streams[self.width].prefetch(self.deadline - FRAME_MARGIN_SECONDS)
+
+def benchmark(count=2000):
+    """ sieve throughput, worst next_prime latency without prefetching and the
+        calls that ran out of budget at each width """
+    for width in WIDTHS:
+        stream = PrimeStream(WIDTH_START[width], 1 << width)
+        worst = 0.0
+        misses = 0
+        primes = 0
+        started = time.perf_counter()
+        while primes < count:
+            before = time.perf_counter()
+            prime = stream.next_prime()
+            worst = max(worst, time.perf_counter() - before)
+            if prime is None:
+                misses += 1
             else:
-                self.matrix.set_pixel(row, xpixel, self.iterations)
-        self.matrix.write_display()
+                primes += 1
+                last = prime
+        elapsed = time.perf_counter() - started
+        covered = stream.sieved + 2 * stream.scanned
+        print("{:>2} bit: {:>8.0f} primes/s {:>10.0f} numbers/s worst {:6.2f} ms "
+              "{:>4} misses last {}".format(
+                  width, count / elapsed, covered / elapsed, worst * 1000, misses, last))
 
 if __name__ == '__main__':
-    exit()
+    benchmark()
+    sys.exit()
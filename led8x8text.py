@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+""" Scroll pre-rendered text across an Adafruit 8x8 LED backpack """
+
+import sys
+import math
+import timesource
+
+import led8x8framebuffer
+
+BRIGHTNESS = 5
+
+# columns scrolled per second unless the message asks for another speed
+SCROLL_SPEED = 10.0
+MINIMUM_SPEED = 1.0
+MAXIMUM_SPEED = 50.0
+
+BLACK = 0
+GREEN = 1
+RED = 2
+YELLOW = 3
+
+COLORS = {"green": GREEN, "red": RED, "yellow": YELLOW}
+
+# classic 5x7 font as five column bytes per glyph, bit 0 is the top row
+FONT_5X7 = {
+    ' ': "0000000000", '!': "00005f0000", '"': "0007000700", '#': "147f147f14",
+    '$': "242a7f2a12", '%': "2313086462", '&': "3649552250", "'": "0005030000",
+    '(': "001c224100", ')': "0041221c00", '*': "082a1c2a08", '+': "08083e0808",
+    ',': "0050300000", '-': "0808080808", '.': "0060600000", '/': "2010080402",
+    '0': "3e5149453e", '1': "00427f4000", '2': "4261514946", '3': "2141454b31",
+    '4': "1814127f10", '5': "2745454539", '6': "3c4a494930", '7': "0171090503",
+    '8': "3649494936", '9': "064949291e", ':': "0036360000", ';': "0056360000",
+    '<': "0008142241", '=': "1414141414", '>': "4122140800", '?': "0201510906",
+    '@': "324979413e", 'A': "7e1111117e", 'B': "7f49494936", 'C': "3e41414122",
+    'D': "7f4141221c", 'E': "7f49494941", 'F': "7f09090101", 'G': "3e41415132",
+    'H': "7f0808087f", 'I': "00417f4100", 'J': "2040413f01", 'K': "7f08142241",
+    'L': "7f40404040", 'M': "7f0204027f", 'N': "7f0408107f", 'O': "3e4141413e",
+    'P': "7f09090906", 'Q': "3e4151215e", 'R': "7f09192946", 'S': "4649494931",
+    'T': "01017f0101", 'U': "3f4040403f", 'V': "1f2040201f", 'W': "7f2018207f",
+    'X': "6314081463", 'Y': "0304780403", 'Z': "6151494543", '[': "00007f4141",
+    '\\': "0204081020", ']': "41417f0000", '^': "0402010204", '_': "4040404040",
+    '`': "0001020400", 'a': "2054545478", 'b': "7f48444438", 'c': "3844444420",
+    'd': "384444487f", 'e': "3854545418", 'f': "087e090102", 'g': "081454543c",
+    'h': "7f08040478", 'i': "00447d4000", 'j': "2040443d00", 'k': "007f102844",
+    'l': "00417f4000", 'm': "7c04180478", 'n': "7c08040478", 'o': "3844444438",
+    'p': "7c14141408", 'q': "081414187c", 'r': "7c08040408", 's': "4854545420",
+    't': "043f444020", 'u': "3c4040207c", 'v': "1c2040201c", 'w': "3c4030403c",
+    'x': "4428102844", 'y': "0c5050503c", 'z': "4464544c44", '{': "0008364100",
+    '|': "00007f0000", '}': "0041360800", '~': "0201020402"
+    }
+
+GLYPH_SPACING = 1
+SPACE_WIDTH = 3
+
+def build_atlas(font):
+    """ column strips for every glyph, trimmed to their inked width """
+    atlas = {}
+    for char, hexcolumns in font.items():
+        columns = bytes.fromhex(hexcolumns)
+        if char == ' ':
+            atlas[char] = bytes(SPACE_WIDTH)
+        else:
+            atlas[char] = columns.strip(b'\0') + bytes(GLYPH_SPACING)
+    return atlas
+
+ATLAS = build_atlas(FONT_5X7)
+
+def render_strip(text):
+    """ message as one column strip, entering and leaving a blank screen """
+    unknown = ATLAS['?']
+    return bytes(8) + b''.join(ATLAS.get(char, unknown) for char in text) + bytes(8)
+
+def render_frames(text):
+    """ every scroll position as eight packed row bytes, concatenated
+
+        Rows are first built as bit strips across the whole message so each
+        frame is eight shifts; scrolling then only slices this bitmap. """
+    strip = render_strip(text)
+    rows = [0] * 8
+    for column, bits in enumerate(strip):
+        for row in range(8):
+            if bits & (1 << row):
+                rows[row] |= 1 << column
+    steps = len(strip) - 7
+    bitmap = bytearray(steps * 8)
+    for step in range(steps):
+        bitmap[step * 8:step * 8 + 8] = bytes((row >> step) & 0xFF for row in rows)
+    return bytes(bitmap), steps
+
+def parse_message(payload):
+    """ payload is 'TEXT', 'COLOR:TEXT' or 'COLOR/SPEED:TEXT' with speed in columns per second """
+    text = payload.decode('utf-8', 'replace') if isinstance(payload, bytes) else payload
+    color = YELLOW
+    speed = SCROLL_SPEED
+    prefix, separator, rest = text.partition(':')
+    name, _, rate = prefix.partition('/')
+    if separator and name.lower() in COLORS:
+        color = COLORS[name.lower()]
+        text = rest
+        try:
+            speed = float(rate) if rate else SCROLL_SPEED
+        except ValueError:
+            speed = SCROLL_SPEED
+        if not math.isfinite(speed):
+            speed = SCROLL_SPEED
+    return text, color, min(max(speed, MINIMUM_SPEED), MAXIMUM_SPEED)
+
+class ScrollMessage:
+    """ immutable pre-rendered message handed from the MQTT thread to the display thread """
+
+    __slots__ = ('text', 'color', 'step_seconds', 'bitmap', 'steps')
+
+    def __init__(self, text, color, speed):
+        """ render every scroll position once """
+        self.text = text
+        self.color = color
+        self.step_seconds = 1.0 / speed
+        self.bitmap, self.steps = render_frames(text)
+
+class Led8x8Text:
+    """ scrolling text pattern; each step copies one slice of a pre-rendered bitmap """
+
+    def __init__(self, matrix8x8):
+        """ create initial conditions and saving display and I2C lock """
+        self.matrix = matrix8x8
+        self.frame = led8x8framebuffer.FrameBuffer()
+        self.message = ScrollMessage("", YELLOW, SCROLL_SPEED)
+        self.showing = None
+        self.step = 0
+        self.deadline = timesource.monotonic()
+        self.late_steps = 0
+
+    def reset(self,):
+        """ initialize to starting state and set brightness """
+        self.matrix.set_brightness(BRIGHTNESS)
+        self.showing = None
+
+    def set_message(self, text, color=YELLOW, speed=SCROLL_SPEED):
+        """ render a new message; safe to call from any thread """
+        self.message = ScrollMessage(text, color, speed)
+
+    def display(self,):
+        """ show the next scroll step at its deadline; True once the message has passed """
+        message = self.message
+        if message is not self.showing:
+            self.showing = message
+            self.step = 0
+            self.deadline = timesource.monotonic()
+        delay = self.deadline - timesource.monotonic()
+        if delay > 0:
+            timesource.sleep(delay)
+        rows = message.bitmap[self.step * 8:self.step * 8 + 8]
+        self.frame.green[:] = rows if message.color & GREEN else bytes(8)
+        self.frame.red[:] = rows if message.color & RED else bytes(8)
+        self.frame.show(self.matrix)
+        self.deadline += message.step_seconds
+        now = timesource.monotonic()
+        if now - self.deadline > message.step_seconds:
+            # too far behind to catch up smoothly, hold the speed from here
+            self.late_steps += 1
+            self.deadline = now + message.step_seconds
+        self.step += 1
+        if self.step >= message.steps:
+            self.showing = None
+            return True
+        return False
+
+if __name__ == '__main__':
+    sys.exit()
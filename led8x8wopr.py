@@ -24,7 +24,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import time
+import timesource
 import random
 
 BRIGHTNESS = 5
@@ -62,7 +62,7 @@ class Led8x8Wopr:
 
     def display(self,):
         """ display the series as a 64 bit image with alternating colored pixels """
-        time.sleep(UPDATE_RATE_SECONDS)
+        timesource.sleep(UPDATE_RATE_SECONDS)
         self.matrix.clear()
         self.output_row(0, 1, RED)
         self.output_row(1, 2, YELLOW)
@@ -24,23 +24,55 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import time
-import datetime
-from threading import Thread
+import math
 import socket
 
 import logging
-import logging.config
 
 from Adafruit_Python_LED_Backpack.Adafruit_LED_Backpack import SevenSegment
 
+import devicehealth
+
+import metrics
+
+import diylogging
+
+import ht16k33
+
+import watchdog
+
+import timesource
+
+from segmentbuffers import BUFFERS
+
 TIME_MODE = 0
 WHO_MODE = 1
 COUNT_MODE = 2
 
 MAXIMUM_COUNT = 9999
 
-logging.config.fileConfig(fname='/home/an/diyclock/logging.ini', disable_existing_loggers=False)
+# low power time of day wakes just after each minute boundary
+MINUTE_SECONDS = 60.0
+MINUTE_SLACK = 0.01
+
+# writing the display is allowed this long before an update counts as late
+UPDATE_SLACK = 0.05
+
+# the clock thread never waits longer than the low power minute in one go
+LONGEST_WAIT = MINUTE_SECONDS + MINUTE_SLACK
+
+# countdown start epochs further than this from now are rejected
+START_HORIZON = 86400.0
+
+def valid_count(seconds):
+    """ True when a countdown of seconds fits the display; nan never does """
+    return 0 <= seconds <= MAXIMUM_COUNT
+
+def valid_start(epoch):
+    """ True for no epoch, the next whole second, or one within START_HORIZON of now """
+    return epoch is None or abs(epoch - timesource.time()) <= START_HORIZON
+
+diylogging.configure()
 
 # Get the logger specified in the file
 LOGGER = logging.getLogger(__name__)
@@ -49,6 +81,8 @@ LOGGER.info('Application started')
 class TimeDisplay:
     """ display time """
 
+    __slots__ = ('seven_segment', 'colon', 'alarm', 'time_format')
+
     def __init__(self, display):
         """ initialize special feature and display format """
         self.seven_segment = display
@@ -64,86 +98,147 @@ class TimeDisplay:
         """ set alarm indictor pixel """
         self.alarm = alarm
 
-    def display(self,):
-        """ display time of day in 12 or 24 hour format """
-        digit_string = time.strftime(self.time_format)
-        try:
-            self.seven_segment.clear()
-            self.seven_segment.print_number_str(digit_string)
-            self.seven_segment.set_colon(self.colon)
-            if self.colon:
-                self.colon = False
-            else:
-                self.colon = True
-            self.seven_segment.set_decimal(3, self.alarm)
-            now = datetime.datetime.now()
-            if now.hour > 11:
-                self.seven_segment.set_decimal(1, True)
-            else:
-                self.seven_segment.set_decimal(1, False)
-            self.seven_segment.write_display()
-        except Exception as e:
-            LOGGER.error("Exception occurred", exc_info=True)
+    def display(self, low_power=False):
+        """ display time of day in 12 or 24 hour format
+
+            In low power the colon stays lit and unchanged frames are not written. """
+        now = timesource.now()
+        colon = True if low_power else self.colon
+        frame = BUFFERS.time_of_day(self.time_format, now.hour, now.minute, colon, self.alarm)
+        if self.colon:
+            self.colon = False
+        else:
+            self.colon = True
+        if low_power and self.seven_segment.buffer == frame:
+            return
+        self.seven_segment.buffer[:] = frame
+        self.seven_segment.write_display()
 
 class WhoDisplay:
     """ display IP address in who mode """
 
+    __slots__ = ('seven_segment', 'iterations', 'ip_address')
+
     def __init__(self, display):
         """ prepare to show ip address on who message """
         self.seven_segment = display
         self.iterations = 0
+        host_ip = "0.0.0.0"
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.connect(("8.8.8.8", 80))
-        host_ip = sock.getsockname()[0]
-        sock.close()
-        self.ip_address = host_ip.split(".")
+        try:
+            sock.connect(("8.8.8.8", 80))
+            host_ip = sock.getsockname()[0]
+        except OSError:
+            LOGGER.info('WhoDisplay: no network route, showing 0.0.0.0')
+        finally:
+            sock.close()
+        self.ip_address = [int(octet) for octet in host_ip.split(".")]
 
     def display(self,):
         """ display 3 digits of ip address """
-        try:
-            self.seven_segment.clear()
-            self.seven_segment.set_brightness(15)
-            self.seven_segment.print_number_str(self.ip_address[self.iterations])
-            self.iterations += 1
-            if self.iterations >= 4:
-                self.iterations = 0
-            self.seven_segment.write_display()
-        except Exception as e:
-            LOGGER.error("Exception occurred", exc_info=True)
+        self.seven_segment.set_brightness(15)
+        self.seven_segment.buffer[:] = BUFFERS.number(self.ip_address[self.iterations])
+        self.iterations += 1
+        if self.iterations >= 4:
+            self.iterations = 0
+        self.seven_segment.write_display()
 
 class CountdownDisplay:
-    """ display countdown in countdown mode """
+    """ deadline based countdown, or stopwatch when the duration is zero
+
+        Digits are derived from timesource.monotonic() against a start time rather
+        than from loop iterations, so they change on exact boundaries and
+        clocks started at the same wall clock second stay in step. """
+
+    __slots__ = ('seven_segment', 'max_count', 'tenths', 'running', 'started', 'elapsed')
 
     def __init__(self, display):
         """ prepare to show counting down """
         self.seven_segment = display
-        self.iterations = MAXIMUM_COUNT
         self.max_count = MAXIMUM_COUNT
+        self.tenths = False
+        self.running = False
+        self.started = 0.0
+        self.elapsed = 0.0
+
+    def step(self,):
+        """ seconds represented by the last digit """
+        return 0.1 if self.tenths else 1.0
+
+    def elapsed_now(self, now):
+        """ seconds counted so far; negative until a scheduled start """
+        if self.running:
+            return self.elapsed + (now - self.started)
+        return self.elapsed
+
+    def units(self, now):
+        """ displayed value in units of step """
+        step = self.step()
+        elapsed = max(0.0, self.elapsed_now(now))
+        if self.max_count == 0:
+            return min(int(elapsed / step + 1e-6), MAXIMUM_COUNT)
+        remaining = max(0.0, self.max_count - elapsed)
+        return min(int(math.ceil(remaining / step - 1e-6)), MAXIMUM_COUNT)
+
+    def next_update(self, now):
+        """ seconds until the displayed value changes """
+        if not self.running:
+            return 1.0
+        step = self.step()
+        elapsed = self.elapsed_now(now)
+        if elapsed < 0.0:
+            return -elapsed
+        if self.max_count and elapsed >= self.max_count:
+            self.elapsed = float(self.max_count)
+            self.running = False
+            return 1.0
+        return step - math.fmod(elapsed, step)
 
     def display(self,):
-        """ display 3 digits of ip address """
-        self.iterations -= 1
-        digits = '{0:d}'.format(self.iterations)
-        try:
-            self.seven_segment.print_number_str(digits)
-            if self.iterations == 0:
-                self.iterations = self.max_count
-            self.seven_segment.write_display()
-        except Exception as e:
-            LOGGER.error("Exception occurred", exc_info=True)
-
-    def set_maximum(self, new_maximum):
-        """ set a new count down maximum less than 1000 """
-        if new_maximum <= MAXIMUM_COUNT:
-            self.iterations = new_maximum
-            self.max_count = new_maximum
+        """ write the current value straight into the display buffer """
+        units = self.units(timesource.monotonic())
+        if self.tenths:
+            self.seven_segment.buffer[:] = BUFFERS.tenths(units)
+        else:
+            self.seven_segment.buffer[:] = BUFFERS.number(units)
+        self.seven_segment.write_display()
+
+    def set_maximum(self, new_maximum, tenths=False):
+        """ set the countdown length in seconds, zero counts up as a stopwatch;
+            False, changing nothing, when it is not a count the display can show """
+        if not valid_count(new_maximum):
+            return False
+        if tenths:
+            new_maximum = min(new_maximum, MAXIMUM_COUNT / 10.0)
+        self.max_count = new_maximum
+        self.tenths = tenths
+        self.running = False
+        self.elapsed = 0.0
+        return True
+
+    def start(self, epoch=None):
+        """ start or resume at a wall clock epoch, by default the next whole second """
+        wall = timesource.time()
+        if epoch is None:
+            epoch = math.ceil(wall)
+        self.started = timesource.monotonic() + (epoch - wall)
+        self.running = True
+
+    def stop(self,):
+        """ freeze the current value """
+        if self.running:
+            self.elapsed = self.elapsed_now(timesource.monotonic())
+            self.running = False
 
 class LedClock:
     """ LED seven segment display object """
 
-    def __init__(self,):
+    def __init__(self, supervisor=None):
         """Create display instance on default I2C address (0x70) and bus number"""
-        self.display = SevenSegment.SevenSegment(address=0x71)
+        self.display = ht16k33.install_block_writes(SevenSegment.SevenSegment(address=0x71))
+        if supervisor is None:
+            supervisor = devicehealth.HealthSupervisor()
+        self.health = supervisor.register("seven_segment", self.display, self.restore_settings)
         # Initialize the display. Must be called once before using the display.
         self.display.begin()
         self.brightness = 12
@@ -153,23 +248,79 @@ class LedClock:
         self.clock = TimeDisplay(self.display)
         self.who = WhoDisplay(self.display)
         self.count = CountdownDisplay(self.display)
-        self.tu_thread = Thread(target=self.time_update_thread)
-        self.tu_thread.daemon = True
+        self.jitter = metrics.JitterStats("seven_segment_jitter")
+        self.wakeups = metrics.WakeupCounter("seven_segment")
+        self.heartbeat = watchdog.Heartbeat("seven_segment")
+        self.low_power = False
+        self.wake = timesource.event()
+        self.tu_thread = None
 
     def time_update_thread(self,):
         """ print "started timeUpdateThread """
         while True:
-            time.sleep(1.0)
-            if self.mode == TIME_MODE:
-                self.clock.display()
-            elif self.mode == COUNT_MODE:
-                self.count.display()
-            else:
-                self.who.display()
+            try:
+                if self.mode == COUNT_MODE:
+                    delay = self.count.next_update(timesource.monotonic())
+                elif self.mode == TIME_MODE and self.low_power:
+                    delay = (MINUTE_SECONDS - math.fmod(timesource.time(), MINUTE_SECONDS)
+                             + MINUTE_SLACK)
+                else:
+                    delay = 1.0
+                # a nan delay would spin and a huge one overflow the wait
+                delay = min(max(delay, 0.0), LONGEST_WAIT) if math.isfinite(delay) else 1.0
+                self.heartbeat.beat(delay + UPDATE_SLACK)
+                if self.wake.wait(delay):
+                    self.wake.clear()
+                self.wakeups.wake()
+                self.jitter.frame()
+                if self.mode == TIME_MODE:
+                    self.clock.display(self.low_power)
+                elif self.mode == COUNT_MODE:
+                    self.count.display()
+                else:
+                    self.who.display()
+                self.health.success()
+            #pylint: disable=broad-except
+            except Exception as ex:
+                self.heartbeat.beat(self.health.longest_delay() + UPDATE_SLACK)
+                self.health.failure(ex)
+
+    def restore_settings(self,):
+        """ begin() resets the backpack to full brightness and no blink """
+        self.display.set_brightness(self.brightness)
+        self.display.set_blink(0)
 
     def set_mode(self, mode):
         """ set alarm indicator """
         self.mode = mode
+        self.wake.set()
+
+    def set_low_power(self, low_power):
+        """ at night only wake for minute changes instead of every colon blink """
+        self.low_power = low_power
+        self.wake.set()
+
+    def set_countdown(self, seconds, tenths=False):
+        """ show a stopped countdown of seconds, or a stopwatch when zero;
+            False, leaving the mode alone, when the count cannot be shown """
+        if not self.count.set_maximum(seconds, tenths):
+            return False
+        self.set_mode(COUNT_MODE)
+        return True
+
+    def start_countdown(self, epoch=None):
+        """ start counting at a shared wall clock epoch; False, not starting,
+            when the epoch is not within START_HORIZON of now """
+        if not valid_start(epoch):
+            return False
+        self.count.start(epoch)
+        self.set_mode(COUNT_MODE)
+        return True
+
+    def stop_countdown(self,):
+        """ freeze the countdown or stopwatch """
+        self.count.stop()
+        self.wake.set()
 
     def set_hour_format(self, hour_format=True):
         """ set 12 or 24 hour clock format """
@@ -204,7 +355,7 @@ class LedClock:
 
     def run(self,):
         """ start the clock thread """
-        self.tu_thread.start()
+        self.tu_thread = timesource.spawn(self.time_update_thread)
 
 if __name__ == '__main__':
     exit()
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+""" Load generator for the diyclock MQTT path against a local broker stand-in """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import argparse
+from threading import Thread
+
+import simulatedhw
+
+import localbroker
+
+import metrics
+
+import led8x8motion
+
+ALARM_TOPICS = ("diy/system/fire", "diy/system/panic")
+
+def motion_topics(floors, rooms):
+    """ diy/<floor>/<room>/motion topics for a simulated house
+
+        The rooms the motion pattern draws are spread evenly among them, so
+        the flood exercises both the topic fan-out and the matrix. """
+    topics = ["diy/floor{}/room{}/motion".format(floor, room)
+              for floor in range(floors) for room in range(rooms)]
+    drawn = [room[0] for room in led8x8motion.ROOMS]
+    spacing = len(topics) // len(drawn) + 1
+    for index, topic in enumerate(drawn):
+        topics.insert(index * spacing, topic)
+    return topics
+
+class LoadHarness:
+    """ diyclock's on_connect and on_message on simulated hardware behind a local broker """
+
+    def __init__(self,):
+        """ simulated hardware must be installed before diyclock is imported """
+        simulatedhw.install()
+        #pylint: disable=import-outside-toplevel
+        import diyclock
+        self.app = diyclock
+        self.broker = localbroker.LocalBroker()
+        self.client = localbroker.LocalClient(self.broker, "diyclock")
+        self.client.on_connect = diyclock.on_connect
+        self.client.on_disconnect = diyclock.on_disconnect
+        self.client.on_message = self.timed(diyclock.on_message)
+        diyclock.create_connection(self.client)
+        self.alarm_client = localbroker.LocalClient(self.broker, "diyclock-alarm")
+        diyclock.create_alarm_connection(self.alarm_client)
+        self.alarm_client.on_message = self.timed(diyclock.alarm_message)
+        self.dispatch = metrics.LatencyStats("dispatch_latency")
+        self.publisher = localbroker.LocalClient(self.broker, "load")
+        self.client.connect()
+        self.client.loop_start()
+        self.alarm_client.connect()
+        self.alarm_client.loop_start()
+        # draw the rooms while they are flooded
+        diyclock.MATRIX.set_state(diyclock.led8x8controller.SECURITY_STATE)
+
+    def timed(self, handler):
+        """ wrap a handler to measure delivery to completion latency """
+        def timed_handler(client, userdata, msg):
+            """ run the handler and record how long the message waited """
+            handler(client, userdata, msg)
+            self.dispatch.record(time.monotonic() - msg.timestamp)
+        return timed_handler
+
+    def motion_flood(self, topics, rate, seconds):
+        """ publish motion edges round robin at a target rate: every room on, then every room off """
+        interval = 1.0 / rate
+        deadline = time.monotonic()
+        end = deadline + seconds
+        sent = 0
+        while deadline < end:
+            topic = topics[sent % len(topics)]
+            self.publisher.publish(topic, b'1' if (sent // len(topics)) % 2 == 0 else b'0', 1, True)
+            sent += 1
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return sent
+
+    def alarm_toggles(self, rate, seconds):
+        """ toggle fire and panic on and off; returns ON publish times and message count """
+        interval = 1.0 / rate
+        published = []
+        end = time.monotonic() + seconds
+        toggles = 0
+        while time.monotonic() < end:
+            topic = ALARM_TOPICS[(toggles // 2) % len(ALARM_TOPICS)]
+            turn_on = toggles % 2 == 0
+            if turn_on:
+                published.append(time.monotonic())
+            self.publisher.publish(topic, b'ON' if turn_on else b'OFF', 1, False)
+            toggles += 1
+            time.sleep(interval)
+        self.publisher.publish(ALARM_TOPICS[0], b'OFF', 1, False)
+        return published, toggles + 1
+
+    def run(self, floors, rooms, rate, alarm_rate, seconds, grace=2.0):
+        """ one storm: motion flood plus alarm toggles, then report """
+        #pylint: disable=too-many-arguments,too-many-locals
+        topics = motion_topics(floors, rooms)
+        self.dispatch.reset()
+        self.app.ALARM.latency.reset()
+        received = self.client.received + self.alarm_client.received
+        pin = self.app.CONFIG.piezo_pin
+        alarms = []
+        toggler = Thread(target=lambda: alarms.append(self.alarm_toggles(alarm_rate, seconds)))
+        toggler.daemon = True
+        started = time.monotonic()
+        toggler.start()
+        sent = self.motion_flood(topics, rate, seconds)
+        toggler.join()
+        alarms, toggles = alarms[0]
+        sent += toggles
+        elapsed = time.monotonic() - started
+        backlog = self.client.backlog()
+        deadline = time.monotonic() + grace
+        while self.client.backlog() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        handled = self.client.received + self.alarm_client.received - received
+        gpio = simulatedhw.GPIO_PLATFORM
+        alarm_latency = metrics.LatencyStats("publish_to_piezo")
+        for published in alarms:
+            edge = gpio.first_change(pin, True, published)
+            if edge is not None:
+                alarm_latency.record(edge - published)
+        return {"rate": rate, "sent": sent, "handled": handled,
+                "throughput": handled / (time.monotonic() - started),
+                "backlog_at_end": backlog, "late": self.client.backlog(),
+                "drop_rate": 1.0 - handled / float(sent) if sent else 0.0,
+                "dispatch_latency": self.dispatch.summary(),
+                "receipt_to_piezo": self.app.ALARM.latency.summary(),
+                "publish_to_piezo": alarm_latency.summary(),
+                "elapsed": elapsed}
+
+def main():
+    """ sweep message rates and report where the clock falls behind """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--floors', type=int, default=4)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--rates', default='100,500,1000,2000,5000,10000')
+    parser.add_argument('--alarm-rate', type=float, default=5.0)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+    harness = LoadHarness()
+    for rate in [int(rate) for rate in args.rates.split(',')]:
+        result = harness.run(args.floors, args.rooms, rate, args.alarm_rate, args.seconds)
+        behind = result["backlog_at_end"] > rate * 0.1
+        print("{rate:>6} msg/s sent {sent:>6} handled {handled:>6} throughput {throughput:8.0f}/s "
+              "backlog {backlog_at_end:>5} drop {drop_rate:.3f} ".format(**result)
+              + "dispatch mean {0:.2f} ms max {1:.2f} ms piezo max {2:.2f} ms{3}".format(
+                  result["dispatch_latency"]["mean"] * 1000,
+                  result["dispatch_latency"]["max"] * 1000,
+                  result["publish_to_piezo"]["max"] * 1000,
+                  "  <- falling behind" if behind else ""))
+
+if __name__ == '__main__':
+    main()
+    sys.exit()
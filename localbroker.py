@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+
+""" In process MQTT broker stand-in with a paho style client for local runs """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import queue
+from threading import Thread, Lock
+
+def topic_matches(topic_filter, topic):
+    """ MQTT topic filter matching with + and # wildcards """
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+class LocalMessage:
+    """ the parts of paho's MQTTMessage that diyclock uses """
+    #pylint: disable=too-few-public-methods
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        """ payload is always bytes, like paho """
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode('utf-8')
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.timestamp = 0.0
+
+class LocalBroker:
+    """ routes publishes to subscribed clients and keeps retained messages """
+
+    def __init__(self,):
+        """ no clients or retained messages """
+        self.lock = Lock()
+        self.subscriptions = []
+        self.retained = {}
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, client, topic_filter):
+        """ add a subscription and replay matching retained messages """
+        with self.lock:
+            self.subscriptions.append((client, topic_filter))
+            retained = [message for topic, message in self.retained.items()
+                        if topic_matches(topic_filter, topic)]
+        for message in retained:
+            client.deliver(LocalMessage(message.topic, message.payload, message.qos, True))
+
+    def unsubscribe_all(self, client):
+        """ drop every subscription of a disconnecting client """
+        with self.lock:
+            self.subscriptions = [(subscriber, topic_filter)
+                                  for subscriber, topic_filter in self.subscriptions
+                                  if subscriber is not client]
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """ deliver a message once to each client with a matching subscription """
+        message = LocalMessage(topic, payload, qos, retain)
+        with self.lock:
+            self.published += 1
+            if retain:
+                if message.payload:
+                    self.retained[topic] = message
+                else:
+                    self.retained.pop(topic, None)
+            targets = []
+            for client, topic_filter in self.subscriptions:
+                if client not in targets and topic_matches(topic_filter, topic):
+                    targets.append(client)
+            self.delivered += len(targets)
+        for client in targets:
+            client.deliver(LocalMessage(topic, message.payload, qos, False))
+        return message
+
+class LocalClient:
+    """ paho.mqtt.client.Client look-alike bound to a LocalBroker """
+
+    def __init__(self, broker, client_id=""):
+        """ callbacks are assigned by the application like with paho """
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.callbacks = []
+        self.inbox = queue.Queue()
+        self.connected = False
+        self.thread = None
+        self.received = 0
+
+    def connect(self, host="localhost", port=1883, keepalive=60):
+        """ attach to the broker and call on_connect """
+        #pylint: disable=unused-argument
+        self.connected = True
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+        return 0
+
+    def disconnect(self,):
+        """ detach from the broker and call on_disconnect """
+        self.connected = False
+        self.broker.unsubscribe_all(self)
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, 0)
+
+    def subscribe(self, topic, qos=0):
+        """ subscribe on the broker """
+        #pylint: disable=unused-argument
+        self.broker.subscribe(self, topic)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        """ publish through the broker """
+        return self.broker.publish(topic, payload if payload is not None else b'', qos, retain)
+
+    def message_callback_add(self, topic_filter, callback):
+        """ topic specific callback that takes precedence over on_message """
+        self.callbacks.append((topic_filter, callback))
+
+    def deliver(self, message):
+        """ called by the broker; stamps arrival like paho """
+        message.timestamp = time.monotonic()
+        self.inbox.put(message)
+
+    def dispatch(self, message):
+        """ run the matching callbacks for one message """
+        self.received += 1
+        matched = False
+        for topic_filter, callback in self.callbacks:
+            if topic_matches(topic_filter, message.topic):
+                callback(self, None, message)
+                matched = True
+        if not matched and self.on_message is not None:
+            self.on_message(self, None, message)
+
+    def loop(self, timeout=1.0):
+        """ dispatch at most one queued message """
+        try:
+            message = self.inbox.get(True, timeout)
+        except queue.Empty:
+            return
+        if message is not None:
+            self.dispatch(message)
+
+    def loop_forever(self,):
+        """ dispatch messages until loop_stop """
+        while True:
+            message = self.inbox.get()
+            if message is None:
+                return
+            self.dispatch(message)
+
+    def loop_start(self,):
+        """ dispatch messages on a background thread like paho's network loop """
+        self.thread = Thread(target=self.loop_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def loop_stop(self,):
+        """ stop the background thread after the queued messages """
+        self.inbox.put(None)
+        if self.thread is not None:
+            self.thread.join()
+
+    def backlog(self,):
+        """ messages delivered but not yet dispatched """
+        return self.inbox.qsize()
+
+if __name__ == '__main__':
+    sys.exit()
@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+""" Steady state memory of each diyclock subsystem measured with tracemalloc """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import gc
+import sys
+import json
+import argparse
+import importlib
+import tracemalloc
+
+import simulatedhw
+
+import timesource
+
+# modules in import order; each is charged for whatever it pulls in first
+MODULES = (
+    "timesource", "metrics", "watchdog", "devicehealth", "led8x8framebuffer",
+    "led8x8idle", "led8x8flash", "led8x8fibonacci", "led8x8motion", "led8x8wopr",
+    "led8x8life", "led8x8text", "led8x8prime", "motionjournal", "led8x8heatmap", "led8x8dither",
+    "rendergovernor",
+    "led8x8controller", "ledclock",
+    "alarmcontroller", "eventscheduler", "occupancy",
+)
+
+# frames run before an object is considered to be in its steady state
+WARM_FRAMES = 200
+
+# traced bytes allowed per subsystem, rss_kib in KiB; the clock shares a 512 MB
+# Pi Zero W with other DIYHAS services. Before the compact layouts the motion
+# pattern imported PIL (1.9 MB), prime kept list copies of its base primes
+# (292 KB at import, 65 KB per instance), all patterns held 84 KB and RSS was
+# 36 MB; after: 34 KB, 58 KB, 23 KB, 35 KB and 29 MB. The render governor
+# imported psutil (1 MB) until it became a first sample import (24 KB).
+BUDGETS = {
+    "import led8x8motion": 64 * 1024,
+    "import led8x8prime": 64 * 1024,
+    "import rendergovernor": 64 * 1024,
+    "patterns": 48 * 1024,
+    "seven_segment": 4 * 1024,
+    "application": 6 * 1024 * 1024,
+    "rss_kib": 40 * 1024,
+}
+
+def traced():
+    """ bytes currently allocated by Python after a full collection """
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+def resident_kib():
+    """ resident set size of this process in KiB, the peak where /proc is missing """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    #pylint: disable=import-outside-toplevel
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure_imports():
+    """ traced bytes added by importing each module """
+    sizes = {}
+    for name in MODULES:
+        before = traced()
+        importlib.import_module(name)
+        sizes["import " + name] = traced() - before
+    return sizes
+
+def warm(target, frames):
+    """ bring a pattern to its steady state the way the display thread would """
+    if hasattr(target, "reset"):
+        target.reset()
+    for _ in range(frames):
+        target.display()
+
+def measure_object(build, matrix, frames=WARM_FRAMES):
+    """ traced bytes held by the object build(matrix) returns once warmed up """
+    before = traced()
+    target = build(matrix)
+    warm(target, frames)
+    size = traced() - before
+    return target, size
+
+def measure_patterns(frames):
+    """ each long lived 8x8 pattern on its own simulated matrix """
+    #pylint: disable=import-outside-toplevel
+    import led8x8framebuffer, led8x8idle, led8x8flash, led8x8fibonacci, led8x8motion
+    import led8x8wopr, led8x8life, led8x8text, led8x8prime, led8x8heatmap, motionjournal
+    import led8x8dither
+    from Adafruit_LED_Backpack import BicolorMatrix8x8
+    builders = {
+        "idle": led8x8idle.Led8x8Idle,
+        "flash": lambda matrix: led8x8flash.Led8x8Flash(matrix, led8x8framebuffer.RED),
+        "fibonacci": led8x8fibonacci.Led8x8Fibonacci,
+        "motion": led8x8motion.Led8x8Motion,
+        "wopr": led8x8wopr.Led8x8Wopr,
+        "life": led8x8life.Led8x8Life,
+        "text": led8x8text.Led8x8Text,
+        "prime": led8x8prime.Led8x8Prime,
+        "heatmap": lambda matrix: led8x8heatmap.Led8x8Heatmap(matrix, motionjournal.DailyHeatmap()),
+        "dither": led8x8dither.Led8x8Dither,
+    }
+    sizes = {}
+    kept = []
+    for name, builder in builders.items():
+        matrix = BicolorMatrix8x8.BicolorMatrix8x8(address=0x70)
+        pattern, sizes["pattern " + name] = measure_object(builder, matrix, frames)
+        kept.append(pattern)
+    sizes["patterns"] = sum(sizes["pattern " + name] for name in builders)
+    return sizes
+
+def measure_seven_segment():
+    """ the three seven segment displays of the clock """
+    #pylint: disable=import-outside-toplevel
+    import ledclock
+    from Adafruit_LED_Backpack import SevenSegment
+    display = SevenSegment.SevenSegment(address=0x71)
+    before = traced()
+    displays = (ledclock.TimeDisplay(display), ledclock.WhoDisplay(display),
+                ledclock.CountdownDisplay(display))
+    size = traced() - before
+    del displays
+    return {"seven_segment": size}
+
+def measure_application(settle):
+    """ everything diyclock builds at import, after its threads have run a while """
+    timesource.install(timesource.SystemTime())
+    before = traced()
+    #pylint: disable=import-outside-toplevel
+    import diyclock
+    timesource.sleep(settle)
+    return {"application": traced() - before,
+            "configuration": sys.getsizeof(diyclock.CONFIG)
+                             + sys.getsizeof(getattr(diyclock.CONFIG, '__dict__', {}))}
+
+def run(frames, settle):
+    """ measure every subsystem, imports first so objects are charged only for themselves """
+    simulatedhw.install()
+    tracemalloc.start()
+    start = traced()
+    timesource.install(timesource.VirtualTime())
+    sizes = measure_imports()
+    sizes.update(measure_patterns(frames))
+    sizes.update(measure_seven_segment())
+    sizes.update(measure_application(settle))
+    sizes["traced_total"] = traced() - start
+    sizes["rss_kib"] = resident_kib()
+    return sizes
+
+def main():
+    """ print the budget table; exit status 1 when a subsystem is over budget """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=WARM_FRAMES)
+    parser.add_argument('--settle', type=float, default=3.0)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    sizes = run(args.frames, args.settle)
+    if args.json:
+        print(json.dumps(sizes))
+    over = 0
+    for name, size in sizes.items():
+        budget = BUDGETS.get(name)
+        if budget is not None and size > budget:
+            over += 1
+        if not args.json:
+            print("{:<28} {:>10}{}".format(
+                name, size, "" if budget is None else
+                "  budget {:>8} {}".format(budget, "OVER" if size > budget else "ok")))
+    return 1 if over else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
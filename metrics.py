@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+""" Lightweight latency and counter statistics shared by the diyclock threads """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+
+class LatencyStats:
+    """ running count, mean, minimum and maximum of a latency in seconds """
+
+    __slots__ = ('name', 'count', 'total', 'minimum', 'maximum', 'last')
+
+    def __init__(self, name):
+        """ start with no samples """
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def record(self, seconds):
+        """ add one sample; single writer so no lock is needed """
+        if self.count == 0 or seconds < self.minimum:
+            self.minimum = seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+
+    def mean(self,):
+        """ average of all samples """
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def reset(self,):
+        """ forget all samples """
+        self.count = 0
+        self.total = 0.0
+        self.minimum = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        return {"name": self.name, "count": self.count, "mean": self.mean(),
+                "min": self.minimum, "max": self.maximum, "last": self.last}
+
+class JitterStats:
+    """ frame to frame jitter: change in interval between consecutive frames """
+
+    __slots__ = ('name', 'jitter', 'last_frame', 'last_interval')
+
+    def __init__(self, name):
+        """ no frames seen yet """
+        self.name = name
+        self.jitter = LatencyStats(name)
+        self.last_frame = None
+        self.last_interval = None
+
+    def frame(self,):
+        """ mark the start of a frame """
+        now = time.monotonic()
+        if self.last_frame is not None:
+            interval = now - self.last_frame
+            if self.last_interval is not None:
+                self.jitter.record(abs(interval - self.last_interval))
+            self.last_interval = interval
+        self.last_frame = now
+
+    def restart(self,):
+        """ the frame rate changed on purpose, e.g. a new pattern """
+        self.last_frame = None
+        self.last_interval = None
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        return self.jitter.summary()
+
+# upper bounds in seconds of the lateness histogram buckets; the last bucket is open
+LATENESS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class LatenessHistogram:
+    """ how late events were against their deadlines, in fixed buckets """
+
+    __slots__ = ('name', 'buckets', 'counts', 'lateness')
+
+    def __init__(self, name, buckets=LATENESS_BUCKETS):
+        """ empty histogram with a running summary """
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.lateness = LatencyStats(name)
+
+    def record(self, seconds):
+        """ count one event; single writer so no lock is needed """
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.lateness.record(seconds)
+
+    def reset(self,):
+        """ forget all events """
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.lateness.reset()
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        labels = ["<={}".format(bound) for bound in self.buckets]
+        labels.append(">{}".format(self.buckets[-1]))
+        summary = self.lateness.summary()
+        summary["histogram"] = dict(zip(labels, self.counts))
+        return summary
+
+# every wake-up counter created in this process, for WakeupReport
+WAKEUP_COUNTERS = []
+
+class WakeupCounter:
+    """ number of times a thread woke up; single writer so no lock is needed """
+
+    __slots__ = ('name', 'total')
+
+    def __init__(self, name):
+        """ register with the process wide list """
+        self.name = name
+        self.total = 0
+        WAKEUP_COUNTERS.append(self)
+
+    def wake(self,):
+        """ count one wake-up """
+        self.total += 1
+
+class WakeupReport:
+    """ wake-ups per minute of every counter since the previous sample """
+
+    def __init__(self,):
+        """ start measuring from now """
+        self.last_time = time.monotonic()
+        self.last_totals = {}
+
+    def sample(self,):
+        """ dictionary of per minute rates by counter name, plus their sum as "total" """
+        now = time.monotonic()
+        minutes = max(now - self.last_time, 1e-6) / 60.0
+        rates = {}
+        for counter in list(WAKEUP_COUNTERS):
+            total = counter.total
+            rate = (total - self.last_totals.get(id(counter), 0)) / minutes
+            rates[counter.name] = rates.get(counter.name, 0.0) + rate
+            self.last_totals[id(counter)] = total
+        self.last_time = now
+        rates["total"] = sum(rates.values())
+        return rates
+
+if __name__ == '__main__':
+    sys.exit()
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+
+""" Append-only journal of room motion events and an incremental daily heatmap """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import struct
+import logging
+import datetime
+from array import array
+from threading import Lock
+
+import timesource
+
+# file starts with a magic and version, then fixed size records in time order
+MAGIC = b'DIYM\x01'
+
+# wall clock seconds and room index
+RECORD = struct.Struct('<IB')
+
+# records per segment; the journal keeps the current and one previous segment
+SEGMENT_RECORDS = 32768
+
+# records buffered in memory before they are appended to the file
+FLUSH_RECORDS = 64
+
+# buffered records are written at least this often to limit SD card writes
+FLUSH_SECONDS = 300.0
+
+# records read per block while scanning a range
+READ_RECORDS = 512
+
+# local days shown by the heatmap, one matrix column each
+HEAT_DAYS = 8
+
+# rooms in the heatmap, one matrix row each
+HEAT_ROOMS = 8
+
+LOGGER = logging.getLogger(__name__)
+
+def read_record(segment, index):
+    """ (seconds, room) of one record of an open segment """
+    segment.seek(len(MAGIC) + index * RECORD.size)
+    return RECORD.unpack(segment.read(RECORD.size))
+
+def segment_events(path, start, end):
+    """ yield (seconds, room) with start <= seconds < end from one segment """
+    try:
+        segment = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with segment:
+        if segment.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a diyclock motion journal'.format(path))
+        count = (os.fstat(segment.fileno()).st_size - len(MAGIC)) // RECORD.size
+        lower = 0
+        upper = count
+        while lower < upper:
+            middle = (lower + upper) // 2
+            if read_record(segment, middle)[0] < start:
+                lower = middle + 1
+            else:
+                upper = middle
+        segment.seek(len(MAGIC) + lower * RECORD.size)
+        while lower < count:
+            block = segment.read(min(READ_RECORDS, count - lower) * RECORD.size)
+            for seconds, room in RECORD.iter_unpack(block):
+                if seconds >= end:
+                    return
+                yield seconds, room
+            lower += len(block) // RECORD.size
+
+class MotionJournal:
+    """ bounded, time ordered motion history on the device
+
+        Records are appended to the current segment; once it holds
+        segment_records it becomes the previous segment, replacing the one
+        before. Range queries binary search the fixed size records on disk,
+        so memory use does not grow with the history. Once run, a thread
+        writes queued records within FLUSH_SECONDS even if no more arrive. """
+
+    def __init__(self, path, segment_records=SEGMENT_RECORDS):
+        """ open or create the journal, dropping a record torn by a crash """
+        self.path = path
+        self.previous = path + ".1"
+        self.segment_records = segment_records
+        self.lock = Lock()
+        self.pending = []
+        self.records = 0
+        self.last_time = 0
+        self.flushed = timesource.monotonic()
+        self.queued = timesource.event()
+        self.journal = None
+        self.thread = None
+        self.open_segment()
+
+    def open_segment(self,):
+        """ open the current segment for appending """
+        self.journal = open(self.path, 'a+b')
+        size = self.journal.seek(0, os.SEEK_END)
+        if size == 0:
+            self.journal.write(MAGIC)
+            self.journal.flush()
+            size = len(MAGIC)
+        self.journal.seek(0)
+        if self.journal.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a diyclock motion journal'.format(self.path))
+        self.records = (size - len(MAGIC)) // RECORD.size
+        self.journal.truncate(len(MAGIC) + self.records * RECORD.size)
+        if self.records:
+            self.last_time = read_record(self.journal, self.records - 1)[0]
+        elif os.path.exists(self.previous):
+            with open(self.previous, 'rb') as previous:
+                count = (os.fstat(previous.fileno()).st_size - len(MAGIC)) // RECORD.size
+                if count:
+                    self.last_time = max(self.last_time, read_record(previous, count - 1)[0])
+
+    def append(self, room, when=None):
+        """ record motion in a room; times never go backwards so the file stays sorted """
+        if when is None:
+            when = timesource.time()
+        with self.lock:
+            self.last_time = max(int(when), self.last_time)
+            self.pending.append(RECORD.pack(self.last_time, room))
+            if len(self.pending) == 1:
+                self.queued.set()
+            if (len(self.pending) >= FLUSH_RECORDS
+                    or timesource.monotonic() - self.flushed >= FLUSH_SECONDS):
+                self.flush_locked()
+
+    def flush_locked(self,):
+        """ append queued records, rotating a full segment; caller holds the lock """
+        self.flushed = timesource.monotonic()
+        if not self.pending or self.journal.closed:
+            return
+        self.journal.write(b''.join(self.pending))
+        self.journal.flush()
+        self.records += len(self.pending)
+        self.pending = []
+        if self.records >= self.segment_records:
+            self.journal.close()
+            os.replace(self.path, self.previous)
+            self.open_segment()
+
+    def flush(self,):
+        """ write queued records now """
+        with self.lock:
+            self.flush_locked()
+
+    def flush_thread(self,):
+        """ write the first record queued since a flush FLUSH_SECONDS after that
+            flush at the latest; blocks while nothing is queued """
+        while True:
+            self.queued.wait()
+            self.queued.clear()
+            timesource.sleep(max(0.0, self.flushed + FLUSH_SECONDS - timesource.monotonic()))
+            self.flush()
+
+    def run(self,):
+        """ start the flush thread """
+        self.thread = timesource.spawn(self.flush_thread)
+
+    def close(self,):
+        """ flush and close the journal """
+        with self.lock:
+            self.flush_locked()
+            self.journal.close()
+
+    def events(self, start, end):
+        """ yield (seconds, room) for start <= seconds < end, oldest first """
+        self.flush()
+        for path in (self.previous, self.path):
+            yield from segment_events(path, start, end)
+
+    def activity(self, start, end, bucket=3600):
+        """ {room: [events per bucket]} from start to end, hourly by default """
+        buckets = max(1, int((end - start + bucket - 1) // bucket))
+        counts = {}
+        for seconds, room in self.events(start, end):
+            counts.setdefault(room, [0] * buckets)[int((seconds - start) // bucket)] += 1
+        return counts
+
+def day_number(when):
+    """ local calendar day of a wall clock time """
+    return datetime.date.fromtimestamp(when).toordinal()
+
+class DailyHeatmap:
+    """ motion per room for the last HEAT_DAYS local days, updated event by event
+
+        counts[day * rooms + room] with today in the last column, the same
+        x * 8 + y layout the framebuffer maps, so a frame costs the same
+        however much history it covers. """
+
+    def __init__(self, days=HEAT_DAYS, rooms=HEAT_ROOMS):
+        """ empty history """
+        self.days = days
+        self.rooms = rooms
+        self.counts = array('I', [0]) * (days * rooms)
+        self.peak = 0
+        self.today = None
+        self.version = 0
+        self.lock = Lock()
+
+    def advance_locked(self, day):
+        """ move the window so day is the last column; caller holds the lock """
+        if self.today is None:
+            self.today = day
+            return
+        shift = day - self.today
+        if shift <= 0:
+            return
+        self.today = day
+        keep = max(0, self.days - shift) * self.rooms
+        self.counts[:keep] = self.counts[len(self.counts) - keep:]
+        self.counts[keep:] = array('I', [0]) * (len(self.counts) - keep)
+        self.peak = max(self.counts)
+        self.version += 1
+
+    def advance(self, when):
+        """ roll the window forward at local midnight """
+        with self.lock:
+            self.advance_locked(day_number(when))
+
+    def record(self, room, when):
+        """ count one motion event """
+        day = day_number(when)
+        with self.lock:
+            self.advance_locked(day)
+            age = self.today - day
+            if age >= self.days or room >= self.rooms:
+                return
+            index = (self.days - 1 - age) * self.rooms + room
+            self.counts[index] += 1
+            self.peak = max(self.peak, self.counts[index])
+            self.version += 1
+
+    def levels(self,):
+        """ 0 for no motion then 1 to 3 relative to the busiest room day """
+        with self.lock:
+            peak = self.peak
+            return bytes(0 if count == 0 else 1 + 3 * (count - 1) // peak
+                         for count in self.counts)
+
+    def load(self, journal, when=None):
+        """ rebuild from the journal once at startup """
+        if when is None:
+            when = timesource.time()
+        first = datetime.date.fromordinal(day_number(when) - self.days + 1)
+        start = datetime.datetime.combine(first, datetime.time()).timestamp()
+        for seconds, room in journal.events(start, when + 1):
+            self.record(room, seconds)
+
+def benchmark(path, events_per_day=2000, days=7):
+    """ heatmap frame cost against rescanning the journal for a week of history """
+    #pylint: disable=import-outside-toplevel
+    import time
+    import random
+    journal = MotionJournal(path)
+    now = time.time()
+    start = now - days * 86400
+    for number in range(events_per_day * days):
+        journal.append(random.randrange(HEAT_ROOMS), start + number * 86400.0 / events_per_day)
+    journal.flush()
+    heatmap = DailyHeatmap()
+    began = time.perf_counter()
+    heatmap.load(journal, now)
+    loaded = time.perf_counter() - began
+    began = time.perf_counter()
+    for _ in range(1000):
+        heatmap.record(random.randrange(HEAT_ROOMS), now)
+        heatmap.levels()
+    incremental = (time.perf_counter() - began) / 1000
+    began = time.perf_counter()
+    journal.activity(start, now, 86400)
+    rescan = time.perf_counter() - began
+    journal.close()
+    return {"events": events_per_day * days, "load": loaded,
+            "frame": incremental, "rescan": rescan}
+
+def main():
+    """ print motion per room per hour, or benchmark the heatmap """
+    #pylint: disable=import-outside-toplevel
+    import argparse
+    import tempfile
+    import occupancy
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', nargs='?')
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+    if args.benchmark or args.path is None:
+        with tempfile.TemporaryDirectory() as directory:
+            result = benchmark(os.path.join(directory, "motion.journal"))
+        print("{events} events: load {0:.1f} ms, frame {1:.3f} ms, rescan {2:.1f} ms".format(
+            result["load"] * 1000, result["frame"] * 1000, result["rescan"] * 1000, **result))
+        return
+    journal = MotionJournal(args.path)
+    end = (int(timesource.time()) // 3600 + 1) * 3600
+    start = end - args.hours * 3600
+    activity = journal.activity(start, end)
+    for room, counts in sorted(activity.items()):
+        name = occupancy.ROOM_TOPICS[room] if room < len(occupancy.ROOM_TOPICS) else str(room)
+        print("{:<28} {}".format(name, " ".join("{:>3}".format(count) for count in counts)))
+
+if __name__ == '__main__':
+    main()
+    sys.exit()
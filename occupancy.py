@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+""" Fold room motion topics into one compact house occupancy bitmap """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import struct
+import logging
+from threading import Lock
+
+import timesource
+
+OCCUPANCY_TOPIC = "diy/system/occupancy"
+
+MOTION_FILTER = "diy/+/+/motion"
+
+# bit order of the bitmap; must match on the aggregator and every clock
+ROOM_TOPICS = (
+    "diy/perimeter/front/motion",
+    "diy/main/hallway/motion",
+    "diy/main/dining/motion",
+    "diy/main/garage/motion",
+    "diy/main/living/motion",
+    "diy/upper/guest/motion",
+    "diy/upper/study/motion",
+    "diy/upper/stairs/motion"
+)
+
+# version, sequence and up to 64 room bits
+OCCUPANCY = struct.Struct('<BHQ')
+
+VERSION = 1
+
+# minimum seconds between bitmap publishes
+PUBLISH_INTERVAL = 0.5
+
+LOGGER = logging.getLogger(__name__)
+
+def encode(sequence, bitmap):
+    """ 11 byte occupancy payload """
+    return OCCUPANCY.pack(VERSION, sequence & 0xFFFF, bitmap)
+
+def decode(payload):
+    """ (sequence, bitmap) or None for an unknown payload """
+    if len(payload) != OCCUPANCY.size:
+        return None
+    version, sequence, bitmap = OCCUPANCY.unpack(payload)
+    if version != VERSION:
+        return None
+    return sequence, bitmap
+
+class OccupancyAggregator:
+    """ subscribe to every room once and publish one retained bitmap
+
+        Rising edges are sticky until the next publish so a short 1 then 0
+        inside one publish interval still reaches the clocks. """
+
+    def __init__(self, client, rooms=ROOM_TOPICS, interval=PUBLISH_INTERVAL):
+        """ client is a paho client or a localbroker.LocalClient """
+        self.client = client
+        self.index = {topic: bit for bit, topic in enumerate(rooms)}
+        self.interval = interval
+        self.active = 0
+        self.rises = 0
+        self.sequence = 0
+        self.received = 0
+        self.ignored = 0
+        self.published = 0
+        self.lock = Lock()
+        self.changed = timesource.event()
+        self.thread = None
+
+    def on_connect(self, client, userdata, flags, rcdata):
+        """ subscribe to all room motion topics """
+        #pylint: disable=unused-argument
+        client.subscribe(MOTION_FILTER, 1)
+
+    def on_message(self, client, userdata, msg):
+        """ fold one room edge into the bitmap """
+        #pylint: disable=unused-argument
+        self.received += 1
+        bit = self.index.get(msg.topic)
+        if bit is None:
+            self.ignored += 1
+            return
+        mask = 1 << bit
+        with self.lock:
+            if msg.payload == b'1':
+                if not self.active & mask:
+                    self.rises |= mask
+                self.active |= mask
+            else:
+                self.active &= ~mask
+        self.changed.set()
+
+    def publish_thread(self,):
+        """ publish on change, never more often than the interval """
+        last = None
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            with self.lock:
+                bitmap = self.active | self.rises
+                self.rises = 0
+            if bitmap != last:
+                self.sequence += 1
+                self.client.publish(OCCUPANCY_TOPIC, encode(self.sequence, bitmap), 1, True)
+                self.published += 1
+                last = bitmap
+            if bitmap != self.active:
+                # a sticky rise went out; follow up with the settled state
+                self.changed.set()
+            timesource.sleep(self.interval)
+
+    def run(self,):
+        """ hook the client callbacks and start publishing """
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.thread = timesource.spawn(self.publish_thread)
+
+def fan_out_demo(rooms, clocks, edges, aggregate):
+    """ broker deliveries for a burst of motion edges with and without aggregation """
+    #pylint: disable=import-outside-toplevel
+    import random
+    import localbroker
+    broker = localbroker.LocalBroker()
+    handled = []
+    for _ in range(clocks):
+        client = localbroker.LocalClient(broker)
+        client.on_message = lambda client, userdata, msg: handled.append(msg.topic)
+        client.connect()
+        client.subscribe(OCCUPANCY_TOPIC if aggregate else MOTION_FILTER)
+        client.loop_start()
+    topics = ["diy/floor{}/room{}/motion".format(room % 3, room) for room in range(rooms)]
+    if aggregate:
+        aggregator_client = localbroker.LocalClient(broker)
+        aggregator = OccupancyAggregator(aggregator_client, topics, 0.05)
+        aggregator.run()
+        aggregator_client.connect()
+        aggregator_client.loop_start()
+    for edge in range(edges):
+        broker.publish(random.choice(topics), b'1' if edge % 2 == 0 else b'0', 1, True)
+        time.sleep(0.001)
+    time.sleep(0.5)
+    return {"aggregate": aggregate, "published": broker.published,
+            "delivered": broker.delivered, "per_clock": len(handled) / clocks}
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        import paho.mqtt.client as mqtt
+        CLIENT = mqtt.Client()
+        AGGREGATOR = OccupancyAggregator(CLIENT)
+        AGGREGATOR.run()
+        CLIENT.connect(sys.argv[1], 1883, 60)
+        CLIENT.loop_forever()
+    for ROOMS, CLOCKS in ((8, 4), (32, 8), (64, 16)):
+        print(fan_out_demo(ROOMS, CLOCKS, 400, False))
+        print(fan_out_demo(ROOMS, CLOCKS, 400, True))
+    sys.exit()
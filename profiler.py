@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+""" On demand sampling profiler and allocation snapshot for field diagnosis """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+
+# seconds between stack samples while a capture runs
+SAMPLE_INTERVAL = 0.005
+
+# longest capture accepted from MQTT
+MAXIMUM_SECONDS = 120
+
+# entries in each top list of the summary
+TOP_ENTRIES = 10
+
+LOGGER = logging.getLogger(__name__)
+
+def frame_key(frame):
+    """ compact function identifier: file:line function """
+    code = frame.f_code
+    return "{}:{} {}".format(code.co_filename.rsplit('/', 1)[-1], code.co_firstlineno,
+                             code.co_name)
+
+class OnDemandProfiler:
+    """ sample every thread's stack for a while and publish the busiest functions
+
+        Nothing is installed while idle: the sampler thread only exists during
+        a capture and reads sys._current_frames(), so there is no per call
+        overhead in the display, clock or MQTT threads at any time. """
+
+    def __init__(self, publish):
+        """ publish is called with the JSON summary when a capture ends """
+        self.publish = publish
+        self.capture = None
+
+    def parse(self, payload):
+        """ 'SECONDS [memory]' to (seconds, memory) """
+        words = payload.decode('utf-8', 'replace').split()
+        try:
+            seconds = float(words[0]) if words else 10.0
+        except ValueError:
+            seconds = 10.0
+        memory = len(words) > 1 and words[1].lower() in ('mem', 'memory', 'tracemalloc')
+        return max(0.1, min(seconds, MAXIMUM_SECONDS)), memory
+
+    def start(self, seconds, memory=False):
+        """ begin a capture unless one is already running """
+        if self.capture is not None and self.capture.is_alive():
+            LOGGER.info('OnDemandProfiler: capture already running')
+            return False
+        self.capture = threading.Thread(target=self.capture_thread, args=(seconds, memory))
+        self.capture.daemon = True
+        self.capture.start()
+        return True
+
+    def capture_thread(self, seconds, memory):
+        """ sample stacks until the deadline then publish the summary """
+        if memory:
+            tracemalloc.start()
+        names = {}
+        own = {}
+        inclusive = {}
+        threads = {}
+        samples = 0
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            #pylint: disable=protected-access
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident, str(ident))
+                threads[name] = threads.get(name, 0) + 1
+                key = name + " " + frame_key(frame)
+                own[key] = own.get(key, 0) + 1
+                seen = set()
+                while frame is not None:
+                    key = name + " " + frame_key(frame)
+                    if key not in seen:
+                        seen.add(key)
+                        inclusive[key] = inclusive.get(key, 0) + 1
+                    frame = frame.f_back
+            samples += 1
+            time.sleep(SAMPLE_INTERVAL)
+        summary = {"seconds": seconds, "samples": samples, "threads": threads,
+                   "self": self.top(own), "inclusive": self.top(inclusive)}
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            summary["allocators"] = [
+                {"where": "{}:{}".format(stat.traceback[0].filename.rsplit('/', 1)[-1],
+                                         stat.traceback[0].lineno),
+                 "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]]
+        self.publish(json.dumps(summary, separators=(',', ':')))
+
+    @classmethod
+    def top(cls, counts):
+        """ most sampled entries as [key, samples] pairs """
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        return [[key, samples] for key, samples in ranked[:TOP_ENTRIES]]
+
+if __name__ == '__main__':
+    PROFILER = OnDemandProfiler(print)
+    PROFILER.start(1.0, True)
+    BUSY = [sum(range(1000)) for _ in range(20000)]
+    PROFILER.capture.join()
+    sys.exit()
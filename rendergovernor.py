@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+""" Slow down decorative matrix patterns while the Pi is busy """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+import os
+import sys
+import logging
+
+import metrics
+
+import timesource
+
+# tiers of matrix patterns, degraded in this order; the clock and the alarm
+# flashes are never given a tier and always run at full rate
+ANIMATION_TIER = 1
+DEMO_TIER = 2
+AMBIENT_TIER = 3
+SECURITY_TIER = 4
+
+TIER_NAMES = {ANIMATION_TIER: "animation", DEMO_TIER: "demo",
+              AMBIENT_TIER: "ambient", SECURITY_TIER: "security"}
+
+# at level L every tier up to L is slowed, the lowest tiers the most
+MAXIMUM_LEVEL = SECURITY_TIER
+
+# frame periods are never stretched by more than this
+MAXIMUM_STRETCH = 8
+
+# seconds between load and lateness samples
+SAMPLE_SECONDS = 2.0
+
+# CPU busy fraction above which the Pi counts as overloaded
+HIGH_LOAD = 0.85
+
+# CPU busy fraction below which patterns may speed up again
+LOW_LOAD = 0.6
+
+# mean heartbeat lateness over a sample above which frames count as late
+LATE_SECONDS = 0.02
+
+# consecutive overloaded samples before degrading one more tier
+RAISE_SAMPLES = 2
+
+# consecutive quiet samples before restoring one tier
+RELAX_SAMPLES = 5
+
+# psutil once cpu_load has imported it, False where it is not installed
+PSUTIL = None
+
+LOGGER = logging.getLogger(__name__)
+
+def cpu_load():
+    """ busy fraction of all cores since the last call, or the load average per core
+
+        psutil costs about a megabyte, so only the first call imports it and
+        a governor given another load never does. """
+    #pylint: disable=global-statement,import-outside-toplevel
+    global PSUTIL
+    if PSUTIL is None:
+        try:
+            import psutil
+            PSUTIL = psutil
+        except ImportError:
+            PSUTIL = False
+    if PSUTIL:
+        return PSUTIL.cpu_percent(interval=None) / 100.0
+    return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+
+def load_source(load):
+    """ name of what a load function reads, without importing anything """
+    if load is not cpu_load:
+        return "custom"
+    return "psutil" if PSUTIL else "loadavg"
+
+class RenderGovernor:
+    """ stretch the frame periods of matrix patterns while the Pi is overloaded
+
+        Every SAMPLE_SECONDS the CPU load and the lateness of the watched
+        heartbeats decide the level. Overload raises the level one tier at a
+        time after RAISE_SAMPLES samples and a quiet Pi lowers it after
+        RELAX_SAMPLES, so a short burst does not make patterns stutter. Only
+        the display thread polls, so no lock is needed; other threads read
+        the level and counters as single values. """
+
+    def __init__(self, load=cpu_load):
+        """ load() returns the CPU busy fraction from 0 to 1 """
+        self.load = load
+        self.heartbeats = []
+        self.windows = {}
+        self.level = 0
+        self.next_sample = timesource.monotonic() + SAMPLE_SECONDS
+        self.overloaded = 0
+        self.quiet = 0
+        self.raised = 0
+        self.lowered = 0
+        self.last_load = 0.0
+        self.last_lateness = 0.0
+        self.level_samples = [0] * (MAXIMUM_LEVEL + 1)
+        self.sampling = metrics.LatencyStats("governor_sample")
+        self.load()
+
+    def watch(self, heartbeat):
+        """ include a heartbeat's lateness in the overload decision """
+        self.heartbeats.append(heartbeat)
+        self.windows[heartbeat.name] = (heartbeat.lateness.lateness.count,
+                                        heartbeat.lateness.lateness.total)
+        return heartbeat
+
+    def lateness(self,):
+        """ worst mean lateness of any watched heartbeat since the last sample """
+        worst = 0.0
+        for heartbeat in self.heartbeats:
+            stats = heartbeat.lateness.lateness
+            count, total = self.windows[heartbeat.name]
+            if stats.count > count:
+                worst = max(worst, (stats.total - total) / (stats.count - count))
+            self.windows[heartbeat.name] = (stats.count, stats.total)
+        return worst
+
+    def poll(self,):
+        """ sample when due; called once per frame by the display thread """
+        now = timesource.monotonic()
+        if now >= self.next_sample:
+            self.next_sample = now + SAMPLE_SECONDS
+            self.sample()
+
+    def sample(self,):
+        """ take one load and lateness sample and move the level at most one tier """
+        started = timesource.monotonic()
+        self.last_load = self.load()
+        self.last_lateness = self.lateness()
+        if self.last_load > HIGH_LOAD or self.last_lateness > LATE_SECONDS:
+            self.overloaded += 1
+            self.quiet = 0
+        elif self.last_load < LOW_LOAD:
+            self.quiet += 1
+            self.overloaded = 0
+        else:
+            self.overloaded = 0
+            self.quiet = 0
+        if self.overloaded >= RAISE_SAMPLES and self.level < MAXIMUM_LEVEL:
+            self.overloaded = 0
+            self.set_level(self.level + 1)
+            self.raised += 1
+        elif self.quiet >= RELAX_SAMPLES and self.level > 0:
+            self.quiet = 0
+            self.set_level(self.level - 1)
+            self.lowered += 1
+        self.level_samples[self.level] += 1
+        self.sampling.record(timesource.monotonic() - started)
+
+    def set_level(self, level):
+        """ log every change of level with the readings that caused it """
+        LOGGER.info('render governor level %d -> %d, load %.2f, lateness %.3f s',
+                    self.level, level, self.last_load, self.last_lateness)
+        self.level = level
+
+    def stretch(self, tier):
+        """ frame period multiplier of a tier; None, the clock and alarms, is never stretched """
+        if tier is None or tier > self.level:
+            return 1
+        return min(MAXIMUM_STRETCH, 2 ** (self.level - tier + 1))
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        return {"level": self.level, "load": self.last_load, "lateness": self.last_lateness,
+                "raised": self.raised, "lowered": self.lowered,
+                "level_samples": list(self.level_samples),
+                "stretch": {name: self.stretch(tier) for tier, name in TIER_NAMES.items()},
+                "source": load_source(self.load),
+                "sampling": self.sampling.summary()}
+
+def storm_demo():
+    """ level and stretch of every tier through a scripted quiet Pi, MQTT storm and recovery """
+    loads = [0.3] * 5 + [0.95] * 12 + [0.7] * 4 + [0.2] * 24
+    script = iter([0.0] + loads)
+    governor = RenderGovernor(load=lambda: next(script))
+    rows = []
+    for sample in range(len(loads)):
+        governor.sample()
+        rows.append((sample * SAMPLE_SECONDS, governor.last_load, governor.level,
+                     [governor.stretch(tier) for tier in TIER_NAMES]))
+    return governor, rows
+
+if __name__ == '__main__':
+    GOVERNOR, ROWS = storm_demo()
+    print("  time  load level  " + " ".join("{:>9}".format(name) for name in TIER_NAMES.values()))
+    for SECONDS, LOAD, LEVEL, STRETCH in ROWS:
+        print("{:6.0f} {:5.2f} {:5d}  ".format(SECONDS, LOAD, LEVEL) +
+              " ".join("{:>9}".format(factor) for factor in STRETCH))
+    print(GOVERNOR.summary())
+    sys.exit()
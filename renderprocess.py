@@ -0,0 +1,437 @@
+#!/usr/bin/python3
+
+""" Optional render process that owns the I2C displays """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import math
+import time
+import signal
+import struct
+import logging
+import multiprocessing
+from threading import Lock
+
+import diylogging
+
+import metrics
+
+import watchdog
+
+import timesync
+
+import ht16k33
+
+# commands sent from the network process to the render process
+MATRIX_MODE = 1
+MATRIX_STATE = 2
+MATRIX_RESTORE = 3
+MATRIX_MOTION = 4
+CLOCK_MODE = 5
+CLOCK_BRIGHTNESS = 6
+CLOCK_HOUR_FORMAT = 7
+CLOCK_ALARM = 8
+CLOCK_COUNT_SET = 9
+CLOCK_COUNT_START = 10
+CLOCK_COUNT_STOP = 11
+MATRIX_OCCUPANCY = 12
+MATRIX_TEXT = 13
+MATRIX_LOW_POWER = 14
+CLOCK_LOW_POWER = 15
+MATRIX_BEACON = 16
+
+# local monotonic receipt time appended to a forwarded time beacon
+RECEIVED = struct.Struct('<d')
+
+# ring header: head and tail counters, each written by only one process
+RING_HEADER = struct.Struct('<II')
+
+# bytes of text a command can carry; longer text is cut
+SLOT_TEXT = 58
+
+# command slot: opcode, a signed and an unsigned argument and a short text argument
+RING_SLOT = struct.Struct('<BxhH{}s'.format(SLOT_TEXT))
+
+RING_SLOTS = 256
+
+# framebuffer: sequence number, matrix and clock buffers, jitter statistics
+FRAMEBUFFER = struct.Struct('<I16s16sdddd')
+
+MATRIX_SLOT = 0
+CLOCK_SLOT = 1
+
+# seconds between jitter publications when no commands arrive
+STATS_SECONDS = 60.0
+
+# seconds between wake-up reports from the render process
+WAKEUP_LOG_SECONDS = 600.0
+
+# the render process watchdog bumps its health counter at least this often
+HEALTH_SECONDS = 2 * watchdog.CHECK_SECONDS
+
+LOGGER = logging.getLogger(__name__)
+
+class CommandRing:
+    """ single producer, single consumer command ring in shared memory
+
+        The producer only writes the head counter and the consumer only the
+        tail, so neither side needs a lock across processes. Threads of the
+        producing process must still take turns; RenderProcess.send does that. """
+
+    def __init__(self, slots=RING_SLOTS):
+        """ allocate the ring before the render process is forked """
+        self.slots = slots
+        self.memory = multiprocessing.RawArray('B', RING_HEADER.size + slots * RING_SLOT.size)
+        self.view = memoryview(self.memory).cast('B')
+        self.dropped = 0
+
+    def put(self, opcode, first=0, second=0, text=b''):
+        """ queue a command; returns False and counts a drop when the ring is full """
+        head, tail = RING_HEADER.unpack_from(self.view, 0)
+        if head - tail >= self.slots:
+            self.dropped += 1
+            return False
+        offset = RING_HEADER.size + (head % self.slots) * RING_SLOT.size
+        RING_SLOT.pack_into(self.view, offset, opcode, first, second, text)
+        struct.pack_into('<I', self.view, 0, (head + 1) & 0xFFFFFFFF)
+        return True
+
+    def get(self,):
+        """ next (opcode, first, second, text) or None when empty """
+        head, tail = RING_HEADER.unpack_from(self.view, 0)
+        if head == tail:
+            return None
+        offset = RING_HEADER.size + (tail % self.slots) * RING_SLOT.size
+        opcode, first, second, text = RING_SLOT.unpack_from(self.view, offset)
+        struct.pack_into('<I', self.view, 4, (tail + 1) & 0xFFFFFFFF)
+        return opcode, first, second, text.rstrip(b'\0')
+
+class SharedFramebuffer:
+    """ latest frame of each display and render jitter, readable from either process
+
+        The writer makes the sequence number odd while it updates the block so
+        readers can retry instead of locking. """
+
+    def __init__(self,):
+        """ allocate the framebuffer before the render process is forked """
+        self.memory = multiprocessing.RawArray('B', FRAMEBUFFER.size)
+        self.view = memoryview(self.memory).cast('B')
+        self.frames = [bytes(16), bytes(16)]
+        self.jitter = [0.0, 0.0, 0.0, 0.0]
+        self.writer = Lock()
+
+    def attach(self, display, slot):
+        """ publish every frame written to a display """
+        write_display = display.write_display
+
+        def shared_write_display():
+            """ send the frame then publish its buffer """
+            write_display()
+            self.frames[slot] = bytes(display.buffer)
+            self.publish()
+
+        display.write_display = shared_write_display
+        return display
+
+    def set_jitter(self, matrix_jitter, clock_jitter):
+        """ publish mean and maximum frame jitter of both displays """
+        self.jitter = [matrix_jitter.mean(), matrix_jitter.maximum,
+                       clock_jitter.mean(), clock_jitter.maximum]
+        self.publish()
+
+    def publish(self,):
+        """ write the block between an odd and an even sequence number
+
+            Both display threads publish, so writers in the render process
+            serialise on a local lock; readers never lock. """
+        with self.writer:
+            sequence = struct.unpack_from('<I', self.view, 0)[0]
+            struct.pack_into('<I', self.view, 0, (sequence + 1) & 0xFFFFFFFF)
+            FRAMEBUFFER.pack_into(self.view, 0, (sequence + 1) & 0xFFFFFFFF,
+                                  self.frames[MATRIX_SLOT], self.frames[CLOCK_SLOT],
+                                  *self.jitter)
+            struct.pack_into('<I', self.view, 0, (sequence + 2) & 0xFFFFFFFF)
+
+    def read(self,):
+        """ consistent (sequence, matrix, clock, jitter) snapshot """
+        while True:
+            fields = FRAMEBUFFER.unpack_from(self.view, 0)
+            if fields[0] % 2 == 0 and struct.unpack_from('<I', self.view, 0)[0] == fields[0]:
+                return fields[0], fields[1], fields[2], fields[3:]
+            time.sleep(0)
+
+class MatrixProxy:
+    """ Led8x8Controller interface that forwards to the render process """
+
+    def __init__(self, renderer):
+        """ commands go through the renderer's ring """
+        self.renderer = renderer
+
+    def set_mode(self, mode, override=False):
+        """ set display mode; fire and panic are only replaced by an override """
+        self.renderer.send(MATRIX_MODE, mode, 1 if override else 0)
+
+    def restore_mode(self,):
+        """ return to last mode; usually after idle, fire or panic """
+        self.renderer.send(MATRIX_RESTORE)
+
+    def set_state(self, state):
+        """ set the machine state """
+        self.renderer.send(MATRIX_STATE, state)
+
+    def update_motion(self, topic, active=True, replay=False):
+        """ update the countdown timer for the topic (room); replay marks a retained message """
+        self.renderer.send(MATRIX_MOTION, 1 if active else 0, 1 if replay else 0,
+                           topic.encode('utf-8'))
+
+    def update_occupancy(self, payload, replay=False):
+        """ update the countdown timers from a house occupancy bitmap """
+        self.renderer.send(MATRIX_OCCUPANCY, 1 if replay else 0,
+                           text=payload.hex().encode('ascii'))
+
+    def set_low_power(self, low_power):
+        """ blank instead of animating the idle state """
+        self.renderer.send(MATRIX_LOW_POWER, 1 if low_power else 0)
+
+    def show_text(self, text, color, speed):
+        """ scroll a message; text is cut to the ring slot size """
+        hundredths = round(speed * 100) if math.isfinite(speed) else 0
+        if not 0 < hundredths <= 0xFFFF:
+            raise ValueError("scroll speed {} outside the command ring range".format(speed))
+        self.renderer.send(MATRIX_TEXT, color, hundredths, text.encode('utf-8'))
+
+    def time_beacon(self, payload, received=None):
+        """ forward a beacon with its receipt time; both processes share CLOCK_MONOTONIC """
+        if received is None:
+            received = time.monotonic()
+        self.renderer.send(MATRIX_BEACON, text=(payload + RECEIVED.pack(received)).hex().encode('ascii'))
+
+class ClockProxy:
+    """ LedClock interface that forwards to the render process """
+
+    def __init__(self, renderer):
+        """ commands go through the renderer's ring """
+        self.renderer = renderer
+
+    def set_mode(self, mode):
+        """ set time, who or count mode """
+        self.renderer.send(CLOCK_MODE, mode)
+
+    def set_brightness(self, val):
+        """ set brightness in range from 1 to 15 """
+        self.renderer.send(CLOCK_BRIGHTNESS, val)
+
+    def set_low_power(self, low_power):
+        """ only wake for minute changes """
+        self.renderer.send(CLOCK_LOW_POWER, 1 if low_power else 0)
+
+    def set_hour_format(self, hour_format=True):
+        """ set 12 or 24 hour clock format """
+        self.renderer.send(CLOCK_HOUR_FORMAT, 1 if hour_format else 0)
+
+    def set_alarm(self, alarm):
+        """ set alarm indicator """
+        self.renderer.send(CLOCK_ALARM, 1 if alarm else 0)
+
+    def set_countdown(self, seconds, tenths=False):
+        """ show a stopped countdown of seconds, or a stopwatch when zero """
+        self.renderer.send(CLOCK_COUNT_SET, 1 if tenths else 0, text=repr(seconds).encode())
+
+    def start_countdown(self, epoch=None):
+        """ start counting at a shared wall clock epoch """
+        text = b'' if epoch is None else repr(epoch).encode()
+        self.renderer.send(CLOCK_COUNT_START, text=text)
+
+    def stop_countdown(self,):
+        """ freeze the countdown or stopwatch """
+        self.renderer.send(CLOCK_COUNT_STOP)
+
+class RenderProcess:
+    """ fork a process that owns rendering and I2C; the parent keeps networking """
+
+    def __init__(self, matrix_address, clock_address, frame_capture="", motion_journal="",
+                 demo_modes=None):
+        """ shared memory must exist before the fork; demo_modes None is the default rotation """
+        #pylint: disable=too-many-arguments
+        self.matrix_address = matrix_address
+        self.clock_address = clock_address
+        self.frame_capture = frame_capture
+        self.motion_journal = motion_journal
+        self.demo_modes = demo_modes
+        self.ring = CommandRing()
+        # paho, the scheduler and the main loop all send; the ring has one head
+        self.sender = Lock()
+        self.framebuffer = SharedFramebuffer()
+        self.wake = multiprocessing.Event()
+        self.healthy = multiprocessing.RawValue('I', 0)
+        self.process = None
+        self.matrix = MatrixProxy(self)
+        self.clock = ClockProxy(self)
+
+    def send(self, opcode, first=0, second=0, text=b''):
+        """ queue a command and wake the render process; safe from any thread """
+        if len(text) > SLOT_TEXT:
+            LOGGER.error('RenderProcess: command %d text cut to %d bytes: %r',
+                         opcode, SLOT_TEXT, text)
+        with self.sender:
+            queued = self.ring.put(opcode, first, second, text)
+        if not queued:
+            LOGGER.error('RenderProcess: command ring full, %d dropped', self.ring.dropped)
+        self.wake.set()
+
+    def ping_parent(self,):
+        """ render process: every display thread is keeping its heartbeat """
+        self.healthy.value = (self.healthy.value + 1) & 0xFFFFFFFF
+
+    def health_count(self,):
+        """ counter that only moves while the render process is healthy """
+        return self.healthy.value
+
+    def start(self,):
+        """ fork the render process; call before any other threads start """
+        context = multiprocessing.get_context('fork')
+        self.process = context.Process(target=self.render_main, name="diyclock-render")
+        self.process.daemon = True
+        self.process.start()
+
+    def render_main(self,):
+        """ render process: build the displays and apply commands until killed """
+        #pylint: disable=import-outside-toplevel
+        from Adafruit_LED_Backpack import BicolorMatrix8x8
+        import devicehealth
+        import framerecorder
+        import ledclock
+        import led8x8controller
+        import motionjournal
+        import rendergovernor
+        diylogging.after_fork()
+        health = devicehealth.HealthSupervisor()
+        clock = ledclock.LedClock(health)
+        display = ht16k33.install_block_writes(
+            BicolorMatrix8x8.BicolorMatrix8x8(address=self.matrix_address))
+        display.begin()
+        if self.frame_capture:
+            recorder = framerecorder.FrameRecorder(self.frame_capture)
+            recorder.attach(clock.display, self.clock_address)
+            recorder.attach(display, self.matrix_address)
+        self.framebuffer.attach(clock.display, CLOCK_SLOT)
+        self.framebuffer.attach(display, MATRIX_SLOT)
+        journal = None
+        if self.motion_journal:
+            journal = motionjournal.MotionJournal(self.motion_journal)
+            journal.run()
+
+            def terminated(signum, frame):
+                """ the parent stops this process with SIGTERM; write the journal first """
+                #pylint: disable=unused-argument
+                journal.close()
+                os._exit(0)
+
+            signal.signal(signal.SIGTERM, terminated)
+        governor = rendergovernor.RenderGovernor()
+        governor.watch(clock.heartbeat)
+        matrix = led8x8controller.Led8x8Controller(display, health, journal=journal,
+                                                   governor=governor,
+                                                   demo_modes=self.demo_modes
+                                                   or led8x8controller.DEMO_MODES)
+        clock.run()
+        matrix.run()
+        monitor = watchdog.Watchdog(ping=self.ping_parent)
+        monitor.watch(clock.heartbeat)
+        monitor.watch(matrix.heartbeat)
+        monitor.add_report("render_governor", governor.summary)
+        monitor.start()
+        wakeups = metrics.WakeupCounter("render_commands")
+        report = metrics.WakeupReport()
+        reported = time.monotonic()
+        while True:
+            self.wake.wait(STATS_SECONDS)
+            self.wake.clear()
+            wakeups.wake()
+            self.apply_queued(matrix, clock)
+            self.framebuffer.set_jitter(matrix.jitter.jitter, clock.jitter.jitter)
+            if time.monotonic() - reported >= WAKEUP_LOG_SECONDS:
+                reported = time.monotonic()
+                LOGGER.info('render wake-ups per minute %s', report.sample())
+
+    def apply_queued(self, matrix, clock):
+        """ apply every queued command; one that fails, e.g. on text cut from
+            MQTT, is logged and the rest still run """
+        command = self.ring.get()
+        while command is not None:
+            try:
+                self.apply(command, matrix, clock)
+            #pylint: disable=broad-except
+            except Exception as ex:
+                LOGGER.error('RenderProcess: command %d failed: %s', command[0], repr(ex))
+            command = self.ring.get()
+
+    @classmethod
+    def apply(cls, command, matrix, clock):
+        """ run one command against the real controllers """
+        opcode, first, second, text = command
+        if opcode == MATRIX_MODE:
+            matrix.set_mode(first, second != 0)
+        elif opcode == MATRIX_STATE:
+            matrix.set_state(first)
+        elif opcode == MATRIX_RESTORE:
+            matrix.restore_mode()
+        elif opcode == MATRIX_MOTION:
+            matrix.update_motion(text.decode('utf-8', 'ignore'), first != 0, second != 0)
+        elif opcode == MATRIX_OCCUPANCY:
+            matrix.update_occupancy(bytes.fromhex(text.decode('ascii', 'ignore')), first != 0)
+        elif opcode == MATRIX_TEXT:
+            matrix.show_text(text.decode('utf-8', 'ignore'), first, second / 100.0)
+        elif opcode == MATRIX_BEACON:
+            data = bytes.fromhex(text.decode('ascii', 'ignore'))
+            matrix.time_beacon(data[:timesync.BEACON.size],
+                               RECEIVED.unpack(data[timesync.BEACON.size:])[0])
+        elif opcode == MATRIX_LOW_POWER:
+            matrix.set_low_power(first != 0)
+        elif opcode == CLOCK_LOW_POWER:
+            clock.set_low_power(first != 0)
+        elif opcode == CLOCK_MODE:
+            clock.set_mode(first)
+        elif opcode == CLOCK_BRIGHTNESS:
+            clock.set_brightness(first)
+        elif opcode == CLOCK_HOUR_FORMAT:
+            clock.set_hour_format(first != 0)
+        elif opcode == CLOCK_ALARM:
+            clock.set_alarm(first != 0)
+        elif opcode == CLOCK_COUNT_SET:
+            clock.set_countdown(float(text.decode('ascii', 'ignore')), first != 0)
+        elif opcode == CLOCK_COUNT_START:
+            clock.start_countdown(float(text.decode('ascii', 'ignore')) if text else None)
+        elif opcode == CLOCK_COUNT_STOP:
+            clock.stop_countdown()
+
+    def jitter(self,):
+        """ render jitter as published by the render process """
+        _, _, _, jitter = self.framebuffer.read()
+        return {"matrix_mean": jitter[0], "matrix_max": jitter[1],
+                "clock_mean": jitter[2], "clock_max": jitter[3]}
+
+if __name__ == '__main__':
+    sys.exit()
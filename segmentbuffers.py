@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+""" Precomputed HT16K33 buffers for everything the seven segment clock shows """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import datetime
+
+# bytes in an HT16K33 display buffer
+BUFFER_SIZE = 16
+
+# HT16K33 buffer bytes of the four digits and the colon
+DIGIT_POSITIONS = (0, 2, 6, 8)
+COLON_POSITION = 4
+COLON = 0x02
+DECIMAL_POINT = 0x80
+
+# segment patterns, same encoding as Adafruit_LED_Backpack.SevenSegment
+DIGIT_SEGMENTS = {
+    ' ': 0x00, '-': 0x40, '0': 0x3F, '1': 0x06, '2': 0x5B, '3': 0x4F, '4': 0x66,
+    '5': 0x6D, '6': 0x7D, '7': 0x07, '8': 0x7F, '9': 0x6F
+}
+
+MAXIMUM_NUMBER = 9999
+
+def encode(digits, decimals=(), colon=False):
+    """ full 16 byte buffer for four characters, decimal point positions and colon """
+    buffer = bytearray(BUFFER_SIZE)
+    for position, digit in zip(DIGIT_POSITIONS, digits):
+        buffer[position] = DIGIT_SEGMENTS[digit]
+    for decimal in decimals:
+        buffer[DIGIT_POSITIONS[decimal]] |= DECIMAL_POINT
+    if colon:
+        buffer[COLON_POSITION] = COLON
+    return buffer
+
+class BufferTable:
+    """ fixed size HT16K33 buffers packed into one bytearray """
+
+    def __init__(self, count):
+        """ reserve count blank buffers """
+        self.data = bytearray(count * BUFFER_SIZE)
+        self.view = memoryview(self.data)
+
+    def store(self, index, buffer):
+        """ copy an encoded buffer into slot index """
+        start = index * BUFFER_SIZE
+        self.data[start:start + BUFFER_SIZE] = buffer
+
+    def __getitem__(self, index):
+        """ zero copy view of slot index """
+        start = index * BUFFER_SIZE
+        return self.view[start:start + BUFFER_SIZE]
+
+def number_table(tenths=False):
+    """ 0 to 9999 right justified; with tenths the third digit carries the point """
+    table = BufferTable(MAXIMUM_NUMBER + 1)
+    for number in range(MAXIMUM_NUMBER + 1):
+        if tenths:
+            table.store(number, encode('{0:>4}'.format('{0:02d}'.format(number)), (2,)))
+        else:
+            table.store(number, encode('{0:>4d}'.format(number)))
+    return table
+
+def time_index(hour, minute, colon, alarm):
+    """ slot of a time of day with colon and alarm indicator """
+    return ((hour * 60 + minute) * 2 + (1 if colon else 0)) * 2 + (1 if alarm else 0)
+
+def time_table(time_format):
+    """ every minute of the day in a strftime hour format, PM dot on the second digit """
+    table = BufferTable(24 * 60 * 4)
+    day = datetime.datetime(2000, 1, 1)
+    for minute_of_day in range(24 * 60):
+        moment = day + datetime.timedelta(minutes=minute_of_day)
+        digits = moment.strftime(time_format)
+        for colon in (False, True):
+            for alarm in (False, True):
+                decimals = []
+                if moment.hour > 11:
+                    decimals.append(1)
+                if alarm:
+                    decimals.append(3)
+                table.store(time_index(moment.hour, moment.minute, colon, alarm),
+                            encode(digits, decimals, colon))
+    return table
+
+class SegmentBuffers:
+    """ tables built once, on first use, and shared by every display """
+
+    def __init__(self,):
+        """ nothing built yet """
+        self.tables = {}
+
+    def table(self, key, builder, *args):
+        """ cached table for key """
+        table = self.tables.get(key)
+        if table is None:
+            table = builder(*args)
+            self.tables[key] = table
+        return table
+
+    def number(self, number):
+        """ buffer showing 0 to 9999 """
+        return self.table('number', number_table)[number]
+
+    def tenths(self, tenths):
+        """ buffer showing 0.0 to 999.9 from a count of tenths """
+        return self.table('tenths', number_table, True)[tenths]
+
+    def time_of_day(self, time_format, hour, minute, colon, alarm):
+        """ buffer showing a time of day """
+        #pylint: disable=too-many-arguments
+        return self.table(time_format, time_table, time_format)[
+            time_index(hour, minute, colon, alarm)]
+
+BUFFERS = SegmentBuffers()
+
+if __name__ == '__main__':
+    import time
+    import simulatedhw
+    DISPLAY = simulatedhw.SimulatedSevenSegment()
+    BUFFERS.time_of_day("%l%M", 0, 0, False, False)
+    START = time.perf_counter()
+    for MINUTE in range(1440):
+        DISPLAY.clear()
+        DISPLAY.print_number_str('{0:>2d}{1:02d}'.format(MINUTE // 60 % 12 or 12, MINUTE % 60))
+        DISPLAY.set_colon(MINUTE % 2)
+        DISPLAY.set_decimal(3, False)
+        DISPLAY.set_decimal(1, MINUTE >= 720)
+    DRAWN = (time.perf_counter() - START) / 1440
+    START = time.perf_counter()
+    for MINUTE in range(1440):
+        DISPLAY.buffer[:] = BUFFERS.time_of_day("%l%M", MINUTE // 60, MINUTE % 60,
+                                                MINUTE % 2, False)
+    LOOKUP = (time.perf_counter() - START) / 1440
+    print("print_number_str path {0:.1f} us, table lookup {1:.1f} us per update".format(
+        DRAWN * 1e6, LOOKUP * 1e6))
+    sys.exit()
@@ -0,0 +1,201 @@
+#!/usr/bin/python3
+
+""" Run a simulated day of clock, matrix, motion and alarm behaviour in virtual time """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time
+import datetime
+import argparse
+from collections import Counter
+
+import timesource
+
+import simulatedhw
+
+DAY_SECONDS = 24 * 3600
+
+def at(hour, minute, second=0):
+    """ virtual seconds after midnight """
+    return hour * 3600 + minute * 60 + second
+
+class SimulatedHouse:
+    """ the clock's display, alarm and scheduling objects on simulated hardware """
+    #pylint: disable=too-many-instance-attributes
+
+    def __init__(self, day, piezo_pin=4):
+        """ install virtual time at local midnight, then build everything on it """
+        midnight = datetime.datetime.combine(day, datetime.time(0, 0)).timestamp()
+        self.source = timesource.install(timesource.VirtualTime(midnight))
+        simulatedhw.install()
+        #pylint: disable=import-outside-toplevel
+        import devicehealth
+        import ledclock
+        import led8x8controller
+        import alarmcontroller
+        import eventscheduler
+        import rendergovernor
+        self.controller = led8x8controller
+        self.alarms = alarmcontroller
+        self.gpio = simulatedhw.GPIO_PLATFORM
+        self.pin = piezo_pin
+        self.health = devicehealth.HealthSupervisor()
+        self.clock = ledclock.LedClock(self.health)
+        self.display = simulatedhw.SimulatedBicolorMatrix8x8()
+        # the simulator's own CPU use is not load on a real Pi
+        governor = rendergovernor.RenderGovernor(load=lambda: 0.0)
+        governor.watch(self.clock.heartbeat)
+        self.matrix = led8x8controller.Led8x8Controller(self.display, self.health,
+                                                        governor=governor)
+        self.alarm = alarmcontroller.AlarmController(piezo_pin, self.gpio)
+        self.transitions = []
+        self.scheduler = eventscheduler.EventScheduler()
+        self.scheduler.add(eventscheduler.DailySchedule(
+            "lights", [(datetime.time(6, 1), self.lights_on), (datetime.time(20, 1), self.lights_off)]))
+        self.samples = Counter()
+        self.frames = []
+
+    def start(self,):
+        """ start every thread the real clock would run """
+        self.clock.run()
+        self.matrix.run()
+        self.scheduler.run()
+
+    def lights_on(self,):
+        """ what TimedEvents does at the start of the day """
+        self.transitions.append((timesource.now(), "lights on"))
+        self.clock.set_low_power(False)
+        self.matrix.set_low_power(False)
+        self.clock.set_brightness(12)
+        self.matrix.set_state(self.controller.DEMO_STATE)
+
+    def lights_off(self,):
+        """ what TimedEvents does at the start of the night """
+        self.transitions.append((timesource.now(), "lights off"))
+        self.clock.set_brightness(0)
+        self.clock.set_low_power(True)
+        self.matrix.set_low_power(True)
+        self.matrix.set_state(self.controller.IDLE_STATE)
+
+    def alarm_message(self, topic, turn_on):
+        """ alarm_message from diyclock without MQTT """
+        mode = self.controller.FIRE_MODE if topic == "fire" else self.controller.PANIC_MODE
+        pattern = self.alarms.FIRE_PATTERN if topic == "fire" else self.alarms.PANIC_PATTERN
+        self.transitions.append((timesource.now(), "{} {}".format(topic, "on" if turn_on else "off")))
+        if turn_on:
+            self.alarm.sound_alarm(True, pattern)
+            self.matrix.set_mode(mode)
+        else:
+            self.alarm.sound_alarm(False)
+            self.matrix.set_mode(self.controller.FIBONACCI_MODE, True)
+
+    def security(self, turn_on):
+        """ diy/system/security """
+        self.transitions.append((timesource.now(), "security {}".format("on" if turn_on else "off")))
+        self.matrix.set_state(self.controller.SECURITY_STATE if turn_on
+                              else self.controller.DEMO_STATE)
+
+    def motion(self, topic):
+        """ a room reports motion """
+        self.matrix.update_motion(topic)
+
+    def sample(self,):
+        """ once a minute: which state and mode the matrix is in, and display writes so far """
+        snap = self.matrix.mode_controller.snapshot
+        self.samples[(snap.machine_state, snap.current_mode)] += 1
+        self.frames.append((timesource.monotonic(), self.display.frames, self.clock.display.frames))
+
+    def piezo_edges(self, start, end):
+        """ (seconds after start, level) of piezo writes between two virtual times """
+        return [(stamp - start, value) for stamp, pin, value in self.gpio.events
+                if pin == self.pin and start <= stamp < end]
+
+def scenario(house):
+    """ (seconds after midnight, action) for one ordinary day """
+    return [
+        (at(7, 30), lambda: house.security(True)),
+        (at(8, 15), lambda: house.motion("diy/perimeter/front/motion")),
+        (at(9, 0), lambda: house.motion("diy/main/garage/motion")),
+        (at(12, 0), lambda: house.alarm_message("fire", True)),
+        (at(12, 0, 30), lambda: house.alarm_message("fire", False)),
+        (at(13, 0), lambda: house.alarm_message("panic", True)),
+        (at(13, 0, 10), lambda: house.alarm_message("panic", False)),
+        (at(17, 30), lambda: house.security(False)),
+        (at(21, 0), lambda: house.motion("diy/main/living/motion")),
+    ]
+
+def simulate(day, seconds=DAY_SECONDS):
+    """ run the scenario and every minute's sample in virtual time """
+    house = SimulatedHouse(day)
+    house.start()
+    actions = scenario(house) + [(minute * 60, house.sample) for minute in range(seconds // 60)]
+    actions.sort(key=lambda action: action[0])
+    started = time.perf_counter()
+    for when, action in actions:
+        if when >= seconds:
+            break
+        timesource.sleep(when - timesource.monotonic())
+        action()
+    timesource.sleep(seconds - timesource.monotonic())
+    house.sample()
+    return house, time.perf_counter() - started
+
+def report(house, elapsed):
+    """ print what happened during the day """
+    state_names = {0: "idle", 1: "demo", 2: "security"}
+    mode_names = {0: "fire", 1: "panic", 2: "fibonacci", 3: "wopr", 4: "life", 5: "text", 6: "prime", 7: "heatmap", 8: "dither"}
+    print("simulated {:.0f} s in {:.1f} s real time, {} clock advances".format(
+        timesource.monotonic(), elapsed, house.source.advances))
+    for stamp, what in house.transitions:
+        print("  {:%H:%M:%S} {}".format(stamp, what))
+    print("minutes per state and mode:")
+    for (state, mode), minutes in sorted(house.samples.items()):
+        print("  {:<9} {:<10} {:>5}".format(state_names[state], mode_names[mode], minutes))
+    print("display writes per hour (matrix, clock):")
+    hourly = []
+    for hour in range(0, len(house.frames) - 60, 60):
+        _, matrix0, clock0 = house.frames[hour]
+        _, matrix1, clock1 = house.frames[hour + 60]
+        hourly.append("{:02d}h {:>5} {:>4}".format(hour // 60, matrix1 - matrix0, clock1 - clock0))
+    for line in range(0, len(hourly), 4):
+        print("  " + "   ".join(hourly[line:line + 4]))
+    fire = house.piezo_edges(at(12, 0), at(12, 0, 31))
+    panic = house.piezo_edges(at(13, 0), at(13, 0, 11))
+    print("fire piezo writes {} first {} last {}".format(len(fire), fire[:3], fire[-1:]))
+    print("panic piezo writes {} first {}".format(len(panic), panic[:5]))
+    print("piezo level at end of day {}".format(house.alarm.level))
+
+def main():
+    """ simulate a day, by default the summer solstice """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--day', default='2024-06-21', help='local date, YYYY-MM-DD')
+    parser.add_argument('--hours', type=int, default=24)
+    args = parser.parse_args()
+    day = datetime.datetime.strptime(args.day, '%Y-%m-%d').date()
+    house, elapsed = simulate(day, args.hours * 3600)
+    report(house, elapsed)
+
+if __name__ == '__main__':
+    main()
+    sys.exit()
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+
+""" Simulated Raspberry Pi hardware for running diyclock logic without a Pi """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import types
+
+import timesource
+
+# same values as Adafruit_GPIO.GPIO
+OUT = 0
+IN = 1
+HIGH = True
+LOW = False
+RISING = 1
+FALLING = 2
+BOTH = 3
+PUD_OFF = 0
+PUD_DOWN = 1
+PUD_UP = 2
+
+class SimulatedGPIO:
+    """ records every output change with a monotonic timestamp """
+
+    def __init__(self,):
+        """ all pins low with no event callbacks """
+        self.levels = {}
+        self.callbacks = {}
+        self.events = []
+
+    def setup(self, pin, mode, pull_up_down=PUD_OFF):
+        """ configure a pin; inputs start low """
+        #pylint: disable=unused-argument
+        self.levels[pin] = LOW
+
+    def output(self, pin, value):
+        """ drive an output pin and record when it happened """
+        self.levels[pin] = value
+        self.events.append((timesource.monotonic(), pin, value))
+
+    def input(self, pin):
+        """ read the simulated level of a pin """
+        return 1 if self.levels.get(pin, LOW) else 0
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=-1):
+        """ remember the interrupt handler for a pin """
+        #pylint: disable=unused-argument
+        self.callbacks[pin] = callback
+
+    def drive_input(self, pin, value):
+        """ change an input level from a test and fire its interrupt handler """
+        self.levels[pin] = value
+        callback = self.callbacks.get(pin)
+        if callback is not None:
+            callback(pin)
+
+    def first_change(self, pin, value, since=0.0):
+        """ monotonic time the pin was first driven to value after since or None """
+        for stamp, event_pin, event_value in self.events:
+            if stamp >= since and event_pin == pin and event_value == value:
+                return stamp
+        return None
+
+# seven segment glyphs, same encoding as Adafruit_LED_Backpack.SevenSegment
+DIGIT_VALUES = {
+    ' ': 0x00, '-': 0x40, '0': 0x3F, '1': 0x06, '2': 0x5B, '3': 0x4F, '4': 0x66,
+    '5': 0x6D, '6': 0x7D, '7': 0x07, '8': 0x7F, '9': 0x6F, 'A': 0x77, 'B': 0x7C,
+    'C': 0x39, 'D': 0x5E, 'E': 0x79, 'F': 0x71
+}
+
+# bicolor matrix colors
+OFF = 0
+GREEN = 1
+RED = 2
+YELLOW = 3
+
+class SimulatedBackpack:
+    """ HT16K33 backpack with the Adafruit buffer layout and a byte counting bus """
+
+    def __init__(self, address=0x70):
+        """ blank display, no traffic yet """
+        self.address = address
+        self.buffer = bytearray(16)
+        self.brightness = 15
+        self.blink = 0
+        self.begun = 0
+        self.frames = 0
+        self.bytes_written = 0
+        self.fail_writes = 0
+
+    def begin(self,):
+        """ oscillator on, no blink, full brightness """
+        self.begun += 1
+        self.blink = 0
+        self.brightness = 15
+
+    def set_brightness(self, brightness):
+        """ one command byte on the bus """
+        self.brightness = brightness
+        self.bytes_written += 1
+
+    def set_blink(self, frequency):
+        """ one command byte on the bus """
+        self.blink = frequency
+        self.bytes_written += 1
+
+    def set_led(self, led, value):
+        """ set or clear one bit of the display buffer """
+        pos = led // 8
+        offset = led % 8
+        if value == 0:
+            self.buffer[pos] &= ~(1 << offset)
+        else:
+            self.buffer[pos] |= 1 << offset
+
+    def clear(self,):
+        """ blank the buffer without writing it """
+        self.buffer[:] = bytes(16)
+
+    def write_display(self,):
+        """ one register write per buffer byte like the Adafruit driver """
+        if self.fail_writes > 0:
+            self.fail_writes -= 1
+            raise IOError("simulated I2C failure at 0x{0:02x}".format(self.address))
+        self.frames += 1
+        self.bytes_written += 2 * len(self.buffer)
+
+class SimulatedBicolorMatrix8x8(SimulatedBackpack):
+    """ bicolor 8x8 matrix: green row bits at buffer[2y], red at buffer[2y+1] """
+
+    def set_pixel(self, x, y, value):
+        """ set a pixel to OFF, GREEN, RED or YELLOW """
+        if x < 0 or x > 7 or y < 0 or y > 7:
+            return
+        self.set_led(y * 16 + x, 1 if value & GREEN > 0 else 0)
+        self.set_led(y * 16 + x + 8, 1 if value & RED > 0 else 0)
+
+    def set_image(self, image):
+        """ copy an 8x8 RGB PIL image using pure red, green and yellow """
+        pixels = image.load()
+        for x in range(8):
+            for y in range(8):
+                color = pixels[(x, y)]
+                if color == (255, 0, 0):
+                    self.set_pixel(x, y, RED)
+                elif color == (0, 255, 0):
+                    self.set_pixel(x, y, GREEN)
+                elif color == (255, 255, 0):
+                    self.set_pixel(x, y, YELLOW)
+                else:
+                    self.set_pixel(x, y, OFF)
+
+class SimulatedSevenSegment(SimulatedBackpack):
+    """ four digit seven segment display with colon at buffer[4] """
+
+    def __init__(self, address=0x71):
+        """ blank display """
+        SimulatedBackpack.__init__(self, address)
+
+    def set_digit_raw(self, pos, bitmask):
+        """ write raw segments, skipping the colon position """
+        if pos < 0 or pos > 3:
+            return
+        offset = 0 if pos < 2 else 1
+        self.buffer[(pos + offset) * 2] = bitmask & 0xFF
+
+    def set_decimal(self, pos, decimal):
+        """ turn the decimal point of a digit on or off """
+        if pos < 0 or pos > 3:
+            return
+        offset = 0 if pos < 2 else 1
+        if decimal:
+            self.buffer[(pos + offset) * 2] |= 1 << 7
+        else:
+            self.buffer[(pos + offset) * 2] &= ~(1 << 7) & 0xFF
+
+    def set_digit(self, pos, digit, decimal=False):
+        """ write a glyph and optional decimal point """
+        self.set_digit_raw(pos, DIGIT_VALUES.get(str(digit).upper(), 0x00))
+        if decimal:
+            self.set_decimal(pos, True)
+
+    def set_colon(self, show_colon):
+        """ turn the center colon on or off """
+        if show_colon:
+            self.buffer[4] |= 0x02
+        else:
+            self.buffer[4] &= (~0x02) & 0xFF
+
+    def print_number_str(self, value, justify_right=True):
+        """ print up to four characters, decimals attach to the previous digit """
+        length = sum(1 for char in value if char != '.')
+        if length > 4:
+            self.print_number_str('----')
+            return
+        pos = (4 - length) if justify_right else 0
+        for char in value:
+            if char == '.':
+                self.set_decimal(pos - 1, True)
+            else:
+                self.set_digit(pos, char)
+                pos += 1
+
+# shared by every simulated module so tests can drive and inspect the pins
+GPIO_PLATFORM = SimulatedGPIO()
+
+# every simulated backpack created through the installed modules, by address
+BACKPACKS = {}
+
+def simulated_backpack(cls):
+    """ constructor with the Adafruit signature that registers the instance """
+    def create(address=0x70, i2c=None, **kwargs):
+        """ keyword arguments of the Adafruit constructors are accepted and ignored """
+        #pylint: disable=unused-argument
+        backpack = cls(address)
+        BACKPACKS[address] = backpack
+        return backpack
+    return create
+
+def install():
+    """ register simulated Adafruit_GPIO and Adafruit_LED_Backpack modules
+
+        Must run before diyclock, ledclock or alarmcontroller are imported. """
+    gpio = types.ModuleType('Adafruit_GPIO.GPIO')
+    for name in ('OUT', 'IN', 'HIGH', 'LOW', 'RISING', 'FALLING', 'BOTH',
+                 'PUD_OFF', 'PUD_DOWN', 'PUD_UP'):
+        setattr(gpio, name, globals()[name])
+    gpio.get_platform_gpio = lambda **kwargs: GPIO_PLATFORM
+    adafruit_gpio = types.ModuleType('Adafruit_GPIO')
+    adafruit_gpio.GPIO = gpio
+    matrix = types.ModuleType('Adafruit_LED_Backpack.BicolorMatrix8x8')
+    matrix.BicolorMatrix8x8 = simulated_backpack(SimulatedBicolorMatrix8x8)
+    segment = types.ModuleType('Adafruit_LED_Backpack.SevenSegment')
+    segment.SevenSegment = simulated_backpack(SimulatedSevenSegment)
+    backpack = types.ModuleType('Adafruit_LED_Backpack')
+    backpack.BicolorMatrix8x8 = matrix
+    backpack.SevenSegment = segment
+    python_backpack = types.ModuleType('Adafruit_Python_LED_Backpack')
+    python_backpack.Adafruit_LED_Backpack = backpack
+    sys.modules.update({
+        'Adafruit_GPIO': adafruit_gpio,
+        'Adafruit_GPIO.GPIO': gpio,
+        'Adafruit_LED_Backpack': backpack,
+        'Adafruit_LED_Backpack.BicolorMatrix8x8': matrix,
+        'Adafruit_LED_Backpack.SevenSegment': segment,
+        'Adafruit_Python_LED_Backpack': python_backpack,
+        'Adafruit_Python_LED_Backpack.Adafruit_LED_Backpack': backpack,
+    })
+
+if __name__ == '__main__':
+    sys.exit()
@@ -0,0 +1,18 @@
+""" the modules live at the top of the repository rather than in a package """
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+#pylint: disable=wrong-import-position
+import timesource
+
+@pytest.fixture(name="clock")
+def virtual_clock():
+    """ virtual time starting at a round epoch, system time restored afterwards """
+    source = timesource.install(timesource.VirtualTime(epoch=100000.0))
+    yield source
+    timesource.install(timesource.SystemTime())
@@ -0,0 +1,105 @@
+""" publishing through the connection manager while offline and on reconnect """
+
+import localbroker
+
+import connectionmanager
+
+def broker_pair():
+    """ a manager around an unconnected client and a subscriber to everything """
+    broker = localbroker.LocalBroker()
+    client = localbroker.LocalClient(broker, "clock")
+    received = []
+    listener = localbroker.LocalClient(broker, "listener")
+    listener.on_message = lambda client, userdata, msg: received.append((msg.topic, msg.payload))
+    listener.connect()
+    listener.subscribe("#")
+    manager = connectionmanager.ConnectionManager(client, "localhost")
+    manager.attach()
+    return manager, client, listener, received
+
+def drain(listener):
+    """ deliver everything queued for the listener """
+    while listener.backlog():
+        listener.loop(0)
+
+def test_offline_retained_publishes_flush_latest_per_topic():
+    manager, client, listener, received = broker_pair()
+    assert not manager.publish("diy/a/motion", b'1', 0, True)
+    assert not manager.publish("diy/a/motion", b'0', 0, True)
+    assert not manager.publish("diy/b/motion", b'1', 0, True)
+    assert not manager.publish("diy/heartbeat", b'{}', 0, False)
+    assert manager.summary()["pending"] == 2
+    assert manager.dropped == 1
+    client.connect()
+    drain(listener)
+    assert manager.connected()
+    assert sorted(received) == [("diy/a/motion", b'0'), ("diy/b/motion", b'1')]
+    assert manager.summary()["pending"] == 0
+    assert manager.publish("diy/c/motion", b'1', 0, True)
+
+def test_empty_and_wildcard_topics_are_rejected():
+    manager, client, listener, received = broker_pair()
+    for topic in ("", "diy/+/motion", "diy/#"):
+        assert not manager.publish(topic, b'1', 0, True)
+    assert manager.rejected == 3
+    assert manager.summary()["pending"] == 0
+    client.connect()
+    assert not manager.publish("", b'1', 0, True)
+    drain(listener)
+    assert received == []
+
+def test_one_failing_flush_does_not_stop_the_rest():
+    manager, client, listener, received = broker_pair()
+    publish = client.publish
+
+    def failing_publish(topic, payload=None, qos=0, retain=False):
+        if topic == "diy/bad/motion":
+            raise ValueError("rejected by the client")
+        return publish(topic, payload, qos, retain)
+
+    client.publish = failing_publish
+    for topic in ("diy/a/motion", "diy/bad/motion", "diy/b/motion"):
+        manager.publish(topic, b'1', 0, True)
+    client.connect()
+    drain(listener)
+    assert sorted(received) == [("diy/a/motion", b'1'), ("diy/b/motion", b'1')]
+    assert manager.dropped == 1
+
+def test_application_callbacks_still_run():
+    manager, client, _, _ = broker_pair()
+    calls = []
+    manager.app_on_connect = lambda *args: calls.append("connect")
+    manager.app_on_disconnect = lambda *args: calls.append("disconnect")
+    client.connect()
+    client.disconnect()
+    assert calls[0] == "connect"
+    assert manager.state == connectionmanager.DISCONNECTED
+
+def test_a_raising_callback_does_not_end_the_network_loop():
+    manager, client, listener, _ = broker_pair()
+    handled = []
+
+    def on_message(client, userdata, msg):
+        #pylint: disable=unused-argument
+        if msg.payload == b'bad':
+            raise KeyError(msg.topic)
+        handled.append(msg.payload)
+
+    client.on_message = on_message
+    loop = client.loop
+
+    def loop_until_drained(timeout=1.0):
+        """ report the connection lost once everything queued is dispatched """
+        if not client.backlog():
+            return 1
+        return loop(timeout)
+
+    client.loop = loop_until_drained
+    assert manager.connect()
+    client.subscribe("diy/#")
+    listener.publish("diy/a", b'1')
+    listener.publish("diy/b", b'bad')
+    listener.publish("diy/c", b'2')
+    manager.service()
+    assert handled == [b'1', b'2']
+    assert manager.summary()["callback_errors"] == 1
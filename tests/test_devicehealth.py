@@ -0,0 +1,48 @@
+""" backoff of a failing I2C device and what re-initialisation restores """
+
+import timesource
+import simulatedhw
+
+import devicehealth
+import led8x8controller
+import led8x8dither
+
+class FlakyDevice:
+    """ device whose begin() only counts calls """
+
+    def __init__(self):
+        self.begins = 0
+
+    def begin(self,):
+        self.begins += 1
+
+def test_backoff_is_capped_and_reset_by_the_first_good_write(clock):
+    #pylint: disable=unused-argument
+    device = FlakyDevice()
+    health = devicehealth.DeviceHealth("flaky", device)
+    for _ in range(devicehealth.ERROR_BUDGET):
+        started = timesource.monotonic()
+        health.failure(OSError("bus error"))
+        slept = timesource.monotonic() - started
+        assert slept <= devicehealth.MAXIMUM_BACKOFF * (1.0 + devicehealth.BACKOFF_JITTER)
+    assert health.backoff == devicehealth.MAXIMUM_BACKOFF
+    assert device.begins == devicehealth.ERROR_BUDGET
+    health.success()
+    assert health.backoff == devicehealth.INITIAL_BACKOFF
+    assert not health.summary()["down"]
+    assert health.errors == devicehealth.ERROR_BUDGET
+
+def test_restore_goes_back_to_the_active_patterns_brightness():
+    matrix = simulatedhw.SimulatedBicolorMatrix8x8()
+    controller = led8x8controller.Led8x8Controller(matrix)
+    controller.mode_controller.set_state(led8x8controller.DEMO_STATE)
+    controller.mode_controller.set_mode(led8x8controller.DITHER_MODE)
+    controller.apply_brightness(controller.mode_controller.apply_transitions())
+    assert matrix.brightness == led8x8dither.BRIGHTNESS
+    matrix.begin()
+    matrix.set_brightness(15 if led8x8dither.BRIGHTNESS != 15 else 0)
+    controller.restore_brightness()
+    assert matrix.brightness == led8x8dither.BRIGHTNESS
+    controller.mode_controller.set_state(led8x8controller.SECURITY_STATE)
+    controller.apply_brightness(controller.mode_controller.apply_transitions())
+    assert matrix.brightness == led8x8controller.led8x8motion.BRIGHTNESS
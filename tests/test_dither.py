@@ -0,0 +1,37 @@
+""" dither sub-frames against the flat frames a capture records """
+
+import simulatedhw
+import framerecorder
+import led8x8dither
+
+def test_flat_subframe_lights_half_level_and_above():
+    green = bytes(range(led8x8dither.SUBFRAMES + 1)) + bytes(64 - led8x8dither.SUBFRAMES - 1)
+    red = bytes(64)
+    flat = led8x8dither.build_subframes(green, red)[led8x8dither.FLAT_SUBFRAME]
+    lit = [index for index in range(64)
+           if int.from_bytes(flat[0::2], 'little') & led8x8dither.CELL_BITS[index]]
+    assert lit == list(range(led8x8dither.SUBFRAMES // 2, led8x8dither.SUBFRAMES + 1))
+    assert not any(flat[1::2])
+
+def test_capture_keeps_one_flat_frame_per_step(clock, tmp_path):
+    #pylint: disable=unused-argument
+    matrix = simulatedhw.SimulatedBicolorMatrix8x8()
+    recorder = framerecorder.FrameRecorder(str(tmp_path / "frames.bin"))
+    recorder.attach(matrix, 0x70)
+    pattern = led8x8dither.Led8x8Dither(matrix)
+    pattern.reset()
+    for _ in range(3):
+        pattern.display()
+    recorder.close()
+    frames = list(framerecorder.read_frames(str(tmp_path / "frames.bin")))
+    assert len(frames) == 3
+    assert matrix.frames > 3 * led8x8dither.SUBFRAMES
+    assert frames[-1][2] == pattern.subframes[led8x8dither.FLAT_SUBFRAME]
+
+def test_uncaptured_matrix_gets_only_subframes(clock):
+    #pylint: disable=unused-argument
+    matrix = simulatedhw.SimulatedBicolorMatrix8x8()
+    pattern = led8x8dither.Led8x8Dither(matrix)
+    pattern.reset()
+    pattern.display()
+    assert matrix.frames == pattern.writes.count
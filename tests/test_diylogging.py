@@ -0,0 +1,71 @@
+""" repeat suppression in front of the log writer """
+
+import queue
+import logging
+import time
+
+import diylogging
+
+class FakeTime:
+    """ monotonic clock the test moves by hand, starting just after boot """
+    now = 5.0
+
+    @classmethod
+    def monotonic(cls):
+        return cls.now
+
+def record(message):
+    return logging.LogRecord("test", logging.ERROR, __file__, 1, message, None, None)
+
+def test_first_message_after_boot_passes(monkeypatch):
+    monkeypatch.setattr(diylogging, 'time', FakeTime)
+    FakeTime.now = 5.0
+    repeats = diylogging.RepeatFilter(60.0)
+    assert repeats.filter(record("Application started"))
+    assert not repeats.filter(record("Application started"))
+
+def test_a_storm_that_stops_is_reported_when_the_window_ends(monkeypatch):
+    monkeypatch.setattr(diylogging, 'time', FakeTime)
+    FakeTime.now = 5.0
+    repeats = diylogging.RepeatFilter(60.0)
+    assert repeats.filter(record("i2c error"))
+    for _ in range(3):
+        assert not repeats.filter(record("i2c error"))
+    assert repeats.next_expiry() == 65.0
+    assert repeats.expire(64.0) == []
+    reports = repeats.expire(65.0)
+    assert [report.getMessage() for report in reports] == ["i2c error (3 repeats suppressed)"]
+    assert repeats.next_expiry() is None
+    FakeTime.now = 70.0
+    passed = record("i2c error")
+    assert repeats.filter(passed)
+    assert passed.getMessage() == "i2c error"
+
+def test_a_repeat_after_the_window_carries_the_count(monkeypatch):
+    monkeypatch.setattr(diylogging, 'time', FakeTime)
+    FakeTime.now = 5.0
+    repeats = diylogging.RepeatFilter(60.0)
+    repeats.filter(record("bus busy"))
+    repeats.filter(record("bus busy"))
+    FakeTime.now = 66.0
+    passed = record("bus busy")
+    assert repeats.filter(passed)
+    assert passed.getMessage() == "bus busy (1 repeats suppressed)"
+    assert repeats.expire(200.0) == []
+
+def test_writer_wakes_to_report_a_finished_storm():
+    repeats = diylogging.RepeatFilter(0.1)
+    records = queue.Queue()
+    written = []
+    collector = logging.Handler()
+    collector.emit = lambda report: written.append(report.getMessage())
+    writer = diylogging.LogWriter(records, [collector], repeats)
+    for _ in range(4):
+        report = record("sensor timeout")
+        if repeats.filter(report):
+            records.put(report)
+    deadline = time.monotonic() + 2.0
+    while len(written) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.stop()
+    assert written == ["sensor timeout", "sensor timeout (3 repeats suppressed)"]
@@ -0,0 +1,95 @@
+""" packed framebuffer against per pixel writes on the bicolor matrix """
+
+import random
+
+import simulatedhw
+
+import led8x8framebuffer
+from led8x8framebuffer import FrameBuffer, BLACK, GREEN, RED, YELLOW
+
+COLORS = (BLACK, GREEN, RED, YELLOW)
+
+def random_image(seed):
+    """ 64 colors indexed x * 8 + y """
+    generator = random.Random(seed)
+    return [generator.choice(COLORS) for _ in range(64)]
+
+def drawn(image):
+    """ buffer left by one set_pixel call per pixel """
+    matrix = simulatedhw.SimulatedBicolorMatrix8x8()
+    for index, color in enumerate(image):
+        matrix.set_pixel(index >> 3, index & 7, color)
+    return bytes(matrix.buffer)
+
+def shown(frame):
+    """ buffer left by showing a frame """
+    matrix = simulatedhw.SimulatedBicolorMatrix8x8()
+    frame.show(matrix)
+    assert matrix.frames == 1
+    return bytes(matrix.buffer)
+
+def test_set_pixel_matches_matrix():
+    for seed in range(20):
+        image = random_image(seed)
+        frame = FrameBuffer()
+        for index, color in enumerate(image):
+            frame.set_pixel(index >> 3, index & 7, color)
+        assert shown(frame) == drawn(image)
+        assert [frame.get_pixel(index >> 3, index & 7) for index in range(64)] == image
+
+def test_map_cells_matches_matrix():
+    palette = (BLACK, GREEN, YELLOW, RED)
+    for seed in range(20):
+        generator = random.Random(seed)
+        cells = [generator.randrange(6) for _ in range(64)]
+        frame = FrameBuffer()
+        frame.fill(YELLOW)
+        frame.map_cells(cells, palette)
+        assert shown(frame) == drawn([palette[min(value, 3)] for value in cells])
+
+def test_fill_and_paint():
+    for color in COLORS:
+        frame = FrameBuffer()
+        frame.fill(color)
+        assert shown(frame) == drawn([color] * 64)
+    image = random_image(1)
+    mask = random.Random(2).getrandbits(64)
+    frame = FrameBuffer()
+    for index, color in enumerate(image):
+        frame.set_pixel(index >> 3, index & 7, color)
+    frame.paint(mask, RED)
+    expected = [RED if mask >> (((index & 7) << 3) | (index >> 3)) & 1 else color
+                for index, color in enumerate(image)]
+    assert shown(frame) == drawn(expected)
+
+def test_shift_and_rotate_match_pixel_moves():
+    image = random_image(3)
+    for dx, dy, wrap in ((1, 0, False), (-2, 3, False), (3, -1, True), (-5, 6, True)):
+        frame = FrameBuffer()
+        for index, color in enumerate(image):
+            frame.set_pixel(index >> 3, index & 7, color)
+        frame.shift(dx, dy, wrap)
+        expected = [BLACK] * 64
+        for index, color in enumerate(image):
+            xpixel, ypixel = (index >> 3) + dx, (index & 7) + dy
+            if wrap:
+                xpixel, ypixel = xpixel % 8, ypixel % 8
+            if 0 <= xpixel < 8 and 0 <= ypixel < 8:
+                expected[xpixel * 8 + ypixel] = color
+        assert shown(frame) == drawn(expected), (dx, dy, wrap)
+    frame = FrameBuffer()
+    for index, color in enumerate(image):
+        frame.set_pixel(index >> 3, index & 7, color)
+    frame.rotate()
+    expected = [BLACK] * 64
+    for index, color in enumerate(image):
+        xpixel, ypixel = index >> 3, index & 7
+        expected[(7 - ypixel) * 8 + xpixel] = color
+    assert shown(frame) == drawn(expected)
+
+def test_planes_match_buffer_layout():
+    frame = FrameBuffer()
+    frame.set_pixel(7, 0, GREEN)
+    frame.set_pixel(0, 7, RED)
+    assert frame.planes() == (1 << 7, 1 << 56)
+    assert led8x8framebuffer.mask_rows(1 << 56) == bytes(7) + b'\x01'
@@ -0,0 +1,67 @@
+""" countdown payloads the clock refuses and delays its thread can always wait """
+
+import math
+
+import simulatedhw
+simulatedhw.install()
+
+#pylint: disable=wrong-import-position
+import ledclock
+
+class Stop(BaseException):
+    """ ends time_update_thread, which catches Exception """
+
+class RecordingWake:
+    """ event stand-in that records each wait and runs the next step after it """
+
+    def __init__(self, steps):
+        self.delays = []
+        self.steps = iter(steps)
+
+    def wait(self, delay):
+        self.delays.append(delay)
+        step = next(self.steps, None)
+        if step is None:
+            raise Stop()
+        step()
+        return False
+
+    def set(self,):
+        pass
+
+    def clear(self,):
+        pass
+
+def test_counts_the_display_cannot_show_change_nothing():
+    clock = ledclock.LedClock()
+    for seconds in (10000, -1, math.nan, math.inf):
+        assert not ledclock.valid_count(seconds)
+        assert not clock.set_countdown(seconds)
+        assert clock.mode == ledclock.TIME_MODE
+    assert clock.set_countdown(90.0, True)
+    assert clock.mode == ledclock.COUNT_MODE
+    assert clock.count.max_count == 90.0
+
+def test_start_epochs_far_from_now_are_refused(clock):
+    #pylint: disable=unused-argument
+    led_clock = ledclock.LedClock()
+    now = ledclock.timesource.time()
+    for epoch in (math.nan, math.inf, 1e300, now + 2 * ledclock.START_HORIZON):
+        assert not ledclock.valid_start(epoch)
+        assert not led_clock.start_countdown(epoch)
+        assert not led_clock.count.running
+    assert led_clock.start_countdown(now + 30)
+    assert led_clock.count.running
+
+def test_thread_waits_are_bounded_and_survive_bad_deadlines():
+    clock = ledclock.LedClock()
+    clock.mode = ledclock.COUNT_MODE
+    # epochs that get past the message checks only by calling the display directly
+    clock.count.start(math.nan)
+    clock.wake = RecordingWake([lambda: clock.count.start(math.inf),
+                                lambda: clock.count.start(1e300)])
+    try:
+        clock.time_update_thread()
+    except Stop:
+        pass
+    assert clock.wake.delays == [1.0, 1.0, ledclock.LONGEST_WAIT]
@@ -0,0 +1,98 @@
+""" queued mode and state transitions applied by the display thread """
+
+import timesource
+import led8x8controller
+from led8x8controller import (ModeController, FIBONACCI_MODE, WOPR_MODE, LIFE_MODE,
+                              TEXT_MODE, FIRE_MODE, PANIC_MODE, DEMO_STATE, SECURITY_STATE)
+
+def modes(controller):
+    """ current and last mode after applying the queue """
+    snap = controller.apply_transitions()
+    return snap.current_mode, snap.last_mode
+
+def test_initial_snapshot():
+    controller = ModeController()
+    snap = controller.apply_transitions()
+    assert (snap.version, snap.machine_state) == (0, DEMO_STATE)
+    assert (snap.current_mode, snap.last_mode) == (FIBONACCI_MODE, LIFE_MODE)
+
+def test_set_mode_keeps_the_previous_as_last():
+    controller = ModeController()
+    controller.set_mode(WOPR_MODE)
+    assert modes(controller) == (WOPR_MODE, FIBONACCI_MODE)
+    controller.set_mode(WOPR_MODE)
+    assert modes(controller) == (WOPR_MODE, FIBONACCI_MODE)
+    controller.restore_mode()
+    assert modes(controller) == (FIBONACCI_MODE, FIBONACCI_MODE)
+
+def test_alarms_are_only_replaced_by_an_override():
+    controller = ModeController()
+    controller.set_mode(FIRE_MODE)
+    controller.set_mode(WOPR_MODE)
+    assert modes(controller) == (FIRE_MODE, FIBONACCI_MODE)
+    controller.set_mode(PANIC_MODE)
+    assert modes(controller)[0] == FIRE_MODE
+    controller.set_mode(PANIC_MODE, True)
+    assert modes(controller) == (PANIC_MODE, FIRE_MODE)
+    controller.set_mode(FIBONACCI_MODE, True)
+    assert modes(controller)[0] == FIBONACCI_MODE
+
+def test_transitions_apply_in_order_once():
+    controller = ModeController()
+    controller.set_state(SECURITY_STATE)
+    controller.set_mode(WOPR_MODE)
+    controller.set_mode(LIFE_MODE)
+    snap = controller.apply_transitions()
+    assert (snap.version, snap.machine_state, snap.current_mode, snap.last_mode) == \
+        (3, SECURITY_STATE, LIFE_MODE, WOPR_MODE)
+    assert controller.apply_transitions().version == 3
+
+def test_text_ends_back_in_the_previous_mode():
+    controller = ModeController()
+    controller.set_mode(TEXT_MODE)
+    assert modes(controller) == (TEXT_MODE, FIBONACCI_MODE)
+    controller.end_text()
+    assert modes(controller) == (FIBONACCI_MODE, FIBONACCI_MODE)
+
+def test_fire_queued_during_text_survives_the_end_of_the_message():
+    controller = ModeController()
+    controller.set_mode(TEXT_MODE)
+    controller.set_mode(FIRE_MODE)
+    controller.end_text()
+    assert modes(controller) == (FIRE_MODE, FIBONACCI_MODE)
+    controller.end_text()
+    assert modes(controller) == (FIRE_MODE, FIBONACCI_MODE)
+    # the alarm clearing restores the mode from before the message, not the message
+    controller.restore_mode()
+    assert modes(controller) == (FIBONACCI_MODE, FIBONACCI_MODE)
+
+def test_end_text_is_ignored_outside_text():
+    controller = ModeController()
+    controller.set_mode(WOPR_MODE)
+    controller.end_text()
+    assert modes(controller) == (WOPR_MODE, FIBONACCI_MODE)
+
+def test_text_is_never_kept_as_last_mode():
+    controller = ModeController()
+    controller.set_mode(TEXT_MODE)
+    controller.set_mode(TEXT_MODE)
+    controller.set_mode(WOPR_MODE)
+    assert modes(controller) == (WOPR_MODE, FIBONACCI_MODE)
+    assert led8x8controller.TEXT_MODE not in modes(controller)
+
+def rotation(demo_modes=led8x8controller.DEMO_MODES):
+    """ modes shown over two full turns of the demo rotation """
+    controller = ModeController(demo_modes=demo_modes)
+    shown = set()
+    for _ in range(2 * len(demo_modes)):
+        timesource.sleep(led8x8controller.ROTATION_SECONDS)
+        controller.evaluate()
+        shown.add(controller.get_mode())
+    return shown
+
+def test_dither_rotates_only_when_opted_in(clock):
+    #pylint: disable=unused-argument
+    assert rotation() == set(led8x8controller.DEMO_MODES)
+    assert led8x8controller.DITHER_MODE not in rotation()
+    assert rotation(led8x8controller.DITHER_DEMO_MODES) == \
+        set(led8x8controller.DEMO_MODES) | {led8x8controller.DITHER_MODE}
@@ -0,0 +1,124 @@
+""" motion journal, incremental heatmap and which motion messages reach them """
+
+import os
+import datetime
+
+import simulatedhw
+import timesource
+
+import occupancy
+import motionjournal
+import led8x8motion
+
+def noon(days_ago=0):
+    """ local noon days_ago days before a fixed day """
+    day = datetime.date(2026, 3, 10) - datetime.timedelta(days=days_ago)
+    return datetime.datetime.combine(day, datetime.time(12)).timestamp()
+
+def test_heatmap_counts_per_day_and_room():
+    heatmap = motionjournal.DailyHeatmap(days=8, rooms=8)
+    heatmap.record(2, noon())
+    heatmap.record(2, noon() + 60)
+    heatmap.record(5, noon(3))
+    heatmap.record(1, noon(8))
+    heatmap.record(9, noon())
+    assert heatmap.counts[7 * 8 + 2] == 2
+    assert heatmap.counts[4 * 8 + 5] == 1
+    assert sum(heatmap.counts) == 3
+    assert heatmap.peak == 2
+    levels = heatmap.levels()
+    assert (levels[7 * 8 + 2], levels[4 * 8 + 5], levels[0]) == (2, 1, 0)
+
+def test_heatmap_rolls_over_at_midnight():
+    heatmap = motionjournal.DailyHeatmap(days=8, rooms=8)
+    heatmap.record(0, noon(1))
+    heatmap.record(0, noon(1))
+    heatmap.record(3, noon())
+    version = heatmap.version
+    heatmap.advance(noon())
+    assert heatmap.version == version
+    heatmap.advance(noon(-2))
+    assert heatmap.version == version + 1
+    assert heatmap.counts[4 * 8 + 0] == 2
+    assert heatmap.counts[5 * 8 + 3] == 1
+    heatmap.advance(noon(-20))
+    assert sum(heatmap.counts) == 0 and heatmap.peak == 0
+
+def test_journal_round_trip_rotation_and_reopen(tmp_path):
+    path = str(tmp_path / "motion.bin")
+    journal = motionjournal.MotionJournal(path, segment_records=100)
+    for number in range(250):
+        journal.append(number % 8, 1000000 + number)
+    journal.flush()
+    events = list(journal.events(1000000, 1000250))
+    # two segments are kept, so the oldest records were rotated away
+    assert 100 <= len(events) <= 200
+    assert [seconds for seconds, _ in events] == sorted(seconds for seconds, _ in events)
+    assert events[-1] == (1000249, 249 % 8)
+    assert list(journal.events(1000240, 1000245)) == \
+        [(seconds, seconds % 8) for seconds in range(1000240, 1000245)]
+    journal.close()
+    reopened = motionjournal.MotionJournal(path, segment_records=100)
+    assert list(reopened.events(1000000, 1000250)) == events
+    reopened.close()
+
+def test_a_lone_record_is_written_within_the_flush_bound(clock, tmp_path):
+    #pylint: disable=unused-argument
+    path = str(tmp_path / "motion.bin")
+    journal = motionjournal.MotionJournal(path)
+    journal.run()
+    journal.append(3, 1000000)
+    timesource.sleep(motionjournal.FLUSH_SECONDS + 1)
+    assert os.path.getsize(path) == len(motionjournal.MAGIC) + motionjournal.RECORD.size
+    journal.close()
+    journal.close()
+
+def test_heatmap_loads_from_journal(tmp_path):
+    journal = motionjournal.MotionJournal(str(tmp_path / "motion.bin"))
+    for days_ago in (9, 2, 0, 0):
+        journal.append(1, noon(days_ago))
+    journal.flush()
+    heatmap = motionjournal.DailyHeatmap()
+    heatmap.load(journal, noon() + 1)
+    assert heatmap.counts[7 * 8 + 1] == 2
+    assert heatmap.counts[5 * 8 + 1] == 1
+    assert sum(heatmap.counts) == 3
+    journal.close()
+
+def motion_pattern():
+    """ motion pattern counting into a fresh heatmap """
+    heatmap = motionjournal.DailyHeatmap()
+    return led8x8motion.Led8x8Motion(simulatedhw.SimulatedBicolorMatrix8x8(), None, heatmap), heatmap
+
+def test_only_rising_motion_edges_are_counted():
+    pattern, heatmap = motion_pattern()
+    topic = led8x8motion.ROOMS[3][0]
+    pattern.motion_detected(topic, True, replay=True)
+    assert sum(heatmap.counts) == 0
+    for active in (True, True, False, False, True):
+        pattern.motion_detected(topic, active)
+    assert sum(heatmap.counts) == 1
+    pattern.motion_detected(topic, False)
+    pattern.motion_detected(topic, True)
+    assert sum(heatmap.counts) == 2
+    # every message still restarts the countdown shown on the matrix
+    pattern.seconds[3] = 0
+    pattern.motion_detected(topic, False)
+    assert pattern.seconds[3] == led8x8motion.MOTION_SECONDS
+    pattern.motion_detected("diy/unknown/room/motion", True)
+    assert sum(heatmap.counts) == 2
+
+def test_only_newly_occupied_rooms_are_counted():
+    pattern, heatmap = motion_pattern()
+    pattern.occupancy_detected(occupancy.encode(1, 0b101), replay=True)
+    assert sum(heatmap.counts) == 0
+    pattern.occupancy_detected(occupancy.encode(2, 0b111))
+    assert sum(heatmap.counts) == 1
+    for sequence in range(3, 10):
+        pattern.occupancy_detected(occupancy.encode(sequence, 0b111))
+    pattern.occupancy_detected(occupancy.encode(10, 0b011))
+    assert sum(heatmap.counts) == 1
+    pattern.seconds[2] = 0
+    pattern.occupancy_detected(occupancy.encode(11, 0b111))
+    assert sum(heatmap.counts) == 2
+    assert pattern.seconds[2] == led8x8motion.MOTION_SECONDS
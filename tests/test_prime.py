@@ -0,0 +1,57 @@
+""" the streaming prime sieve against a plain sieve of the same numbers """
+
+import led8x8prime
+
+def primes_between(low, high):
+    """ reference primes in [low, high) crossed off by every number up to the root """
+    numbers = bytearray([1]) * (high - low)
+    for factor in range(2, int(high ** 0.5) + 1):
+        first = max(factor * factor, (low + factor - 1) // factor * factor)
+        numbers[first - low::factor] = bytes(len(range(first - low, high - low, factor)))
+    return [low + index for index in range(high - low) if numbers[index] and low + index >= 2]
+
+def take_below(stream, high):
+    """ primes from the stream up to the first one at or past high """
+    primes = []
+    while not primes or primes[-1] < high:
+        primes.append(stream.next_prime(budget=1 << 20))
+    return primes[:-1]
+
+def test_primes_across_segment_boundaries():
+    high = 2 + 2 * 3 * led8x8prime.SEGMENT_ODDS + 100
+    assert take_below(led8x8prime.PrimeStream(), high) == primes_between(2, high)
+    # a start that is not the first number of a segment
+    start = 2 * led8x8prime.SEGMENT_ODDS - 7
+    stream = led8x8prime.PrimeStream(start)
+    assert take_below(stream, start + 4 * led8x8prime.SEGMENT_ODDS) == \
+        primes_between(start, start + 4 * led8x8prime.SEGMENT_ODDS)
+
+def test_numbers_past_end_wrap_to_start():
+    for end in (1 << 8, 100, 2 * led8x8prime.SEGMENT_ODDS + 11):
+        stream = led8x8prime.PrimeStream(2, end)
+        once = primes_between(2, end)
+        primes = [stream.next_prime(budget=1 << 20) for _ in range(2 * len(once) + 1)]
+        assert primes == once + once + once[:1]
+    stream = led8x8prime.PrimeStream(1 << 15, 1 << 16)
+    once = primes_between(1 << 15, 1 << 16)
+    assert [stream.next_prime(budget=1 << 20) for _ in range(len(once) + 2)] == once + once[:2]
+
+def test_exact_sieve_hands_over_to_presieve_near_2_to_the_32():
+    low = (1 << 32) - 3 * 2 * led8x8prime.SEGMENT_ODDS
+    high = (1 << 32) + 3 * 2 * led8x8prime.SEGMENT_ODDS
+    stream = led8x8prime.PrimeStream(low + 1, 1 << 33)
+    assert stream.exact
+    assert take_below(stream, high) == primes_between(low, high)
+    assert not stream.exact
+
+def test_next_prime_stops_at_its_budget():
+    stream = led8x8prime.PrimeStream(1 << 31, 1 << 32)
+    assert stream.next_prime(budget=1) is None
+    misses = 0
+    while True:
+        prime = stream.next_prime()
+        if prime is not None:
+            break
+        misses += 1
+    assert misses > 0
+    assert prime == primes_between(1 << 31, (1 << 31) + 100)[0]
@@ -0,0 +1,77 @@
+""" governor levels from load samples and what a throttled matrix holds """
+
+import os
+import sys
+import subprocess
+
+import simulatedhw
+
+import rendergovernor
+from rendergovernor import (RenderGovernor, ANIMATION_TIER, DEMO_TIER, SECURITY_TIER,
+                            RAISE_SAMPLES, RELAX_SAMPLES, MAXIMUM_LEVEL, MAXIMUM_STRETCH)
+import led8x8dither
+import led8x8controller
+
+def scripted(loads):
+    """ governor reading loads in order after the priming call in its constructor """
+    script = iter([0.0] + list(loads))
+    return RenderGovernor(load=lambda: next(script))
+
+def levels(governor, count):
+    """ level after each of count samples """
+    result = []
+    for _ in range(count):
+        governor.sample()
+        result.append(governor.level)
+    return result
+
+def test_overload_raises_one_tier_per_raise_samples():
+    governor = scripted([0.95] * (RAISE_SAMPLES * (MAXIMUM_LEVEL + 1)))
+    steps = levels(governor, RAISE_SAMPLES * (MAXIMUM_LEVEL + 1))
+    assert steps[RAISE_SAMPLES - 2] == 0
+    assert steps[RAISE_SAMPLES - 1] == 1
+    assert steps[-1] == MAXIMUM_LEVEL
+    assert governor.raised == MAXIMUM_LEVEL
+
+def test_quiet_lowers_after_relax_samples_and_middling_load_holds():
+    governor = scripted([0.95] * RAISE_SAMPLES + [0.7] * 20 + [0.2] * RELAX_SAMPLES)
+    levels(governor, RAISE_SAMPLES)
+    assert levels(governor, 20) == [1] * 20
+    steps = levels(governor, RELAX_SAMPLES)
+    assert steps == [1] * (RELAX_SAMPLES - 1) + [0]
+    assert governor.lowered == 1
+
+def test_a_short_burst_does_not_raise():
+    governor = scripted([0.95, 0.3] * 10)
+    assert levels(governor, 20) == [0] * 20
+
+def test_stretch_slows_the_lowest_tiers_most():
+    governor = scripted([])
+    governor.set_level(2)
+    assert governor.stretch(None) == 1
+    assert governor.stretch(ANIMATION_TIER) == 4
+    assert governor.stretch(DEMO_TIER) == 2
+    assert governor.stretch(SECURITY_TIER) == 1
+    governor.set_level(MAXIMUM_LEVEL)
+    assert governor.stretch(ANIMATION_TIER) == MAXIMUM_STRETCH
+
+def test_importing_the_governor_leaves_psutil_unloaded():
+    code = "import sys, rendergovernor; print('psutil' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                            text=True, cwd=os.path.dirname(rendergovernor.__file__))
+    assert output.stdout.strip() == "False"
+    assert scripted([]).summary()["source"] == "custom"
+
+def test_throttled_dither_holds_its_flat_frame(clock):
+    #pylint: disable=unused-argument
+    matrix = simulatedhw.SimulatedBicolorMatrix8x8()
+    governor = scripted([])
+    governor.set_level(ANIMATION_TIER)
+    controller = led8x8controller.Led8x8Controller(matrix, governor=governor)
+    controller.mode_controller.set_state(led8x8controller.DEMO_STATE)
+    controller.mode_controller.set_mode(led8x8controller.DITHER_MODE)
+    snap = controller.mode_controller.apply_transitions()
+    controller.dither.display()
+    flat = controller.dither.subframes[led8x8dither.FLAT_SUBFRAME]
+    controller.throttle(snap)
+    assert bytes(matrix.buffer) == flat
@@ -0,0 +1,77 @@
+""" command ring shared between the network and render processes """
+
+import sys
+from threading import Thread
+
+import pytest
+
+import renderprocess
+
+def test_ring_round_trip():
+    ring = renderprocess.CommandRing(slots=4)
+    assert ring.get() is None
+    assert ring.put(renderprocess.MATRIX_MODE, -1, 0xFFFF, b'text')
+    assert ring.get() == (renderprocess.MATRIX_MODE, -1, 0xFFFF, b'text')
+    assert ring.get() is None
+
+def test_ring_full_counts_drops():
+    ring = renderprocess.CommandRing(slots=2)
+    assert ring.put(1) and ring.put(2)
+    assert not ring.put(3)
+    assert ring.dropped == 1
+    assert [ring.get()[0], ring.get()[0]] == [1, 2]
+
+def test_concurrent_senders_lose_nothing():
+    renderer = renderprocess.RenderProcess(0x70, 0x71)
+    renderer.ring = renderprocess.CommandRing(slots=8192)
+    interval = sys.getswitchinterval()
+    # switch threads often enough that unserialised puts collide
+    sys.setswitchinterval(1e-6)
+    threads = [Thread(target=lambda sender=sender: [
+        renderer.send(renderprocess.MATRIX_MODE, sender, number) for number in range(1000)])
+               for sender in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sys.setswitchinterval(interval)
+    received = []
+    command = renderer.ring.get()
+    while command is not None:
+        received.append((command[1], command[2]))
+        command = renderer.ring.get()
+    assert sorted(received) == [(sender, number) for sender in range(6) for number in range(1000)]
+    assert renderer.ring.dropped == 0
+
+def test_text_speed_is_range_checked():
+    renderer = renderprocess.RenderProcess(0x70, 0x71)
+    renderer.matrix.show_text("hi", 3, 50.0)
+    assert renderer.ring.get() == (renderprocess.MATRIX_TEXT, 3, 5000, b'hi')
+    for speed in (0.0, -1.0, 700.0, float("nan"), float("inf")):
+        with pytest.raises(ValueError):
+            renderer.matrix.show_text("hi", 3, speed)
+    assert renderer.ring.get() is None
+
+class Recorder:
+    """ stands in for a controller and records the calls the commands make """
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+def test_a_failing_command_does_not_stop_the_rest():
+    renderer = renderprocess.RenderProcess(0x70, 0x71)
+    matrix = Recorder()
+    clock = Recorder()
+    renderer.ring.put(renderprocess.MATRIX_OCCUPANCY, 0, 0, b'not hex')
+    renderer.ring.put(renderprocess.CLOCK_COUNT_SET, 0, 0, b'soon')
+    topic = "diy/main/" + "\u00e9" * 30 + "/motion"
+    renderer.matrix.update_motion(topic, True)
+    renderer.clock.set_countdown(90.0, False)
+    renderer.apply_queued(matrix, clock)
+    assert renderer.ring.get() is None
+    assert len(matrix.calls) == 1 and matrix.calls[0][0] == "update_motion"
+    assert topic.startswith(matrix.calls[0][1])
+    assert clock.calls == [("set_countdown", 90.0, False)]
@@ -0,0 +1,45 @@
+""" precomputed seven segment buffers against the per digit writes they replace """
+
+import datetime
+
+import pytest
+
+import simulatedhw
+
+import segmentbuffers
+
+def drawn(draw):
+    """ buffer left by drawing on a cleared simulated seven segment display """
+    display = simulatedhw.SimulatedSevenSegment()
+    display.clear()
+    draw(display)
+    return bytes(display.buffer)
+
+@pytest.mark.parametrize("time_format", ["%l%M", "%H%M"])
+def test_time_of_day_matches_print_number_str(time_format):
+    buffers = segmentbuffers.SegmentBuffers()
+    day = datetime.datetime(2000, 1, 1)
+    for minute_of_day in range(24 * 60):
+        moment = day + datetime.timedelta(minutes=minute_of_day)
+        for colon in (False, True):
+            for alarm in (False, True):
+                def draw(display, moment=moment, colon=colon, alarm=alarm):
+                    display.print_number_str(moment.strftime(time_format))
+                    display.set_colon(colon)
+                    display.set_decimal(3, alarm)
+                    display.set_decimal(1, moment.hour > 11)
+                table = buffers.time_of_day(time_format, moment.hour, moment.minute, colon, alarm)
+                assert bytes(table) == drawn(draw), (moment, colon, alarm)
+
+def test_numbers_match_print_number_str():
+    buffers = segmentbuffers.SegmentBuffers()
+    for number in range(segmentbuffers.MAXIMUM_NUMBER + 1):
+        expected = drawn(lambda display, number=number: display.print_number_str(str(number)))
+        assert bytes(buffers.number(number)) == expected, number
+
+def test_tenths_match_print_number_str():
+    buffers = segmentbuffers.SegmentBuffers()
+    for tenths in range(segmentbuffers.MAXIMUM_NUMBER + 1):
+        text = "{}.{}".format(tenths // 10, tenths % 10)
+        expected = drawn(lambda display, text=text: display.print_number_str(text))
+        assert bytes(buffers.tenths(tenths)) == expected, tenths
@@ -0,0 +1,16 @@
+""" message payload parsing for the scrolling text mode """
+
+import led8x8text
+from led8x8text import parse_message, SCROLL_SPEED, MINIMUM_SPEED, MAXIMUM_SPEED
+
+def test_plain_colored_and_timed_messages():
+    assert parse_message(b'HELLO') == ('HELLO', led8x8text.YELLOW, SCROLL_SPEED)
+    assert parse_message(b'red:HI') == ('HI', led8x8text.COLORS['red'], SCROLL_SPEED)
+    assert parse_message(b'green/20:HI') == ('HI', led8x8text.COLORS['green'], 20.0)
+    assert parse_message(b'10:30') == ('10:30', led8x8text.YELLOW, SCROLL_SPEED)
+
+def test_speeds_are_clamped_and_non_finite_ones_fall_back():
+    assert parse_message(b'red/0.01:HI')[2] == MINIMUM_SPEED
+    assert parse_message(b'red/1e9:HI')[2] == MAXIMUM_SPEED
+    for rate in (b'nan', b'inf', b'-inf', b'fast'):
+        assert parse_message(b'red/' + rate + b':HI')[2] == SCROLL_SPEED
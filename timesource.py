@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+""" Wall clock, monotonic clock, sleeps and thread wake-ups from one replaceable source """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import time as _time
+import datetime
+from threading import Thread, Event, Lock, Condition, current_thread
+
+INFINITY = float('inf')
+
+class SystemTime:
+    """ the real clocks; what every module uses unless a simulation installs another source """
+
+    @classmethod
+    def time(cls,):
+        """ wall clock seconds since the epoch """
+        return _time.time()
+
+    @classmethod
+    def monotonic(cls,):
+        """ seconds from an arbitrary start that never go backwards """
+        return _time.monotonic()
+
+    @classmethod
+    def sleep(cls, seconds):
+        """ block the calling thread """
+        _time.sleep(seconds)
+
+    @classmethod
+    def now(cls,):
+        """ local wall clock as a datetime """
+        return datetime.datetime.now()
+
+    @classmethod
+    def event(cls,):
+        """ event whose wait timeouts run on this clock """
+        return Event()
+
+    @classmethod
+    def spawn(cls, target, args=()):
+        """ start a daemon thread """
+        thread = Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+class VirtualEvent:
+    """ threading.Event look-alike whose timeouts are measured in virtual time """
+
+    def __init__(self, source):
+        """ unset event bound to a virtual clock """
+        self.source = source
+        self.flag = False
+
+    def set(self,):
+        """ set the flag and release every thread waiting on this event """
+        with self.source.lock:
+            self.flag = True
+            self.source.release(lambda waiter: waiter[1] is self)
+
+    def clear(self,):
+        """ reset the flag """
+        with self.source.lock:
+            self.flag = False
+
+    def is_set(self,):
+        """ current flag """
+        return self.flag
+
+    def wait(self, timeout=None):
+        """ True once set, False if the virtual timeout passes first """
+        return self.source.wait_for(self, timeout)
+
+class VirtualTime:
+    """ virtual clock that runs as fast as the threads using it allow
+
+        Time stands still while any registered thread is running. When every
+        one of them is sleeping or waiting it jumps straight to the earliest
+        deadline and wakes only the threads that are due. Threads started with
+        spawn() are registered before they run; any other thread registers on
+        its first sleep or wait. The thread that creates the clock is
+        registered from the start, so time stays put while it sets up. """
+
+    def __init__(self, epoch=None):
+        """ start at a wall clock epoch, by default the real current time """
+        self.epoch = _time.time() if epoch is None else epoch
+        self.elapsed = 0.0
+        self.lock = Lock()
+        self.threads = {current_thread()}
+        self.waiting = {}
+        self.advances = 0
+
+    def time(self,):
+        """ virtual wall clock seconds since the epoch """
+        return self.epoch + self.elapsed
+
+    def monotonic(self,):
+        """ virtual seconds since the clock was created """
+        return self.elapsed
+
+    def now(self,):
+        """ virtual local wall clock as a datetime """
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def sleep(self, seconds):
+        """ block the calling thread for virtual seconds """
+        self.wait_for(None, seconds)
+
+    def event(self,):
+        """ event whose wait timeouts run on this clock """
+        return VirtualEvent(self)
+
+    def spawn(self, target, args=()):
+        """ start a registered daemon thread """
+        thread = Thread(target=self.run_thread, args=(target, args))
+        thread.daemon = True
+        with self.lock:
+            self.threads.add(thread)
+        thread.start()
+        return thread
+
+    def run_thread(self, target, args):
+        """ unregister the thread when its target returns or raises """
+        try:
+            target(*args)
+        finally:
+            with self.lock:
+                self.threads.discard(current_thread())
+                self.waiting.pop(current_thread(), None)
+                self.advance()
+
+    def wait_for(self, event, timeout):
+        """ block until event is set (if given) or the virtual timeout passes """
+        thread = current_thread()
+        with self.lock:
+            self.threads.add(thread)
+            deadline = INFINITY if timeout is None else self.elapsed + max(0.0, timeout)
+            condition = Condition(self.lock)
+            while True:
+                if event is not None and event.flag:
+                    return True
+                if self.elapsed >= deadline:
+                    return False
+                self.waiting[thread] = (deadline, event, condition)
+                self.advance()
+                if thread in self.waiting:
+                    condition.wait()
+                self.waiting.pop(thread, None)
+
+    def release(self, due):
+        """ with the lock held: wake the waiters for which due(waiter) is true """
+        for thread, waiter in list(self.waiting.items()):
+            if due(waiter):
+                del self.waiting[thread]
+                waiter[2].notify()
+
+    def advance(self,):
+        """ with the lock held: once every registered thread waits, jump to the next deadline """
+        if len(self.waiting) < len(self.threads):
+            return
+        deadline = min(waiter[0] for waiter in self.waiting.values())
+        if deadline == INFINITY:
+            return
+        self.elapsed = max(self.elapsed, deadline)
+        self.advances += 1
+        self.release(lambda waiter: waiter[0] <= self.elapsed)
+
+SOURCE = SystemTime()
+
+def install(source):
+    """ replace the time source; do it before creating the objects that will use it """
+    #pylint: disable=global-statement
+    global SOURCE
+    SOURCE = source
+    return source
+
+def time():
+    """ wall clock seconds since the epoch """
+    return SOURCE.time()
+
+def monotonic():
+    """ seconds that never go backwards """
+    return SOURCE.monotonic()
+
+def sleep(seconds):
+    """ block the calling thread """
+    SOURCE.sleep(seconds)
+
+def now():
+    """ local wall clock as a datetime """
+    return SOURCE.now()
+
+def event():
+    """ a threading.Event equivalent for the installed source """
+    return SOURCE.event()
+
+def spawn(target, args=()):
+    """ start a daemon thread known to the installed source """
+    return SOURCE.spawn(target, args)
+
+if __name__ == '__main__':
+    sys.exit()
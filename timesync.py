@@ -0,0 +1,282 @@
+#!/usr/bin/python3
+
+""" Shared animation timeline for several clocks from MQTT time beacons """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import math
+import struct
+import logging
+from collections import deque
+
+import timesource
+
+BEACON_TOPIC = "diy/system/time"
+
+# version, sequence and the leader's wall clock in microseconds
+BEACON = struct.Struct('<BHq')
+
+VERSION = 1
+
+BEACON_SECONDS = 2.0
+
+# beacons kept for the offset and drift estimate
+WINDOW = 32
+
+# drift is only fitted once the window spans this many seconds
+DRIFT_SPAN = 20.0
+
+# fitted drift is clamped to what a crystal oscillator can plausibly do
+MAX_DRIFT = 500e-6
+
+# a beacon this far ahead of the prediction means a clock was stepped; start
+# over. One this far behind may only have been delayed, so a second beacon
+# that agrees with it has to confirm the step first
+STEP_SECONDS = 0.5
+
+LOGGER = logging.getLogger(__name__)
+
+def encode(sequence, seconds):
+    """ 11 byte beacon payload """
+    return BEACON.pack(VERSION, sequence & 0xFFFF, int(round(seconds * 1000000)))
+
+def decode(payload):
+    """ (sequence, seconds) or None for an unknown payload """
+    if len(payload) != BEACON.size:
+        return None
+    version, sequence, micros = BEACON.unpack(payload)
+    if version != VERSION:
+        return None
+    return sequence, micros / 1000000.0
+
+class TimeLeader:
+    """ publish the wall clock of this clock as the shared timeline """
+
+    def __init__(self, client, interval=BEACON_SECONDS):
+        """ client is a paho client or a localbroker.LocalClient """
+        self.client = client
+        self.interval = interval
+        self.sequence = 0
+        self.thread = None
+
+    def publish_thread(self,):
+        """ stamp each beacon as late as possible before it is sent """
+        while True:
+            self.sequence += 1
+            self.client.publish(BEACON_TOPIC, encode(self.sequence, timesource.time()), 0, False)
+            timesource.sleep(self.interval)
+
+    def run(self,):
+        """ start publishing beacons """
+        self.thread = timesource.spawn(self.publish_thread)
+
+class SharedClock:
+    """ this clock's estimate of the leader's timeline
+
+        Each beacon gives leader time minus local monotonic time at receipt,
+        which is the true offset less the network delay. Drift is a least
+        squares fit over the window, the offset its upper envelope so delayed
+        beacons never pull the estimate back. A beacon far behind the estimate
+        only restarts it once the next beacon agrees, so one delivered late
+        is dropped rather than taken for a step. Until the first beacon, and on
+        the leader which does not subscribe, the shared timeline is this
+        clock's wall clock.
+
+        The estimate is replaced in a single reference assignment so the
+        display thread reads it without a lock. """
+
+    def __init__(self, local=None):
+        """ local() is the monotonic clock to align, timesource.monotonic by default """
+        self.local = local if local is not None else timesource.monotonic
+        self.samples = deque(maxlen=WINDOW)
+        self.estimate = None
+        self.beacons = 0
+        self.ignored = 0
+        self.steps = 0
+        self.delayed = 0
+        self.behind = None
+
+    def on_beacon(self, payload, received=None):
+        """ fold one beacon into the estimate; received is local() at arrival """
+        decoded = decode(payload)
+        if decoded is None:
+            self.ignored += 1
+            return
+        if received is None:
+            received = self.local()
+        offset = decoded[1] - received
+        behind = self.behind
+        self.behind = None
+        if self.estimate is not None:
+            moved = offset - self.offset(received)
+            if moved < -STEP_SECONDS and (behind is None or abs(offset - behind[1]) > STEP_SECONDS):
+                # held out of the fit until the next beacon says whether it was a step
+                self.behind = (received, offset)
+                self.delayed += 1
+                return
+            if abs(moved) > STEP_SECONDS:
+                LOGGER.info('SharedClock: leader moved %.3f s, restarting estimate', moved)
+                self.steps += 1
+                self.samples.clear()
+                if behind is not None:
+                    self.delayed -= 1
+                    self.samples.append(behind)
+                    self.beacons += 1
+        self.samples.append((received, offset))
+        self.beacons += 1
+        self.fit()
+
+    def fit(self,):
+        """ drift by least squares then offset by the upper envelope of the window """
+        reference = self.samples[-1][0]
+        drift = 0.0
+        span = reference - self.samples[0][0]
+        if span >= DRIFT_SPAN:
+            count = len(self.samples)
+            mean_local = sum(local for local, _ in self.samples) / count
+            mean_offset = sum(offset for _, offset in self.samples) / count
+            spread = sum((local - mean_local) ** 2 for local, _ in self.samples)
+            drift = sum((local - mean_local) * (offset - mean_offset)
+                        for local, offset in self.samples) / spread
+            drift = min(max(drift, -MAX_DRIFT), MAX_DRIFT)
+        base = max(offset - drift * (local - reference) for local, offset in self.samples)
+        self.estimate = (reference, base, drift)
+
+    def offset(self, local):
+        """ shared time minus local time at a local instant """
+        estimate = self.estimate
+        if estimate is None:
+            return timesource.time() - timesource.monotonic()
+        reference, base, drift = estimate
+        return base + drift * (local - reference)
+
+    def synced(self,):
+        """ True once a beacon has been received """
+        return self.estimate is not None
+
+    def shared(self, local=None):
+        """ shared time now, or at a local instant """
+        if local is None:
+            local = self.local()
+        return local + self.offset(local)
+
+    def local_at(self, shared):
+        """ local instant at which the shared timeline reaches shared """
+        estimate = self.estimate
+        if estimate is None:
+            return shared - (timesource.time() - timesource.monotonic())
+        reference, base, drift = estimate
+        return (shared - base + drift * reference) / (1.0 + drift)
+
+    def next_boundary(self, period, after=None):
+        """ index of the next multiple of period on the shared timeline, past after """
+        index = math.floor(self.shared() / period) + 1
+        if after is not None and index <= after:
+            index = after + 1
+        return index
+
+    def sleep_until(self, shared, longest=None):
+        """ sleep until the shared timeline reaches shared, or at most longest seconds """
+        delay = self.local_at(shared) - self.local()
+        if longest is not None:
+            delay = min(delay, longest)
+        if delay > 0:
+            timesource.sleep(delay)
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        estimate = self.estimate
+        return {"synced": estimate is not None,
+                "offset": None if estimate is None else estimate[1],
+                "drift_ppm": None if estimate is None else estimate[2] * 1000000,
+                "beacons": self.beacons,
+                "ignored": self.ignored,
+                "delayed": self.delayed,
+                "steps": self.steps}
+
+def skew_demo(clocks=3, seconds=20.0, interval=0.5, delay=0.005):
+    """ frame edge skew of Led8x8Flash on several clocks synced through a local broker
+
+        Each follower's monotonic clock gets a random offset and up to 100 ppm
+        of drift, and each beacon up to delay seconds of random network delay. """
+    #pylint: disable=import-outside-toplevel,too-many-locals
+    import random
+    import time
+    from threading import Thread
+    import simulatedhw
+    simulatedhw.install()
+    import localbroker
+    import led8x8flash
+    import led8x8framebuffer
+    from Adafruit_LED_Backpack import BicolorMatrix8x8
+    broker = localbroker.LocalBroker()
+    leader = TimeLeader(localbroker.LocalClient(broker, "leader"), interval)
+    edges = []
+    followers = []
+    for number in range(clocks):
+        skew = random.uniform(-1000.0, 1000.0)
+        drift = random.uniform(-100e-6, 100e-6)
+        sync = SharedClock(lambda skew=skew, drift=drift: time.monotonic() * (1.0 + drift) + skew)
+        client = localbroker.LocalClient(broker, "clock{}".format(number))
+        client.message_callback_add(BEACON_TOPIC, lambda client, userdata, msg, sync=sync:
+                                    sync.on_beacon(msg.payload,
+                                                   sync.local() + random.uniform(0.0, delay)))
+        client.connect()
+        client.subscribe(BEACON_TOPIC)
+        client.loop_start()
+        matrix = BicolorMatrix8x8.BicolorMatrix8x8(address=0x70 + number)
+        flash = led8x8flash.Led8x8Flash(matrix, led8x8framebuffer.RED, sync)
+        followers.append((sync, flash, matrix))
+        edges.append({})
+    leader.run()
+    while not all(sync.synced() for sync, _, _ in followers):
+        time.sleep(interval)
+
+    def animate(number, flash, stop):
+        while time.monotonic() < stop:
+            flash.display()
+            edges[number][flash.index] = time.monotonic()
+
+    stop = time.monotonic() + seconds
+    threads = [Thread(target=animate, args=(number, flash, stop), daemon=True)
+               for number, (_, flash, _) in enumerate(followers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    common = set.intersection(*(set(edge) for edge in edges))
+    skews = sorted(max(edge[index] for edge in edges) - min(edge[index] for edge in edges)
+                   for index in common)
+    return {"frames": len(skews),
+            "median_skew": skews[len(skews) // 2],
+            "p99_skew": skews[int(len(skews) * 0.99)],
+            "max_skew": skews[-1],
+            "clocks": [sync.summary() for sync, _, _ in followers]}
+
+if __name__ == '__main__':
+    RESULT = skew_demo()
+    print("frames {frames} skew median {0:.2f} ms p99 {1:.2f} ms max {2:.2f} ms".format(
+        RESULT["median_skew"] * 1000, RESULT["p99_skew"] * 1000, RESULT["max_skew"] * 1000,
+        **RESULT))
+    sys.exit()
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+""" systemd readiness and watchdog notification driven by worker thread heartbeats """
+
+# MIT License
+#
+# Copyright (c) 2019 Dave Wilson
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import json
+import socket
+import logging
+
+import metrics
+
+import timesource
+
+# seconds past its promised deadline before a heartbeat counts as stalled
+STALL_SECONDS = 5.0
+
+# seconds between checks when systemd has not set a watchdog interval
+CHECK_SECONDS = 5.0
+
+# seconds between lateness histogram reports
+REPORT_SECONDS = 600.0
+
+LOGGER = logging.getLogger(__name__)
+
+def sd_notify(state):
+    """ send a state string such as READY=1 to systemd; False when not run by systemd """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address[0] == '@':
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode('utf-8'))
+    except OSError as ex:
+        LOGGER.error('sd_notify %s failed: %s', state, ex)
+        return False
+    return True
+
+def watchdog_seconds():
+    """ WatchdogSec of the unit when it applies to this process, otherwise None """
+    usec = os.environ.get('WATCHDOG_USEC')
+    pid = os.environ.get('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1000000.0
+
+def systemd_ping():
+    """ tell systemd every thread is alive """
+    sd_notify("WATCHDOG=1")
+
+class Heartbeat:
+    """ a worker thread promising to beat again within a number of seconds
+
+        Each beat records how late it was against the previous promise. A
+        promise of None means the thread is blocked on an external event and
+        cannot stall. Single writer, so beats take no lock. """
+
+    __slots__ = ('name', 'lateness', 'deadline', 'beats')
+
+    def __init__(self, name):
+        """ no promise yet """
+        self.name = name
+        self.lateness = metrics.LatenessHistogram(name)
+        self.deadline = None
+        self.beats = 0
+
+    def beat(self, within=None):
+        """ record this beat and promise the next within seconds, or None when idle """
+        now = timesource.monotonic()
+        deadline = self.deadline
+        if deadline is not None:
+            self.lateness.record(max(0.0, now - deadline))
+        self.deadline = None if within is None else now + within
+        self.beats += 1
+
+    def overdue(self, now):
+        """ seconds past the promised deadline, 0 when on time or idle """
+        deadline = self.deadline
+        if deadline is None:
+            return 0.0
+        return max(0.0, now - deadline)
+
+    def summary(self,):
+        """ dictionary suitable for logging or publishing as JSON """
+        summary = self.lateness.summary()
+        summary["beats"] = self.beats
+        return summary
+
+class CounterHeartbeat(Heartbeat):
+    """ heartbeat for work outside this process, beaten when a progress counter moves """
+
+    __slots__ = ('read', 'within', 'last')
+
+    def __init__(self, name, read, within):
+        """ read() returns a counter that changes at least every within seconds """
+        Heartbeat.__init__(self, name)
+        self.read = read
+        self.within = within
+        self.last = None
+
+    def poll(self,):
+        """ beat if the counter moved since the last poll """
+        value = self.read()
+        if value != self.last:
+            self.last = value
+            self.beat(self.within)
+
+class Watchdog:
+    """ ping the watchdog only while every heartbeat keeps its promise
+
+        A stalled thread stops the pings and systemd restarts the service
+        after WatchdogSec. Lateness histograms are published periodically so
+        creeping latency shows up before that happens. """
+
+    def __init__(self, publish=None, ping=systemd_ping):
+        """ publish receives a JSON summary; ping is called while healthy """
+        self.publish = publish
+        self.ping = ping
+        self.heartbeats = []
+        self.reports = {}
+        interval = watchdog_seconds()
+        self.check_seconds = interval / 2.0 if interval else CHECK_SECONDS
+        self.stalled = set()
+        self.thread = None
+
+    def watch(self, heartbeat):
+        """ include a heartbeat in the health check """
+        self.heartbeats.append(heartbeat)
+        return heartbeat
+
+    def heartbeat(self, name):
+        """ create and watch a heartbeat """
+        return self.watch(Heartbeat(name))
+
+    def watch_counter(self, name, read, within):
+        """ watch a progress counter, e.g. from another process """
+        return self.watch(CounterHeartbeat(name, read, within))
+
+    def add_report(self, name, summary):
+        """ include summary(), e.g. render governor decisions, in the periodic report """
+        self.reports[name] = summary
+
+    def check(self,):
+        """ ping when healthy, otherwise log which heartbeats stalled; True when healthy """
+        now = timesource.monotonic()
+        stalled = set()
+        for heartbeat in self.heartbeats:
+            if isinstance(heartbeat, CounterHeartbeat):
+                heartbeat.poll()
+            if heartbeat.overdue(now) > STALL_SECONDS:
+                stalled.add(heartbeat.name)
+        if stalled - self.stalled:
+            LOGGER.error('Watchdog: stalled %s', ", ".join(sorted(stalled)))
+            sd_notify("STATUS=stalled " + ", ".join(sorted(stalled)))
+        elif self.stalled and not stalled:
+            LOGGER.info('Watchdog: all heartbeats recovered')
+            sd_notify("STATUS=running")
+        self.stalled = stalled
+        if not stalled:
+            self.ping()
+        return not stalled
+
+    def summary(self,):
+        """ lateness of every heartbeat and every added report """
+        summary = {heartbeat.name: heartbeat.summary() for heartbeat in self.heartbeats}
+        for name, report in self.reports.items():
+            summary[name] = report()
+        return summary
+
+    def report(self,):
+        """ publish the lateness histograms, or log them when there is nowhere to publish """
+        summary = json.dumps(self.summary())
+        if self.publish is None:
+            LOGGER.info('heartbeat lateness %s', summary)
+        else:
+            self.publish(summary)
+
+    def watch_thread(self,):
+        """ check every half watchdog interval and report every REPORT_SECONDS """
+        reported = timesource.monotonic()
+        while True:
+            timesource.sleep(self.check_seconds)
+            self.check()
+            if timesource.monotonic() - reported >= REPORT_SECONDS:
+                reported = timesource.monotonic()
+                self.report()
+
+    def start(self,):
+        """ start checking without telling systemd, e.g. in a child process """
+        self.thread = timesource.spawn(self.watch_thread)
+
+    def ready(self,):
+        """ startup is complete: tell systemd and start checking """
+        sd_notify("READY=1")
+        self.start()
+
+if __name__ == '__main__':
+    sys.exit()